@@ -0,0 +1,87 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Latency of repeated questions without vs. with the two-level answer cache, and
+invalidation of cached answers by re-ingestion & deletion, against local fakes.
+
+Usage: python -m benchmarks.answer_cache_benchmark [--questions 5] [--repeats 4]
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import time
+
+from benchmarks.fakes import FakeFirestoreClient, fake_gcp_backend, fake_page_text
+from rsc.DeletionSession import DeletionSession
+from rsc.IngestionSession import IngestionSession
+from rsc.SearchQuerySession import SearchQuerySession
+
+
+def ask(query_session: SearchQuerySession, questions: list) -> list:
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            query_session(client_query=question)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run(questions: int, repeats: int) -> None:
+    document = "\n\n".join(fake_page_text(page) for page in range(10))
+
+    with fake_gcp_backend():
+        with contextlib.redirect_stdout(io.StringIO()):
+            ingestion = IngestionSession()
+            ingestion(new_file_name="benchmark-part1.json", file_to_ingest=document.encode(), ingest_json=True)
+            query_session = SearchQuerySession(model_name="gemini-1.5-flash")
+        answer_cache = query_session.answer_cache
+
+        # ask the content of stored chunks, so every question has a match
+        chunks = sorted(FakeFirestoreClient.store[query_session.firestore_collection_name].values(), key=lambda doc: doc["id"])
+        asked = [chunk["page_content"] for chunk in chunks[:questions]]
+        # repeats differ in case & surrounding whitespace only
+        repeated = [question.upper() + "  " if repeat % 2 else question for repeat in range(repeats) for question in asked]
+
+        query_session.answer_cache = None
+        uncached = ask(query_session, repeated)
+        query_session.answer_cache = answer_cache
+        cached = ask(query_session, repeated)
+
+        print(f"Questions: {questions} x {repeats}")
+        print(f"Uncached  median {statistics.median(uncached) * 1000:7.1f}ms  mean {statistics.mean(uncached) * 1000:7.1f}ms")
+        print(f"Cached    median {statistics.median(cached) * 1000:7.1f}ms  mean {statistics.mean(cached) * 1000:7.1f}ms")
+        stats = answer_cache.stats()
+        print(f"Hit rate  embeddings {stats['embedding_hit_rate']:.0%}  answers {stats['answer_hit_rate']:.0%}")
+
+        # editing the first page changes the chunks the first answers were built from
+        with contextlib.redirect_stdout(io.StringIO()):
+            ingestion(new_file_name="benchmark-part1.json", file_to_ingest=("EDITED " + document).encode(), ingest_json=True)
+        reingest_invalidations = answer_cache.stats()["invalidations"]
+        print(f"Invalidated by re-ingestion: {reingest_invalidations}")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            DeletionSession()(document_name="benchmark-part1")
+        print(f"Invalidated by deletion:     {answer_cache.stats()['invalidations'] - reingest_invalidations}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=4)
+    args = parser.parse_args()
+    run(args.questions, args.repeats)
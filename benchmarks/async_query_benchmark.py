@@ -0,0 +1,78 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Concurrent query throughput of one process: synchronous SearchQuerySession calls
+vs. SearchQuerySession.aquery on one event loop, against local fakes.
+
+Usage: python -m benchmarks.async_query_benchmark [--queries 64] [--concurrency 1 8 32]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+from benchmarks.fakes import fake_gcp_backend, fake_page_text
+from rsc.IngestionSession import IngestionSession
+from rsc.SearchQuerySession import SearchQuerySession
+
+
+async def run_async(query_session: SearchQuerySession, questions: list, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def ask(question):
+        async with semaphore:
+            await query_session.aquery(client_query=question)
+
+    await asyncio.gather(*(ask(question) for question in questions))
+
+
+def run(queries: int, concurrency_levels: list, model_name: str) -> None:
+    with fake_gcp_backend():
+        with contextlib.redirect_stdout(io.StringIO()):
+            ingestion = IngestionSession()
+            ingestion(new_file_name="benchmark.json", file_to_ingest="\n\n".join(fake_page_text(page) for page in range(10)).encode(), ingest_json=True)
+            query_session = SearchQuerySession(model_name=model_name)
+            query_session.answer_cache = None
+            # warm up, so client setup is not measured
+            query_session(client_query="warm up")
+            asyncio.run(query_session.aquery(client_query="warm up"))
+
+        print(f"Queries: {queries}  Model: {model_name}")
+        questions = [fake_page_text(page)[:200] for page in range(queries)]
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for question in questions:
+                query_session(client_query=question)
+        seconds = time.perf_counter() - start
+        print(f"sync             {queries / seconds:7.1f} QPS")
+
+        for concurrency in concurrency_levels:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                asyncio.run(run_async(query_session, questions, concurrency))
+            seconds = time.perf_counter() - start
+            print(f"async x{concurrency:<3d}       {queries / seconds:7.1f} QPS")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--model", default="gemini-1.5-flash")
+    args = parser.parse_args()
+    run(args.queries, args.concurrency, args.model)
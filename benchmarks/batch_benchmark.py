@@ -0,0 +1,78 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Wall-clock time of answering many questions with SearchQuerySession.__call__ in
+a loop vs. SearchQuerySession.batch, against local fakes.
+
+Usage: python -m benchmarks.batch_benchmark [--questions 100] [--concurrency 1 8 32]
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import time
+
+from benchmarks.fakes import FakeFirestoreClient, FakeTextEmbeddingModel, fake_gcp_backend, fake_page_text
+from rsc.IngestionSession import IngestionSession
+from rsc.SearchQuerySession import SearchQuerySession
+
+
+def run(questions: int, concurrencies: list) -> None:
+    document = "\n\n".join(fake_page_text(page) for page in range(40))
+
+    with fake_gcp_backend():
+        with contextlib.redirect_stdout(io.StringIO()):
+            IngestionSession()(new_file_name="benchmark-part1.json", file_to_ingest=document.encode(), ingest_json=True)
+            query_session = SearchQuerySession(model_name="gemini-1.5-flash")
+        query_session.answer_cache = None
+
+        chunks = sorted(FakeFirestoreClient.store[query_session.firestore_collection_name].values(), key=lambda doc: doc["id"])
+        print(f"Questions: {questions}")
+
+        def asked(run_name):
+            # distinct texts per run, so no run is served from the embedding cache
+            return [chunks[idx % len(chunks)]["page_content"] + f" (question {idx}, {run_name})" for idx in range(questions)]
+
+        FakeTextEmbeddingModel.reset_counters()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for question in asked("loop"):
+                query_session(client_query=question)
+        loop_seconds = time.perf_counter() - start
+        print(f"Loop          {loop_seconds:7.2f}s  {questions / loop_seconds:6.1f} questions/s  "
+              f"embedding requests {FakeTextEmbeddingModel.request_count}")
+
+        for concurrency in concurrencies:
+            FakeTextEmbeddingModel.reset_counters()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = query_session.batch(asked(f"batch {concurrency}"), llm_concurrency=concurrency)
+            batch_seconds = time.perf_counter() - start
+            retrieval = statistics.median(
+                sum(seconds for stage, seconds in result["timings"].items() if stage not in ("llm", "total")) for result in results
+            )
+            print(f"Batch x{concurrency:<3d}    {batch_seconds:7.2f}s  {questions / batch_seconds:6.1f} questions/s  "
+                  f"embedding requests {FakeTextEmbeddingModel.request_count}  retrieval {retrieval * 1000:.0f}ms  "
+                  f"llm median {statistics.median(result['timings']['llm'] for result in results) * 1000:.0f}ms  "
+                  f"failed {sum(result['error'] is not None for result in results)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+    run(args.questions, args.concurrency)
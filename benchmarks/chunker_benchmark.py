@@ -0,0 +1,81 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Throughput & output of the native TextChunker vs. langchain's
+RecursiveCharacterTextSplitter on a corpus of sample texts.
+
+Usage: python -m benchmarks.chunker_benchmark [--documents 200] [--corpus-dir DIR]
+"""
+
+import argparse
+import glob
+import os
+import random
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from benchmarks.fakes import fake_page_text
+from rsc.TextChunker import DEFAULT_SEPARATORS, TextChunker
+
+
+def sample_corpus(documents: int) -> list:
+    rng = random.Random(0)
+    texts = []
+    for doc in range(documents):
+        text = "\n".join(fake_page_text(f"{doc}-{page}") for page in range(rng.randint(1, 30)))
+        if doc % 10 == 0:
+            text = text.replace(" ", "")  # no word boundaries, e.g. OCR noise
+        texts.append(text)
+    return texts
+
+
+def load_corpus(corpus_dir: str) -> list:
+    texts = []
+    for file_path in sorted(glob.glob(os.path.join(corpus_dir, "**", "*.txt"), recursive=True)):
+        with open(file_path, encoding="utf-8", errors="ignore") as f:
+            texts.append(f.read())
+    return texts
+
+
+def run(texts: list, chunk_size: int, chunk_overlap: int) -> None:
+    total_chars = sum(len(text) for text in texts)
+
+    start = time.perf_counter()
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=DEFAULT_SEPARATORS)
+    langchain_chunks = [[doc.page_content for doc in text_splitter.create_documents([text])] for text in texts]
+    langchain_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    native_chunks = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_texts(texts)
+    native_seconds = time.perf_counter() - start
+
+    mismatches = sum(1 for a, b in zip(langchain_chunks, native_chunks) if a != b)
+
+    print(f"Documents: {len(texts)}, characters: {total_chars}, chunk_size {chunk_size}, chunk_overlap {chunk_overlap}")
+    print(f"langchain: {total_chars / langchain_seconds / 2**20:7.2f} MiB/s  ({sum(map(len, langchain_chunks))} chunks)")
+    print(f"native:    {total_chars / native_seconds / 2**20:7.2f} MiB/s  ({sum(map(len, native_chunks))} chunks)")
+    print(f"Speedup: {langchain_seconds / native_seconds:.1f}x, documents with different chunks: {mismatches}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--corpus-dir", default=None, help="directory of .txt files to use instead of generated texts")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    args = parser.parse_args()
+    texts = load_corpus(args.corpus_dir) if args.corpus_dir else sample_corpus(args.documents)
+    run(texts, args.chunk_size, args.chunk_overlap)
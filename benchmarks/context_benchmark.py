@@ -0,0 +1,96 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Prompt size & answer latency of joining every retrieved chunk (as before) vs.
+token-budgeted context packing with adjacent chunk merging & overlap removal,
+against local fakes whose LLM latency grows with the prompt size.
+
+Usage: python -m benchmarks.context_benchmark [--pages 40] [--questions 10] [--chunk-overlap 200] [--budget 1500]
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import time
+
+from benchmarks.fakes import fake_gcp_backend, fake_page_text
+from rsc.ContextBuilder import ContextBuilder, estimate_tokens
+from rsc.IngestionSession import IngestionSession
+from rsc.SearchQuerySession import SearchQuerySession
+
+
+class JoinAllChunks(ContextBuilder):
+    # the previous behaviour: every retrieved chunk joined with spaces, no budget
+    def build(self, chunks: list) -> tuple:
+        content = " ".join(chunk["page_content"] for chunk in chunks)
+        tokens = estimate_tokens(content)
+        stats = {"token_budget": None, "chunks_retrieved": len(chunks), "chunks_used": len(chunks), "chunks_merged": 0,
+                 "naive_tokens": tokens, "context_tokens": tokens, "tokens_saved": 0, "truncated": False}
+        return content, chunks, stats
+
+
+def ask(query_session: SearchQuerySession, questions: list) -> tuple:
+    latencies = []
+    stats = []
+    for question in questions:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            context = query_session._retrieve_context(question)
+            query_session._llm_session(question, context).llm_prediction()
+        latencies.append(time.perf_counter() - start)
+        stats.append(context["context_stats"])
+    return latencies, stats
+
+
+def run(pages: int, questions: int, chunk_overlap: int, budget: int) -> None:
+    # every page is about one error code, so its chunks are retrieved together
+    codes = [f"ERR-{4000 + page}" for page in range(pages)]
+    texts = []
+    for page, code in enumerate(codes):
+        sentences = fake_page_text(page).replace("\n\n", " ").split(". ")
+        texts.append(". ".join(f"{sentence} {code}" if idx % 3 == 0 else sentence for idx, sentence in enumerate(sentences)))
+    document = "\n\n".join(texts)
+    asked = [f"What causes {code} on the network device?" for code in codes[:questions]]
+
+    with fake_gcp_backend({"VECTOR_SEARCH_BACKEND": "local", "RETRIEVAL_MODE": "hybrid"}):
+        with contextlib.redirect_stdout(io.StringIO()):
+            IngestionSession(chunk_overlap=chunk_overlap)(new_file_name="benchmark-part1.json", file_to_ingest=document.encode(), ingest_json=True)
+            query_session = SearchQuerySession(model_name="gemini-1.5-flash")
+        query_session.answer_cache = None
+        print(f"Pages: {pages}  Questions: {questions}  Chunk overlap: {chunk_overlap}")
+
+        builders = {
+            "join all": JoinAllChunks(),
+            "packed, model budget": query_session.context_builder,
+            f"packed, budget {budget}": ContextBuilder(token_budget=budget),
+        }
+        for name, builder in builders.items():
+            query_session.context_builder = builder
+            latencies, stats = ask(query_session, asked)
+            print(f"{name:22s} prompt context {statistics.mean(s['context_tokens'] for s in stats):7.0f} tokens  "
+                  f"chunks {statistics.mean(s['chunks_used'] for s in stats):4.1f} used {statistics.mean(s['chunks_merged'] for s in stats):4.1f} merged  "
+                  f"saved {statistics.mean(s['naive_tokens'] - s['context_tokens'] for s in stats):6.0f} tokens  "
+                  f"answer median {statistics.median(latencies) * 1000:6.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--budget", type=int, default=1500)
+    args = parser.parse_args()
+    run(args.pages, args.questions, args.chunk_overlap, args.budget)
@@ -0,0 +1,87 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Chunks/sec of per-chunk vs. batched vs. cached embedding against a local fake
+endpoint.
+
+Usage: python -m benchmarks.embedding_benchmark [--chunks 300]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.fakes import fake_embedding_backend, FakeTextEmbeddingModel
+from rsc.EmbeddingCache import EmbeddingCache
+from rsc.EmbeddingSession import EmbeddingSession
+
+
+def sample_chunks(count: int, chunk_size: int = 1000) -> list:
+    return [(f"chunk {idx} " * chunk_size)[:chunk_size] for idx in range(count)]
+
+
+def embed_per_chunk(session: EmbeddingSession, texts: list) -> list:
+    # previous behaviour: one model lookup and one request per chunk
+    embeddings = []
+    for text in texts:
+        model = FakeTextEmbeddingModel.from_pretrained(session.model_name)
+        embeddings.append(model.get_embeddings([text])[0].values)
+    return embeddings
+
+
+def run(chunks: int) -> None:
+    texts = sample_chunks(chunks)
+
+    with fake_embedding_backend() as model_cls:
+        session = EmbeddingSession(use_cache=False)
+
+        start = time.perf_counter()
+        before = embed_per_chunk(session, texts)
+        before_seconds = time.perf_counter() - start
+        before_requests = model_cls.request_count
+
+        model_cls.reset_counters()
+        start = time.perf_counter()
+        after = session.get_vertex_embeddings(texts)
+        after_seconds = time.perf_counter() - start
+        after_requests = model_cls.request_count
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            session.cache = EmbeddingCache(path=os.path.join(tmp_dir, "embeddings.sqlite"))
+            session.get_vertex_embeddings(texts)  # populate the cache
+
+            model_cls.reset_counters()
+            start = time.perf_counter()
+            session.get_vertex_embeddings(texts)
+            cached_seconds = time.perf_counter() - start
+            cached_requests = model_cls.request_count
+            cache_stats = session.cache.stats()
+
+    assert before == after, "batched embeddings differ from per-chunk embeddings"
+
+    print(f"Chunks: {chunks}")
+    print(f"Before: {chunks / before_seconds:9.1f} chunks/sec ({before_requests} requests)")
+    print(f"After:  {chunks / after_seconds:9.1f} chunks/sec ({after_requests} requests)")
+    print(f"Cached: {chunks / cached_seconds:9.1f} chunks/sec ({cached_requests} requests)")
+    print(f"Speedup: {before_seconds / after_seconds:.1f}x batched, {before_seconds / cached_seconds:.1f}x cached")
+    print(f"Embedding cache: {cache_stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=300)
+    args = parser.parse_args()
+    run(args.chunks)
@@ -0,0 +1,735 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local stand-ins for the GCP & model clients used by the rsc sessions, so the
+sessions can be benchmarked without network access or credentials.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import itertools
+import os
+import random
+import tempfile
+import threading
+import time
+from io import BytesIO
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+import PyPDF2
+from google.api_core import exceptions
+from google.cloud import aiplatform_v1
+
+from rsc import ClientRegistry
+
+EMBEDDING_DIMENSIONS = 768
+
+# simulated round trip latencies in seconds, per client operation
+LATENCIES = {
+    "gcs_upload": 0.05,
+    "gcs_delete": 0.02,
+    "documentai_request": 0.2,
+    "documentai_page": 0.02,
+    "firestore_write": 0.01,
+    "firestore_read": 0.01,
+    "firestore_commit": 0.03,
+    "firestore_query": 0.02,
+    "vector_upsert": 0.1,
+    "vector_upsert_datapoint": 0.0005,
+    "vector_remove": 0.05,
+    "vector_query": 0.03,
+    "auth": 0.05,
+    "client_init": 0.1,
+    "llm_request": 0.2,  # until the first token
+    "llm_prompt_token": 0.00002,  # prompt processing, per prompt token
+    "llm_chunk": 0.02,  # per streamed chunk
+}
+
+# streamed answer chunks per fake LLM call
+LLM_ANSWER_CHUNKS = 10
+
+WORDS = (
+    "brand name origin product company market founder logo trade history "
+    "customer engine vector search index document chunk error code manual "
+    "service quality support release version update install device network"
+).split()
+
+
+# injected tail latency per operation: (probability, latency multiplier) of a slow call
+TAIL_LATENCIES = {}
+# latency distribution per operation ("*" for all): sigma of a log-normal spread around the LATENCIES value
+LATENCY_SIGMAS = {}
+# injected failure probability per operation, raised as a retryable ServiceUnavailable
+ERROR_RATES = {}
+_tail_rng = random.Random(0)
+_rng_lock = threading.Lock()
+
+
+def scaled_latency(operation: str, latency: float) -> float:
+    # latency drawn from the operation's distribution & tail
+    sigma = LATENCY_SIGMAS.get(operation, LATENCY_SIGMAS.get("*", 0.0))
+    probability, multiplier = TAIL_LATENCIES.get(operation, (0.0, 1.0))
+    with _rng_lock:
+        if sigma:
+            latency *= _tail_rng.lognormvariate(0.0, sigma)
+        if probability and _tail_rng.random() < probability:
+            latency *= multiplier
+    return latency
+
+
+def operation_latency(operation: str) -> float:
+    return scaled_latency(operation, LATENCIES[operation])
+
+
+def maybe_fail(operation: str) -> None:
+    rate = ERROR_RATES.get(operation, 0.0)
+    with _rng_lock:
+        failed = rate and _tail_rng.random() < rate
+    if failed:
+        raise exceptions.ServiceUnavailable(f"injected {operation} failure")
+    return None
+
+
+def simulate_latency(operation: str, count: int = 1, timeout: float = None) -> None:
+    # a failed call still costs its round trip; calls slower than timeout end with DeadlineExceeded
+    latency = operation_latency(operation) * count
+    if timeout is not None and latency > timeout:
+        time.sleep(timeout)
+        raise exceptions.DeadlineExceeded(f"{operation} exceeded its {timeout:.3f}s timeout")
+    time.sleep(latency)
+    maybe_fail(operation)
+
+
+async def asimulate_latency(operation: str, count: int = 1, timeout: float = None) -> None:
+    latency = operation_latency(operation) * count
+    if timeout is not None and latency > timeout:
+        await asyncio.sleep(timeout)
+        raise exceptions.DeadlineExceeded(f"{operation} exceeded its {timeout:.3f}s timeout")
+    await asyncio.sleep(latency)
+    maybe_fail(operation)
+
+
+@contextlib.contextmanager
+def inject_tail_latency(tail_latencies: dict, seed: int = 0):
+    """
+    Make a fraction of the calls of the given operations slow, e.g.
+    {"vector_query": (0.05, 20)} makes 5% of the vector queries 20x slower.
+    """
+    _tail_rng.seed(seed)
+    TAIL_LATENCIES.update(tail_latencies)
+    try:
+        yield
+    finally:
+        TAIL_LATENCIES.clear()
+
+
+@contextlib.contextmanager
+def fake_service_profile(latency_sigmas: dict = None, error_rates: dict = None, seed: int = 0):
+    """
+    Draw the fake latencies from log-normal distributions & make calls fail at the
+    given rates, e.g. latency_sigmas={"*": 0.3}, error_rates={"firestore_commit": 0.01}.
+    """
+    _tail_rng.seed(seed)
+    LATENCY_SIGMAS.update(latency_sigmas or {})
+    ERROR_RATES.update(error_rates or {})
+    try:
+        yield
+    finally:
+        LATENCY_SIGMAS.clear()
+        ERROR_RATES.clear()
+
+
+def fake_vector(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> list:
+    # deterministic pseudo embedding derived from the text
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    return [rng.uniform(-1.0, 1.0) for _ in range(dimensions)]
+
+
+def fake_load_credentials_from_file(filename, **kwargs) -> tuple:
+    simulate_latency("auth")
+    return None, "fake-project"
+
+
+class FakeTextEmbedding:
+    def __init__(self, values: list):
+        self.values = values
+
+
+class FakeTextEmbeddingModel:
+    """
+    Mimics vertexai.language_models.TextEmbeddingModel with simulated latency.
+    """
+
+    load_latency = 0.05  # seconds per from_pretrained() call
+    request_latency = 0.02  # seconds per get_embeddings() round trip
+    per_text_latency = 0.0005  # seconds of server time per embedded text
+
+    load_count = 0
+    request_count = 0
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    @classmethod
+    def from_pretrained(cls, model_name: str):
+        time.sleep(cls.load_latency)
+        cls.load_count += 1
+        return cls(model_name)
+
+    @classmethod
+    def reset_counters(cls) -> None:
+        cls.load_count = 0
+        cls.request_count = 0
+
+    def get_embeddings(self, texts: list, **kwargs) -> list:
+        time.sleep(scaled_latency("embedding_request", self.request_latency + self.per_text_latency * len(texts)))
+        maybe_fail("embedding_request")
+        type(self).request_count += 1
+        return [FakeTextEmbedding(fake_vector(getattr(t, "text", t))) for t in texts]
+
+    async def get_embeddings_async(self, texts: list, **kwargs) -> list:
+        await asyncio.sleep(scaled_latency("embedding_request", self.request_latency + self.per_text_latency * len(texts)))
+        maybe_fail("embedding_request")
+        type(self).request_count += 1
+        return [FakeTextEmbedding(fake_vector(getattr(t, "text", t))) for t in texts]
+
+
+def fake_page_text(seed, chars: int = 1800) -> str:
+    # deterministic prose-like page text with sentences & paragraphs
+    rng = random.Random(seed)
+    sentences = []
+    length = 0
+    while length < chars:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18)))
+        sentence = sentence.capitalize() + rng.choice([".", ".", ".", "!", "?"])
+        if rng.random() < 0.15:
+            sentence += "\n\n"
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return " ".join(sentences)
+
+
+class FakeBlob:
+    def __init__(self, bucket, name: str):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_file(self, file_obj) -> None:
+        simulate_latency("gcs_upload")
+        FakeStorageClient.blobs[(self.bucket.name, self.name)] = file_obj.read()
+
+    def upload_from_filename(self, filename: str) -> None:
+        with open(filename, "rb") as f:
+            self.upload_from_file(f)
+
+    def delete(self) -> None:
+        simulate_latency("gcs_delete")
+        FakeStorageClient.blobs.pop((self.bucket.name, self.name), None)
+
+    def generate_signed_url(self, expiration=None) -> str:
+        return f"https://storage.example.com/{self.bucket.name}/{self.name}"
+
+
+class FakeBucket:
+    def __init__(self, name: str):
+        self.name = name
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def list_blobs(self) -> list:
+        return [FakeBlob(self, name) for bucket, name in list(FakeStorageClient.blobs) if bucket == self.name]
+
+
+class FakeStorageClient:
+    """
+    Mimics google.cloud.storage.Client with an in-memory object store.
+    """
+
+    blobs = {}
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def bucket(self, name: str) -> FakeBucket:
+        return FakeBucket(name)
+
+
+class FakeDocumentProcessorServiceClient:
+    """
+    Mimics documentai.DocumentProcessorServiceClient, returning synthetic page text.
+    """
+
+    _calls = itertools.count()
+    pages_processed = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def processor_version_path(self, project, location, processor, processor_version) -> str:
+        return f"projects/{project}/locations/{location}/processors/{processor}/processorVersions/{processor_version}"
+
+    def process_document(self, request):
+        pages = len(PyPDF2.PdfReader(BytesIO(request.raw_document.content)).pages)
+        simulate_latency("documentai_request")
+        simulate_latency("documentai_page", pages)
+        FakeDocumentProcessorServiceClient.pages_processed += pages
+        call = next(self._calls)
+        text = "\n".join(fake_page_text(f"{call}-{page}") for page in range(pages))
+        return SimpleNamespace(document=SimpleNamespace(text=text))
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, doc_id: str, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+        self.reference = None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field_path: str):
+        return self._data[field_path]
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, doc_id: str):
+        self.collection = collection
+        self.id = doc_id
+
+    def set(self, data: dict) -> None:
+        simulate_latency("firestore_write")
+        self.collection._write(self.id, data)
+
+    def get(self, field_paths=None, **kwargs) -> FakeDocumentSnapshot:
+        simulate_latency("firestore_read")
+        return self.collection._read(self.id, field_paths)
+
+    def delete(self) -> None:
+        simulate_latency("firestore_write")
+        self.collection._delete(self.id)
+
+
+class FakeQuery:
+    OPERATORS = {
+        "==": lambda a, b: a == b,
+        ">=": lambda a, b: a >= b,
+        ">": lambda a, b: a > b,
+        "<=": lambda a, b: a <= b,
+        "<": lambda a, b: a < b,
+        "in": lambda a, b: a in b,
+    }
+
+    def __init__(self, collection, filters=(), projection=None):
+        self.collection = collection
+        self.filters = list(filters)
+        self.projection = projection
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return FakeQuery(self.collection, self.filters + [(field_path, op_string, value)], self.projection)
+
+    def select(self, field_paths):
+        return FakeQuery(self.collection, self.filters, list(field_paths))
+
+    def stream(self, **kwargs):
+        simulate_latency("firestore_query")
+        with FakeFirestoreClient.lock:
+            docs = list(self.collection.docs.items())
+        for doc_id, data in sorted(docs):
+            if all(
+                field in data and self.OPERATORS[op](data[field], value)
+                for field, op, value in self.filters
+            ):
+                if self.projection is not None:
+                    data = {field: data[field] for field in self.projection if field in data}
+                yield FakeDocumentSnapshot(doc_id, data)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, name: str):
+        super().__init__(self)
+        self.name = name
+        with FakeFirestoreClient.lock:
+            self.docs = FakeFirestoreClient.store.setdefault(name, {})
+
+    def document(self, doc_id: str) -> FakeDocumentReference:
+        return FakeDocumentReference(self, doc_id)
+
+    def _write(self, doc_id: str, data: dict) -> None:
+        with FakeFirestoreClient.lock:
+            self.docs[doc_id] = dict(data)
+
+    def _update(self, doc_id: str, data: dict) -> None:
+        with FakeFirestoreClient.lock:
+            if doc_id not in self.docs:
+                raise exceptions.NotFound(f"No document to update: {doc_id}")
+            self.docs[doc_id].update(data)
+
+    def _delete(self, doc_id: str) -> None:
+        with FakeFirestoreClient.lock:
+            self.docs.pop(doc_id, None)
+
+    def _read(self, doc_id: str, field_paths=None) -> FakeDocumentSnapshot:
+        with FakeFirestoreClient.lock:
+            data = self.docs.get(doc_id)
+        if data is not None and field_paths is not None:
+            data = {field: data[field] for field in field_paths if field in data}
+        return FakeDocumentSnapshot(doc_id, data)
+
+
+class FakeWriteBatch:
+    MAX_OPERATIONS = 500
+
+    def __init__(self):
+        self.operations = []
+
+    def set(self, reference: FakeDocumentReference, data: dict, **kwargs) -> None:
+        self.operations.append(("set", reference, data))
+
+    def update(self, reference: FakeDocumentReference, data: dict, **kwargs) -> None:
+        self.operations.append(("update", reference, data))
+
+    def delete(self, reference: FakeDocumentReference, **kwargs) -> None:
+        self.operations.append(("delete", reference, None))
+
+    def commit(self, **kwargs) -> list:
+        if len(self.operations) > self.MAX_OPERATIONS:
+            raise ValueError(f"maximum {self.MAX_OPERATIONS} writes allowed per request")
+        simulate_latency("firestore_commit")
+        for operation, reference, data in self.operations:
+            if operation == "set":
+                reference.collection._write(reference.id, data)
+            elif operation == "update":
+                reference.collection._update(reference.id, data)
+            else:
+                reference.collection._delete(reference.id)
+        return [None] * len(self.operations)
+
+
+class FakeFirestoreClient:
+    """
+    Mimics google.cloud.firestore.Client with an in-memory document store.
+    """
+
+    store = {}
+    lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(name)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch()
+
+    def get_all(self, references, field_paths=None, timeout=None, **kwargs):
+        simulate_latency("firestore_read", timeout=timeout)
+        for reference in references:
+            yield reference.collection._read(reference.id, field_paths)
+
+
+class FakeAsyncFirestoreClient(FakeFirestoreClient):
+    """
+    Mimics google.cloud.firestore.AsyncClient reads on the same in-memory store.
+    """
+
+    async def get_all(self, references, field_paths=None, timeout=None, **kwargs):
+        await asimulate_latency("firestore_read", timeout=timeout)
+        for reference in references:
+            yield reference.collection._read(reference.id, field_paths)
+
+
+class FakeIndexServiceClient:
+    """
+    Mimics aiplatform_v1.IndexServiceClient streaming updates.
+    """
+
+    datapoints = {}
+    lock = threading.Lock()
+    first_upsert_time = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def upsert_datapoints(self, request) -> None:
+        simulate_latency("vector_upsert")
+        request = aiplatform_v1.UpsertDatapointsRequest.pb(request)
+        simulate_latency("vector_upsert_datapoint", len(request.datapoints))
+        with self.lock:
+            if FakeIndexServiceClient.first_upsert_time is None:
+                FakeIndexServiceClient.first_upsert_time = time.time()
+            for datapoint in request.datapoints:
+                self.datapoints[datapoint.datapoint_id] = list(datapoint.feature_vector)
+
+    def remove_datapoints(self, request) -> None:
+        simulate_latency("vector_remove")
+        with self.lock:
+            for datapoint_id in request.datapoint_ids:
+                self.datapoints.pop(datapoint_id, None)
+
+
+class FakeMatchingEngineIndexEndpoint:
+    """
+    Mimics aiplatform.MatchingEngineIndexEndpoint, which only resolves the public endpoint domain.
+    """
+
+    init_count = 0
+    public_endpoint_domain_name = "fake-index-endpoint.vdb.vertexai.goog"
+
+    def __init__(self, *args, **kwargs):
+        simulate_latency("client_init")
+        FakeMatchingEngineIndexEndpoint.init_count += 1
+
+
+class FakeMatchServiceClient:
+    """
+    Mimics aiplatform_v1.MatchServiceClient, querying the datapoints upserted
+    into FakeIndexServiceClient by cosine similarity.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def find_neighbors(self, request, timeout=None, **kwargs):
+        simulate_latency("vector_query", timeout=timeout)
+        with FakeIndexServiceClient.lock:
+            ids = list(FakeIndexServiceClient.datapoints)
+            vectors = np.array([FakeIndexServiceClient.datapoints[i] for i in ids], dtype=np.float32)
+        results = []
+        for query in request.queries:
+            if not ids:
+                results.append(SimpleNamespace(neighbors=[]))
+                continue
+            query_vec = np.asarray(list(query.datapoint.feature_vector), dtype=np.float32)
+            scores = vectors @ query_vec / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vec) + 1e-12)
+            top = np.argsort(-scores)[:query.neighbor_count]
+            results.append(SimpleNamespace(neighbors=[
+                SimpleNamespace(distance=float(scores[i]), datapoint=SimpleNamespace(
+                    datapoint_id=ids[i], feature_vector=vectors[i].tolist() if request.return_full_datapoint else [],
+                ))
+                for i in top
+            ]))
+        return SimpleNamespace(nearest_neighbors=results)
+
+
+def fake_prompt_tokens(contents) -> int:
+    # rough prompt size of a generate_content / messages request
+    return len(str(contents)) // 4
+
+
+def fake_answer_chunks(model_name: str, prompt_tokens: int = 0, timeout: float = None):
+    # simulated generation: latency until the first token, then one chunk at a time;
+    # the timeout bounds the whole generation, as a gRPC deadline does
+    expires_at = None if timeout is None else time.monotonic() + timeout
+    remaining = lambda: None if expires_at is None else max(expires_at - time.monotonic(), 0.0)
+    simulate_latency("llm_request", timeout=remaining())
+    simulate_latency("llm_prompt_token", prompt_tokens, timeout=remaining())
+    for index in range(LLM_ANSWER_CHUNKS):
+        if index:
+            simulate_latency("llm_chunk", timeout=remaining())
+        yield f"Answer from {model_name}, part {index}. "
+
+
+class FakePredictionServiceClient:
+    """
+    Mimics aiplatform_v1.PredictionServiceClient: embedding & text model predict
+    calls and Gemini generate_content / stream_generate_content, with simulated latency.
+    """
+
+    init_count = 0
+
+    def __init__(self, *args, **kwargs):
+        simulate_latency("client_init")
+        FakePredictionServiceClient.init_count += 1
+
+    def predict(self, endpoint: str, instances: list, parameters=None, timeout=None, **kwargs):
+        model_name = endpoint.split("/")[-1]
+        if instances and "prompt" in instances[0]:
+            text = "".join(fake_answer_chunks(model_name, fake_prompt_tokens(instances), timeout))
+            return SimpleNamespace(predictions=[{"content": text}])
+
+        # embedding model, with the latency of FakeTextEmbeddingModel
+        latency = scaled_latency("embedding_request", FakeTextEmbeddingModel.request_latency + FakeTextEmbeddingModel.per_text_latency * len(instances))
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise exceptions.DeadlineExceeded(f"embedding_request exceeded its {timeout:.3f}s timeout")
+        time.sleep(latency)
+        maybe_fail("embedding_request")
+        FakeTextEmbeddingModel.request_count += 1
+        return SimpleNamespace(predictions=[{"embeddings": {"values": fake_vector(instance["content"])}} for instance in instances])
+
+    @staticmethod
+    def _response(text: str):
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text)]))])
+
+    def generate_content(self, request, timeout=None, **kwargs):
+        chunks = fake_answer_chunks(request.model.split("/")[-1], fake_prompt_tokens(request.contents), timeout)
+        return self._response("".join(chunks))
+
+    def stream_generate_content(self, request, timeout=None, **kwargs):
+        for text in fake_answer_chunks(request.model.split("/")[-1], fake_prompt_tokens(request.contents), timeout):
+            yield self._response(text)
+
+
+class FakeGenerativeModel:
+    """
+    Mimics vertexai GenerativeModel.generate_content with simulated latency.
+    """
+
+    init_count = 0
+
+    def __init__(self, model_name: str, *args, **kwargs):
+        simulate_latency("client_init")
+        FakeGenerativeModel.init_count += 1
+        self.model_name = model_name
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        chunks = (SimpleNamespace(text=text) for text in fake_answer_chunks(self.model_name, fake_prompt_tokens(contents)))
+        if stream:
+            return chunks
+        return SimpleNamespace(text="".join(chunk.text for chunk in chunks))
+
+    async def generate_content_async(self, contents, generation_config=None, **kwargs):
+        return SimpleNamespace(text=await afake_answer_chunks(self.model_name, fake_prompt_tokens(contents)))
+
+
+async def afake_answer_chunks(model_name: str, prompt_tokens: int = 0) -> str:
+    await asimulate_latency("llm_request")
+    await asimulate_latency("llm_prompt_token", prompt_tokens)
+    await asimulate_latency("llm_chunk", LLM_ANSWER_CHUNKS - 1)
+    return "".join(f"Answer from {model_name}, part {index}. " for index in range(LLM_ANSWER_CHUNKS))
+
+
+class FakeMessageStream:
+    def __init__(self, model: str, prompt_tokens: int = 0, timeout: float = None):
+        self.text_stream = fake_answer_chunks(model, prompt_tokens, timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class FakeAnthropicVertex:
+    """
+    Mimics anthropic.AnthropicVertex messages.create & messages.stream with simulated latency.
+    """
+
+    def __init__(self, region: str, project_id: str):
+        simulate_latency("client_init")
+        self.messages = SimpleNamespace(create=self._create, stream=self._stream)
+
+    def _create(self, model: str, messages: list, timeout: float = None, **kwargs):
+        text = "".join(fake_answer_chunks(model, fake_prompt_tokens(messages), timeout))
+        return SimpleNamespace(content=[SimpleNamespace(text=text)])
+
+    def _stream(self, model: str, messages: list, timeout: float = None, **kwargs) -> FakeMessageStream:
+        return FakeMessageStream(model, fake_prompt_tokens(messages), timeout)
+
+
+class FakeAsyncAnthropicVertex:
+    """
+    Mimics anthropic.AsyncAnthropicVertex messages.create with simulated latency.
+    """
+
+    def __init__(self, region: str, project_id: str):
+        simulate_latency("client_init")
+        self.messages = SimpleNamespace(create=self._create)
+
+    async def _create(self, model: str, messages: list, **kwargs):
+        text = await afake_answer_chunks(model, fake_prompt_tokens(messages))
+        return SimpleNamespace(content=[SimpleNamespace(text=text)])
+
+
+def reset_fake_stores() -> None:
+    ClientRegistry.clear()
+    FakeStorageClient.blobs.clear()
+    FakeDocumentProcessorServiceClient.pages_processed = 0
+    FakeFirestoreClient.store.clear()
+    FakeIndexServiceClient.datapoints.clear()
+    FakeIndexServiceClient.first_upsert_time = None
+    FakeMatchingEngineIndexEndpoint.init_count = 0
+    FakePredictionServiceClient.init_count = 0
+    FakeGenerativeModel.init_count = 0
+
+
+@contextlib.contextmanager
+def fake_embedding_backend(secrets: dict = None):
+    """
+    Patch the Vertex AI auth, embedding model & prediction client used by rsc.EmbeddingSession.
+
+    The embedding & answer caches and the local vector & lexical indexes are redirected to
+    a temporary directory. secrets override .env values read through the client registry.
+    """
+    FakeTextEmbeddingModel.reset_counters()
+    ClientRegistry.clear()
+    dotenv_values = ClientRegistry.dotenv_values
+    with tempfile.TemporaryDirectory() as cache_dir, mock.patch(
+        "rsc.ClientRegistry.dotenv_values", lambda path: {**dotenv_values(path), **(secrets or {})}
+    ), mock.patch(
+        "google.auth.load_credentials_from_file", fake_load_credentials_from_file
+    ), mock.patch("vertexai.init"), mock.patch(
+        "rsc.EmbeddingSession.TextEmbeddingModel", FakeTextEmbeddingModel
+    ), mock.patch(
+        "google.cloud.aiplatform_v1.PredictionServiceClient", FakePredictionServiceClient
+    ), mock.patch(
+        "rsc.EmbeddingSession.DEFAULT_CACHE_PATH", os.path.join(cache_dir, "embeddings.sqlite")
+    ), mock.patch(
+        "rsc.AnswerCache.DEFAULT_ANSWER_CACHE_PATH", os.path.join(cache_dir, "answers.sqlite")
+    ), mock.patch(
+        "rsc.LocalVectorIndex.DEFAULT_LOCAL_INDEX_PATH", os.path.join(cache_dir, "vector_index")
+    ), mock.patch(
+        "rsc.IVFPQIndex.DEFAULT_IVFPQ_INDEX_PATH", os.path.join(cache_dir, "ivfpq_index")
+    ), mock.patch(
+        "rsc.LexicalIndex.DEFAULT_LEXICAL_INDEX_PATH", os.path.join(cache_dir, "lexical_index")
+    ):
+        yield FakeTextEmbeddingModel
+    # drop clients created against the fakes
+    ClientRegistry.clear()
+
+
+@contextlib.contextmanager
+def fake_gcp_backend(secrets: dict = None):
+    """
+    Patch all GCP clients used by the rsc sessions with in-memory fakes.
+    """
+    reset_fake_stores()
+    with fake_embedding_backend(secrets), mock.patch.dict(
+        "firebase_admin._apps", {"[DEFAULT]": object()}
+    ), mock.patch("google.cloud.storage.Client", FakeStorageClient), mock.patch(
+        "google.cloud.documentai.DocumentProcessorServiceClient", FakeDocumentProcessorServiceClient
+    ), mock.patch("google.cloud.firestore.Client", FakeFirestoreClient), mock.patch(
+        "firebase_admin.firestore.Client", FakeFirestoreClient
+    ), mock.patch(
+        "google.cloud.aiplatform_v1.IndexServiceClient", FakeIndexServiceClient
+    ), mock.patch("google.cloud.aiplatform_v1.MatchServiceClient", FakeMatchServiceClient), mock.patch(
+        "google.cloud.aiplatform.MatchingEngineIndexEndpoint", FakeMatchingEngineIndexEndpoint
+    ), mock.patch(
+        "vertexai.preview.generative_models.GenerativeModel", FakeGenerativeModel
+    ), mock.patch("anthropic.AnthropicVertex", FakeAnthropicVertex), mock.patch(
+        "anthropic.AsyncAnthropicVertex", FakeAsyncAnthropicVertex
+    ), mock.patch("google.cloud.firestore.AsyncClient", FakeAsyncFirestoreClient), mock.patch(
+        "firebase_admin.firestore.AsyncClient", FakeAsyncFirestoreClient
+    ):
+        yield
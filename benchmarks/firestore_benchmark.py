@@ -0,0 +1,89 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Firestore chunk write throughput of one set() per chunk vs. batched commits,
+bulk deletion of more than 500 chunks and fetching the matched chunks of a
+query, against a local fake Firestore.
+
+Usage: python -m benchmarks.firestore_benchmark [--chunks 2000]
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+from benchmarks.fakes import fake_gcp_backend, FakeFirestoreClient
+from rsc.FirestoreBulkWriter import FirestoreBulkWriter
+from rsc.SearchQuerySession import SearchQuerySession
+
+
+def sample_documents(count: int) -> dict:
+    return {
+        f"benchmark-part1-chunk{idx}": {
+            "id": f"benchmark-part1-chunk{idx}",
+            "document_name": "benchmark-part1.pdf",
+            "page_content": f"chunk {idx} " * 100,
+        }
+        for idx in range(count)
+    }
+
+
+def run(chunks: int) -> None:
+    documents = sample_documents(chunks)
+
+    with fake_gcp_backend():
+        client = FakeFirestoreClient()
+        collection = client.collection("chunks")
+
+        # previous behaviour: one blocking set() per chunk
+        start = time.perf_counter()
+        for doc_id, data in documents.items():
+            collection.document(doc_id).set(data)
+        before_seconds = time.perf_counter() - start
+
+        writer = FirestoreBulkWriter(client=client, collection_name="chunks")
+        write_stats = writer.set_documents(documents)
+
+        # fetching the top 10 matches of a query, one of them deleted meanwhile
+        matched_ids = list(documents)[:9] + ["benchmark-part1-deleted"]
+        start = time.perf_counter()
+        per_id_docs = [collection.document(doc_id).get().to_dict() for doc_id in matched_ids]
+        per_id_seconds = time.perf_counter() - start
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            query_session = SearchQuerySession(model_name="gemini-1.5-flash")
+        query_session.firestore_collection_name = "chunks"
+        start = time.perf_counter()
+        _, missing_ids = query_session._get_doc_from_firestore(matched_ids)
+        get_all_seconds = time.perf_counter() - start
+
+        delete_stats = writer.delete_documents(list(documents))
+
+    print(f"Chunks: {chunks}")
+    print(f"Before: {chunks / before_seconds:9.1f} writes/sec")
+    print(f"After:  {write_stats['ops_per_second']:9.1f} writes/sec "
+          f"({write_stats['batches']} batches, {write_stats['failed']} failed)")
+    print(f"Delete: {delete_stats['ops_per_second']:9.1f} deletes/sec "
+          f"({delete_stats['batches']} batches, {delete_stats['failed']} failed)")
+    print(f"Fetch {len(matched_ids)} matches: per id {per_id_seconds * 1000:6.1f}ms  "
+          f"get_all {get_all_seconds * 1000:6.1f}ms  (missing {missing_ids})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    args = parser.parse_args()
+    run(args.chunks)
@@ -0,0 +1,82 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Query latency percentiles without vs. with hedged requests, against local fakes
+that make a fraction of the vector search, Firestore & LLM calls much slower.
+
+Usage: python -m benchmarks.hedging_benchmark [--queries 150] [--warmup 40] [--deadline 5] [--tail-probability 0.02]
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from benchmarks.fakes import FakeFirestoreClient, fake_gcp_backend, fake_page_text, inject_tail_latency
+from rsc import ClientRegistry
+from rsc.IngestionSession import IngestionSession
+from rsc.SearchQuerySession import SearchQuerySession
+from rsc.hedging import DeadlineExceeded
+
+
+def run(queries: int, warmup: int, deadline: float, tail_probability: float) -> None:
+    document = "\n\n".join(fake_page_text(page) for page in range(20))
+    tails = {"vector_query": (tail_probability, 20), "firestore_read": (tail_probability, 20), "llm_request": (tail_probability, 10)}
+
+    with fake_gcp_backend():
+        with contextlib.redirect_stdout(io.StringIO()):
+            IngestionSession()(new_file_name="benchmark-part1.json", file_to_ingest=document.encode(), ingest_json=True)
+        print(f"Queries: {queries} (after {warmup} warm-up)  Deadline: {deadline}s  "
+              f"Slow calls: {tail_probability:.0%} of vector queries & Firestore reads (20x), LLM requests (10x)")
+
+        for hedging in (False, True):
+            ClientRegistry.clear()  # fresh latency tracker
+            with contextlib.redirect_stdout(io.StringIO()):
+                query_session = SearchQuerySession(model_name="gemini-1.5-pro", deadline_seconds=deadline, hedging=hedging)
+            query_session.answer_cache = None
+            chunks = sorted(FakeFirestoreClient.store[query_session.firestore_collection_name].values(), key=lambda doc: doc["id"])
+
+            latencies = []
+            exceeded = 0
+            with inject_tail_latency(tails, seed=1):
+                for idx in range(warmup + queries):
+                    question = f"{chunks[idx % len(chunks)]['page_content']} ({'hedged' if hedging else 'plain'} {idx})"
+                    start = time.perf_counter()
+                    try:
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            query_session(client_query=question)
+                    except DeadlineExceeded:
+                        exceeded += 1
+                    if idx >= warmup:
+                        latencies.append(time.perf_counter() - start)
+
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            stages = query_session.latency_tracker.stats()
+            hedges = sum(stage["hedges"] for stage in stages.values())
+            wins = sum(stage["hedge_wins"] for stage in stages.values())
+            print(f"{'hedged' if hedging else 'plain':7s} p50 {p50:6.0f}ms  p95 {p95:6.0f}ms  p99 {p99:6.0f}ms  max {max(latencies) * 1000:6.0f}ms  "
+                  f"hedges {hedges} (won {wins})  deadline exceeded {exceeded}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=150)
+    parser.add_argument("--warmup", type=int, default=40)
+    parser.add_argument("--deadline", type=float, default=5.0)
+    parser.add_argument("--tail-probability", type=float, default=0.02)
+    args = parser.parse_args()
+    run(args.queries, args.warmup, args.deadline, args.tail_probability)
@@ -0,0 +1,77 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Recall & per-stage latency of vector, lexical (BM25) & hybrid retrieval for
+questions about exact error codes planted in the ingested pages, against local fakes.
+The fake embeddings are text hashes, so vector recall here only shows what
+embeddings that do not capture exact identifiers miss.
+
+Usage: python -m benchmarks.hybrid_benchmark [--pages 40] [--codes 20]
+"""
+
+import argparse
+import contextlib
+import io
+import random
+import statistics
+import time
+
+from benchmarks.fakes import FakeFirestoreClient, fake_gcp_backend, fake_page_text
+from rsc.IngestionSession import IngestionSession
+from rsc.SearchQuerySession import RETRIEVAL_MODES, SearchQuerySession
+
+
+def run(pages: int, codes: int) -> None:
+    rng = random.Random(0)
+    error_codes = [f"ERR-{4000 + idx}" for idx in range(codes)]
+    texts = [fake_page_text(page) for page in range(pages)]
+    for code in error_codes:
+        page = rng.randrange(pages)
+        texts[page] += f" Error {code} means the device lost its network connection."
+    document = "\n\n".join(texts)
+
+    with fake_gcp_backend({"VECTOR_SEARCH_BACKEND": "local"}):
+        with contextlib.redirect_stdout(io.StringIO()):
+            IngestionSession()(new_file_name="benchmark-part1.json", file_to_ingest=document.encode(), ingest_json=True)
+            collection = SearchQuerySession(model_name="gemini-1.5-flash").firestore_collection_name
+        chunks = FakeFirestoreClient.store[collection].values()
+        relevant = {code: {chunk["id"] for chunk in chunks if code in chunk["page_content"]} for code in error_codes}
+        print(f"Pages: {pages}  Chunks: {len(chunks)}  Questions: {codes}")
+
+        for mode in RETRIEVAL_MODES:
+            query_session = SearchQuerySession(model_name="gemini-1.5-flash", retrieval_mode=mode)
+            query_session.answer_cache = None
+            hits = 0
+            latencies = []
+            stages = {}
+            for code in error_codes:
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    context = query_session._retrieve_context(f"What does error {code} mean?")
+                latencies.append(time.perf_counter() - start)
+                hits += bool(relevant[code] & set(context["matched_ids"]))
+                for stage, seconds in context["timings"].items():
+                    stages.setdefault(stage, []).append(seconds)
+
+            stage_report = "  ".join(f"{stage} {statistics.median(seconds) * 1000:.1f}ms" for stage, seconds in stages.items())
+            print(f"{mode:8s} recall@10 {hits / codes:4.0%}  retrieval median {statistics.median(latencies) * 1000:6.1f}ms  ({stage_report})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--codes", type=int, default=20)
+    args = parser.parse_args()
+    run(args.pages, args.codes)
@@ -0,0 +1,108 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Recall@k vs. query latency vs. memory of the IVF-PQ index at several nprobe
+values, compared with exact search on the LocalVectorIndex.
+
+Runs on synthetic clustered 768-d vectors by default. Real embeddings can be
+passed as JSONL in the Vertex Vector Search batch input format
+({"id": ..., "embedding": [...]} per line); queries are then perturbed copies
+of stored embeddings.
+
+Usage: python -m benchmarks.ivfpq_benchmark [--size 50000] [--nprobe 1 4 16 64] [--jsonl embeddings.jsonl]
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from rsc.IVFPQIndex import IVFPQIndex
+from rsc.LocalVectorIndex import LocalVectorIndex
+
+DIMENSIONS = 768
+
+
+def synthetic_vectors(size: int, rng) -> np.ndarray:
+    # gaussian clusters, roughly like embeddings of documents on a few hundred topics
+    centers = rng.standard_normal((500, DIMENSIONS), dtype=np.float32)
+    return centers[rng.integers(0, len(centers), size)] + 0.5 * rng.standard_normal((size, DIMENSIONS), dtype=np.float32)
+
+
+def load_jsonl(path: str) -> tuple:
+    ids, vectors = [], []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            ids.append(record["id"])
+            vectors.append(record["embedding"])
+    return ids, np.asarray(vectors, dtype=np.float32)
+
+
+def measure(index, queries: np.ndarray, k: int, **search_kwargs) -> tuple:
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(index.search(query[None, :], k, **search_kwargs)[0][0])
+        latencies.append(time.perf_counter() - start)
+    return results, statistics.median(latencies)
+
+
+def run(size: int, nprobes: list, num_queries: int, k: int, nlist: int, jsonl: str) -> None:
+    rng = np.random.default_rng(0)
+    if jsonl:
+        ids, vectors = load_jsonl(jsonl)
+    else:
+        vectors = synthetic_vectors(size, rng)
+        ids = [f"doc-part1-chunk{idx}" for idx in range(size)]
+    queries = vectors[rng.choice(len(vectors), num_queries)]
+    queries = queries + 0.3 * queries.std() * rng.standard_normal(queries.shape, dtype=np.float32)
+    print(f"Vectors: {len(ids)} ({jsonl or 'synthetic'})  Queries: {num_queries}  k: {k}  nlist: {nlist}")
+
+    with tempfile.TemporaryDirectory() as exact_path, tempfile.TemporaryDirectory() as ivfpq_path:
+        exact = LocalVectorIndex(exact_path)
+        ivfpq = IVFPQIndex(ivfpq_path, nlist=nlist, train_size=len(ids) + 1)
+        for first in range(0, len(ids), 5000):
+            batch = list(zip(ids[first:first + 5000], vectors[first:first + 5000]))
+            exact.upsert(batch)
+            ivfpq.upsert(batch)
+
+        start = time.perf_counter()
+        ivfpq.train()
+        train_seconds = time.perf_counter() - start
+
+        expected, exact_latency = measure(exact, queries, k)
+        memory = ivfpq.memory_bytes()
+        print(f"exact            recall@{k} 1.000  p50 {exact_latency * 1000:7.2f}ms  memory {memory['flat'] / 2**20:8.1f}MiB")
+        for nprobe in nprobes:
+            found, latency = measure(ivfpq, queries, k, nprobe=nprobe)
+            recall = np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, expected) if e])
+            print(f"ivfpq nprobe {nprobe:<3d} recall@{k} {recall:.3f}  p50 {latency * 1000:7.2f}ms  memory {memory['ivfpq'] / 2**20:8.1f}MiB")
+        print(f"training: {train_seconds:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=50000)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--jsonl", default=None)
+    args = parser.parse_args()
+    run(args.size, args.nprobe, args.queries, args.k, args.nlist, args.jsonl)
@@ -0,0 +1,64 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-backend latency & token counters of the registered LLM backends, answering the
+same questions through the faked Gemini & Claude clients, the local echo backend
+and an echo backend registered at runtime with simulated latency.
+
+Usage: python -m benchmarks.llm_backend_benchmark [--questions 10]
+"""
+
+import argparse
+import contextlib
+import io
+
+from benchmarks.fakes import FakeFirestoreClient, fake_gcp_backend, fake_page_text
+from rsc.IngestionSession import IngestionSession
+from rsc.LLMBackends import EchoBackend, llm_backend_stats, register_llm_backend
+from rsc.SearchQuerySession import SearchQuerySession
+
+MODELS = ["gemini-1.5-flash", "claude3-sonnet", "echo", "echo-slow"]
+
+
+def run(questions: int) -> None:
+    document = "\n\n".join(fake_page_text(page) for page in range(10))
+    register_llm_backend("echo-slow", lambda: EchoBackend("echo-slow", first_token_seconds=0.2, token_seconds=0.001))
+
+    with fake_gcp_backend():
+        with contextlib.redirect_stdout(io.StringIO()):
+            IngestionSession()(new_file_name="benchmark-part1.json", file_to_ingest=document.encode(), ingest_json=True)
+            sessions = {model: SearchQuerySession(model_name=model) for model in MODELS}
+        chunks = sorted(FakeFirestoreClient.store[sessions["echo"].firestore_collection_name].values(), key=lambda doc: doc["id"])
+        asked = [chunk["page_content"] for chunk in chunks[:questions]]
+
+        for model, query_session in sessions.items():
+            query_session.answer_cache = None
+            with contextlib.redirect_stdout(io.StringIO()):
+                for question in asked[:-1]:
+                    query_session(client_query=question)
+                "".join(query_session.stream(client_query=asked[-1]))
+
+        print(f"Questions: {questions} per model (the last one streamed)")
+        for model, stats in llm_backend_stats().items():
+            print(f"{model:18s} requests {stats['requests']:3d}  errors {stats['errors']}  mean {stats['mean_seconds'] * 1000:6.1f}ms  "
+                  f"first token {stats['mean_first_token_seconds'] * 1000:6.1f}ms  "
+                  f"tokens in {stats['prompt_tokens']:6d} out {stats['output_tokens']:5d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=10)
+    args = parser.parse_args()
+    run(args.questions)
@@ -0,0 +1,81 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Build, open & query latency of the memory-mapped LocalVectorIndex on random
+768-d vectors, checked against brute-force NumPy search.
+
+Usage: python -m benchmarks.local_index_benchmark [--sizes 10000 100000] [--queries 100]
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from rsc.LocalVectorIndex import LocalVectorIndex
+
+DIMENSIONS = 768
+
+
+def run(sizes: list, queries: int) -> None:
+    rng = np.random.default_rng(0)
+    print(f"Queries: {queries}  Dimensions: {DIMENSIONS}")
+
+    for size in sizes:
+        vectors = rng.standard_normal((size, DIMENSIONS), dtype=np.float32)
+        ids = [f"doc-part1-chunk{idx}" for idx in range(size)]
+        query_vecs = rng.standard_normal((queries, DIMENSIONS), dtype=np.float32)
+
+        with tempfile.TemporaryDirectory() as path:
+            start = time.perf_counter()
+            index = LocalVectorIndex(path)
+            for first in range(0, size, 1000):
+                index.upsert(list(zip(ids[first:first + 1000], vectors[first:first + 1000])))
+            build_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            index = LocalVectorIndex(path)
+            open_seconds = time.perf_counter() - start
+
+            latencies = []
+            found = []
+            for query_vec in query_vecs:
+                start = time.perf_counter()
+                found.append(index.search(query_vec[None, :], num_neighbors=10)[0][0])
+                latencies.append(time.perf_counter() - start)
+
+            # exact search must agree with brute force
+            normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+            expected = np.argsort(-(query_vecs @ normalized.T), axis=1)[:, :10]
+            recall = np.mean([len(set(f) & {ids[i] for i in e}) / 10 for f, e in zip(found, expected)])
+
+            start = time.perf_counter()
+            index.remove(ids[: size // 10])
+            remove_seconds = time.perf_counter() - start
+
+        latencies.sort()
+        print(f"{size:8d} vectors  build {size / build_seconds:9.0f} vec/s  open {open_seconds * 1000:6.1f}ms  "
+              f"query p50 {statistics.median(latencies) * 1000:6.2f}ms p95 {latencies[int(len(latencies) * 0.95)] * 1000:6.2f}ms  "
+              f"recall@10 {recall:.2f}  remove {size // 10 / remove_seconds:9.0f} ids/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+    run(args.sizes, args.queries)
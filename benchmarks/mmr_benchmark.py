@@ -0,0 +1,102 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Distinct passages, prompt tokens & retrieval latency of plain top-10 vector
+matches vs. MMR re-ranking, on chunks stored as near-identical copies (e.g. the
+same section in several split PDF parts), against local fakes.
+
+Usage: python -m benchmarks.mmr_benchmark [--questions 20] [--copies 4] [--fetch-k 40] [--lambdas 0.5 0.7]
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import time
+
+import numpy as np
+
+from benchmarks.fakes import FakeFirestoreClient, fake_gcp_backend, fake_page_text, fake_vector
+from rsc.ClientRegistry import get_local_vector_index
+from rsc.SearchQuerySession import SearchQuerySession
+
+PASSAGES_PER_QUESTION = 6
+
+
+def store_chunks(collection_name: str, questions: list, copies: int) -> None:
+    # every question has PASSAGES_PER_QUESTION relevant passages, each stored `copies` times
+    rng = np.random.default_rng(0)
+    collection = FakeFirestoreClient().collection(collection_name)
+    datapoints = []
+    for question_idx, question in enumerate(questions):
+        query_vec = np.asarray(fake_vector(question), dtype=np.float32)
+        query_vec /= np.linalg.norm(query_vec)
+        for passage in range(PASSAGES_PER_QUESTION):
+            passage_id = question_idx * PASSAGES_PER_QUESTION + passage
+            text = fake_page_text(f"passage {passage_id}", chars=700)
+            noise = rng.standard_normal(len(query_vec)).astype(np.float32)
+            base = 0.8 * query_vec + 0.6 * noise / np.linalg.norm(noise)
+            for copy in range(copies):
+                doc_id = f"manual-part{copy + 1}-chunk{passage_id}"
+                jitter = rng.standard_normal(len(query_vec)).astype(np.float32)
+                datapoints.append((doc_id, base + 0.05 * jitter / np.linalg.norm(jitter)))
+                collection._write(doc_id, {"id": doc_id, "document_name": f"manual-part{copy + 1}", "page_content": text})
+    get_local_vector_index().upsert(datapoints)
+
+
+def ask(query_session: SearchQuerySession, questions: list) -> tuple:
+    passages, tokens, latencies = [], [], []
+    for question in questions:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            context = query_session._retrieve_context(question)
+        latencies.append(time.perf_counter() - start)
+        passages.append(len({doc_id.split("-chunk")[1] for doc_id in context["matched_ids"]}))
+        tokens.append(context["context_stats"]["context_tokens"])
+    return passages, tokens, latencies
+
+
+def run(questions: int, copies: int, fetch_k: int, lambdas: list) -> None:
+    asked = [f"How do I reset the device after error ERR-{4000 + idx}?" for idx in range(questions)]
+
+    with fake_gcp_backend({"VECTOR_SEARCH_BACKEND": "local"}):
+        configs = {"top-10": SearchQuerySession(model_name="gemini-1.5-flash")}
+        for lambda_mult in lambdas:
+            configs[f"MMR lambda {lambda_mult}"] = SearchQuerySession(
+                model_name="gemini-1.5-flash", mmr_fetch_k=fetch_k, mmr_lambda=lambda_mult
+            )
+        store_chunks(configs["top-10"].firestore_collection_name, asked, copies)
+        print(f"Questions: {questions}  Relevant passages: {PASSAGES_PER_QUESTION} x {copies} copies  MMR fetch k: {fetch_k}")
+
+        # warm up the query embedding caches, so every configuration is timed alike
+        ask(configs["top-10"], asked)
+
+        baseline_tokens = None
+        for name, query_session in configs.items():
+            query_session.answer_cache = None
+            passages, tokens, latencies = ask(query_session, asked)
+            baseline_tokens = baseline_tokens or statistics.mean(tokens)
+            print(f"{name:16s} distinct passages {statistics.mean(passages):4.1f}  prompt context {statistics.mean(tokens):6.0f} tokens "
+                  f"({1 - statistics.mean(tokens) / baseline_tokens:4.0%} smaller)  retrieval median {statistics.median(latencies) * 1000:5.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--copies", type=int, default=4)
+    parser.add_argument("--fetch-k", type=int, default=40)
+    parser.add_argument("--lambdas", type=float, nargs="+", default=[0.5, 0.7])
+    args = parser.parse_args()
+    run(args.questions, args.copies, args.fetch_k, args.lambdas)
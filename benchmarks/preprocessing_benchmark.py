@@ -0,0 +1,66 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Wall-clock time of ingesting a large, split PDF with different worker counts
+against local fakes of the GCP clients.
+
+Usage: python -m benchmarks.preprocessing_benchmark [--pages 300] [--workers 1 2 4 8]
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+import PyPDF2
+
+from benchmarks.fakes import fake_gcp_backend
+from rsc.PreprocessingSession import PreprocessingSession
+
+
+def blank_pdf(pages: int) -> bytes:
+    pdf_writer = PyPDF2.PdfWriter()
+    for _ in range(pages):
+        pdf_writer.add_blank_page(width=595, height=842)
+    tmp = io.BytesIO()
+    pdf_writer.write(tmp)
+    return tmp.getvalue()
+
+
+def run(pages: int, workers: list, max_pages_per_file: int) -> None:
+    file_bytes = blank_pdf(pages)
+    baseline = None
+
+    print(f"Pages: {pages}, pages per part: {max_pages_per_file}")
+    for max_workers in workers:
+        with fake_gcp_backend():
+            preprocessing = PreprocessingSession(max_workers=max_workers)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                report = preprocessing(new_file_name="benchmark.pdf", file_to_ingest=file_bytes, max_pages_per_file=max_pages_per_file)
+            seconds = time.perf_counter() - start
+
+        baseline = baseline or seconds
+        print(f"Workers: {max_workers:3d}  {seconds:6.2f}s  speedup {baseline / seconds:4.1f}x  "
+              f"parts ingested {len(report['ingested'])}/{report['parts']}, failed {len(report['failed'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--max-pages-per-file", type=int, default=15)
+    args = parser.parse_args()
+    run(args.pages, args.workers, args.max_pages_per_file)
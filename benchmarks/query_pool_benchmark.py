@@ -0,0 +1,71 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Query latency with a new SearchQuerySession per question (cold) vs. sessions &
+clients shared through the ClientRegistry (warm), against local fakes.
+
+Usage: python -m benchmarks.query_pool_benchmark [--queries 20] [--model gemini-1.5-flash]
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import time
+
+from benchmarks.fakes import FakeMatchingEngineIndexEndpoint, FakePredictionServiceClient, fake_gcp_backend, fake_page_text
+from rsc import ClientRegistry
+from rsc.ClientRegistry import get_search_query_session
+from rsc.IngestionSession import IngestionSession
+from rsc.SearchQuerySession import SearchQuerySession
+
+
+def run(queries: int, model_name: str) -> None:
+    with fake_gcp_backend():
+        with contextlib.redirect_stdout(io.StringIO()):
+            ingestion = IngestionSession()
+            ingestion(new_file_name="benchmark.json", file_to_ingest="\n\n".join(fake_page_text(page) for page in range(10)).encode(), ingest_json=True)
+        questions = [fake_page_text(page)[:200] for page in range(queries)]
+
+        print(f"Queries: {queries}  Model: {model_name}")
+        for mode in ("cold", "warm"):
+            ClientRegistry.clear()
+            FakeMatchingEngineIndexEndpoint.init_count = 0
+            FakePredictionServiceClient.init_count = 0
+            latencies = []
+            for question in questions:
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if mode == "cold":
+                        # every client is rebuilt per question, as without the registry
+                        ClientRegistry.clear()
+                        query_session = SearchQuerySession(model_name=model_name)
+                    else:
+                        query_session = get_search_query_session(model_name=model_name)
+                    query_session(client_query=question)
+                latencies.append(time.perf_counter() - start)
+
+            # the first warm query still pays for client setup
+            print(f"{mode:4s}  first {latencies[0] * 1000:7.1f}ms  median {statistics.median(latencies) * 1000:7.1f}ms  "
+                  f"mean {statistics.mean(latencies) * 1000:7.1f}ms  endpoint inits {FakeMatchingEngineIndexEndpoint.init_count:3d}  "
+                  f"prediction client inits {FakePredictionServiceClient.init_count:3d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--model", default="gemini-1.5-flash")
+    args = parser.parse_args()
+    run(args.queries, args.model)
@@ -0,0 +1,271 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Offline benchmark suite for regression tracking, against the local fakes with
+log-normally distributed latencies & injected transient errors.
+
+Scenarios: ingest a PDF, sequential query latency, batch queries & deletion of
+a document. Each scenario runs --repeat times in a fresh fake backend, the
+median of every *_seconds metric is kept. Results are stored per commit in
+benchmarks/results/<commit>.json and compared with an earlier result; metrics
+more than --threshold slower are reported as regressions (exit code 1).
+
+Usage: python -m benchmarks.regression_suite [--scenarios ingest_pdf query_latency batch_queries deletion]
+       [--repeat 3] [--pages 100] [--queries 50] [--sigma 0.25] [--error-rate firestore_commit=0.01]
+       [--compare <commit>] [--threshold 0.1]
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.fakes import FakeFirestoreClient, fake_gcp_backend, fake_page_text, fake_service_profile
+from benchmarks.preprocessing_benchmark import blank_pdf
+from rsc.DeletionSession import DeletionSession
+from rsc.IngestionSession import IngestionSession
+from rsc.SearchQuerySession import SearchQuerySession
+from rsc.tracing import get_tracer
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# transient errors on the write paths, which retry them
+DEFAULT_ERROR_RATES = {"firestore_commit": 0.01, "vector_upsert": 0.01, "vector_remove": 0.01}
+
+
+def percentiles(latencies: list) -> dict:
+    ordered = sorted(latencies)
+    def at(percentile):
+        return ordered[min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))]
+    return {"p50_seconds": at(50), "p95_seconds": at(95), "p99_seconds": at(99)}
+
+
+def ingest_document(name: str, pages: int) -> None:
+    # untimed setup: a text document of the given number of pages
+    document = "\n\n".join(fake_page_text(page) for page in range(pages))
+    with contextlib.redirect_stdout(io.StringIO()):
+        IngestionSession()(new_file_name=f"{name}.json", file_to_ingest=document.encode(), ingest_json=True)
+    return None
+
+
+def query_session() -> tuple:
+    # uncached query session & the ingested chunks to ask about
+    with contextlib.redirect_stdout(io.StringIO()):
+        session = SearchQuerySession(model_name="gemini-1.5-pro")
+    session.answer_cache = None
+    chunks = sorted(FakeFirestoreClient.store[session.firestore_collection_name].values(), key=lambda doc: doc["id"])
+    return session, chunks
+
+
+def bench_ingest_pdf(args) -> dict:
+    file_bytes = blank_pdf(args.pages)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = IngestionSession()(new_file_name="benchmark.pdf", file_to_ingest=file_bytes, ingest_pdf=True)
+    seconds = time.perf_counter() - start
+    return {"total_seconds": seconds, "pages": args.pages, "chunks": report.get("recomputed"),
+            "pages_per_second": args.pages / seconds}
+
+
+def bench_query_latency(args) -> dict:
+    ingest_document("benchmark-part1", 40)
+    session, chunks = query_session()
+    latencies = []
+    failed = 0
+    for idx in range(args.queries):
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                session(f"{chunks[idx % len(chunks)]['page_content'][:300]} (question {idx})")
+        except Exception:
+            failed += 1
+        latencies.append(time.perf_counter() - start)
+    return dict(percentiles(latencies), mean_seconds=statistics.mean(latencies), queries=args.queries, failed=failed)
+
+
+def bench_batch_queries(args) -> dict:
+    ingest_document("benchmark-part1", 40)
+    session, chunks = query_session()
+    questions = [f"{chunks[idx % len(chunks)]['page_content'][:300]} (batch question {idx})" for idx in range(args.batch_queries)]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = session.batch(questions, llm_concurrency=args.llm_concurrency)
+    seconds = time.perf_counter() - start
+    return {"total_seconds": seconds, "queries": len(questions), "queries_per_second": len(questions) / seconds,
+            "failed": sum(result["error"] is not None for result in results)}
+
+
+def bench_deletion(args) -> dict:
+    ingest_document("benchmark-part1", args.pages)
+    chunks = len(FakeFirestoreClient.store.get(DeletionSession().firestore_collection_name, {}))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        DeletionSession()(document_name="benchmark-part1")
+    return {"total_seconds": time.perf_counter() - start, "chunks": chunks}
+
+
+SCENARIOS = {
+    "ingest_pdf": bench_ingest_pdf,
+    "query_latency": bench_query_latency,
+    "batch_queries": bench_batch_queries,
+    "deletion": bench_deletion,
+}
+
+
+def run_scenario(name: str, args) -> dict:
+    """
+    Run a scenario --repeat times, each in a fresh fake backend. Keeps the median of
+    every metric & the per-stage p95 latencies traced during the last run.
+    """
+    runs = []
+    for repeat in range(args.repeat):
+        with fake_gcp_backend(), fake_service_profile({"*": args.sigma}, args.error_rates, seed=args.seed + repeat):
+            get_tracer().reset()
+            runs.append(SCENARIOS[name](args))
+            stages = {stage: round(histogram["p95_seconds"], 6) for stage, histogram in get_tracer().stats().items() if "[" not in stage}
+    metrics = {key: statistics.median(run[key] for run in runs) for key in runs[0] if isinstance(runs[0][key], (int, float))}
+    return {"metrics": metrics, "runs": runs, "stage_p95_seconds": stages}
+
+
+def git_commit() -> str:
+    # short commit hash, suffixed with -dirty for uncommitted changes to tracked files
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def result_path(commit: str) -> str:
+    return os.path.join(RESULTS_DIR, f"{commit}.json")
+
+
+def load_baseline(compare: str, commit: str) -> dict:
+    """
+    The stored result of the --compare commit (a hash, ref or file path), or else
+    the most recent stored result of another commit.
+    """
+    if compare:
+        if os.path.exists(compare):
+            path = compare
+        else:
+            resolved = subprocess.run(["git", "rev-parse", "--short", compare], capture_output=True, text=True).stdout.strip()
+            path = result_path(resolved or compare)
+        if not os.path.exists(path):
+            print(f"No stored result for {compare} ({path}).")
+            return None
+    else:
+        stored = [
+            os.path.join(RESULTS_DIR, file_name) for file_name in os.listdir(RESULTS_DIR)
+            if file_name.endswith(".json") and file_name != f"{commit}.json"
+        ] if os.path.isdir(RESULTS_DIR) else []
+        if not stored:
+            return None
+        path = max(stored, key=os.path.getmtime)
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(result: dict, baseline: dict, threshold: float) -> list:
+    # *_seconds metrics that got slower than baseline * (1 + threshold)
+    print(f"\nCompared with {baseline['commit']} ({baseline['timestamp']}):")
+    print(f"{'scenario':<15} {'metric':<18} {'baseline':>10} {'current':>10} {'change':>8}")
+    regressions = []
+    for scenario, scenario_result in result["scenarios"].items():
+        baseline_metrics = baseline["scenarios"].get(scenario, {}).get("metrics", {})
+        for metric, value in scenario_result["metrics"].items():
+            if not metric.endswith("_seconds") or not baseline_metrics.get(metric):
+                continue
+            change = value / baseline_metrics[metric] - 1
+            regressed = change > threshold
+            if regressed:
+                regressions.append((scenario, metric, change))
+            print(f"{scenario:<15} {metric:<18} {baseline_metrics[metric]:>10.3f} {value:>10.3f} {change:>+7.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def parse_error_rates(values: list) -> dict:
+    if values is None:
+        return dict(DEFAULT_ERROR_RATES)
+    error_rates = {}
+    for value in values:
+        operation, _, rate = value.partition("=")
+        error_rates[operation] = float(rate)
+    return error_rates
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--batch-queries", type=int, default=100)
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--sigma", type=float, default=0.25, help="log-normal latency spread of every fake operation")
+    parser.add_argument("--error-rate", dest="error_rates", action="append",
+                        help="operation=rate, repeatable (default: 1%% of Firestore commits & vector upserts/removes fail)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", help="commit, ref or result file to compare with (default: latest stored result)")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args(argv)
+    args.error_rates = parse_error_rates(args.error_rates)
+
+    commit = git_commit()
+    result = {
+        "commit": commit,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("compare", "no_save")},
+        "scenarios": {},
+    }
+    print(f"Commit {commit}  repeat {args.repeat}  latency sigma {args.sigma}  error rates {args.error_rates}")
+    for scenario in args.scenarios:
+        start = time.perf_counter()
+        result["scenarios"][scenario] = run_scenario(scenario, args)
+        metrics = result["scenarios"][scenario]["metrics"]
+        print(f"{scenario:<15} " + "  ".join(
+            f"{key} {value:.3f}" if isinstance(value, float) else f"{key} {value}" for key, value in metrics.items()
+        ) + f"  ({time.perf_counter() - start:.0f}s)")
+
+    baseline = load_baseline(args.compare, commit)
+    regressions = compare_results(result, baseline, args.threshold) if baseline else []
+    if baseline is None:
+        print("\nNo earlier result to compare with.")
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        with open(result_path(commit), "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved {result_path(commit)}")
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Re-ingesting a slightly edited document: full vs. incremental (chunk-level diff)
+ingestion against local fakes.
+
+Usage: python -m benchmarks.reingest_benchmark [--pages 100]
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+from benchmarks.fakes import fake_gcp_backend, fake_page_text
+from rsc.IngestionSession import IngestionSession
+
+
+def run(pages: int) -> None:
+    original = "\n\n".join(fake_page_text(page) for page in range(pages))
+    # edit one page in the middle & drop the last page
+    middle = len(original) // 2
+    edited = original[:middle] + " EDITED " + original[middle + 40:len(original) - 1800]
+
+    print(f"Pages: {pages}")
+    for incremental in (False, True):
+        with fake_gcp_backend():
+            ingestion = IngestionSession()
+            ingestion.embedding_session.cache = None
+            with contextlib.redirect_stdout(io.StringIO()):
+                ingestion(new_file_name="benchmark.json", file_to_ingest=original.encode(), ingest_json=True)
+                start = time.perf_counter()
+                report = ingestion(new_file_name="benchmark.json", file_to_ingest=edited.encode(), ingest_json=True, incremental=incremental)
+            seconds = time.perf_counter() - start
+
+        print(f"{'Incremental' if incremental else 'Full':11s}  {seconds:6.2f}s  reused {report['reused']:4d}  "
+              f"recomputed {report['recomputed']:4d}  removed {report['removed']:4d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=100)
+    args = parser.parse_args()
+    run(args.pages)
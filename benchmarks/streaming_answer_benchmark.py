@@ -0,0 +1,72 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time until the answer starts to show: blocking vs. streaming LLM output, for the
+Gemini & Anthropic backends, against local fakes.
+
+Usage: python -m benchmarks.streaming_answer_benchmark [--queries 5]
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import time
+
+from benchmarks.fakes import fake_gcp_backend, fake_page_text
+from rsc.IngestionSession import IngestionSession
+from rsc.SearchQuerySession import SearchQuerySession
+
+
+def run(queries: int) -> None:
+    with fake_gcp_backend():
+        with contextlib.redirect_stdout(io.StringIO()):
+            ingestion = IngestionSession()
+            ingestion(new_file_name="benchmark.json", file_to_ingest="\n\n".join(fake_page_text(page) for page in range(10)).encode(), ingest_json=True)
+        questions = [fake_page_text(page)[:200] for page in range(queries)]
+
+        print(f"Queries: {queries}")
+        for model_name in ("gemini-1.5-flash", "claude3-sonnet"):
+            with contextlib.redirect_stdout(io.StringIO()):
+                query_session = SearchQuerySession(model_name=model_name)
+                query_session.answer_cache = None
+                # warm up, so client setup is not measured
+                query_session(client_query=questions[0])
+
+            blocking = []
+            for question in questions:
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    query_session(client_query=question)
+                blocking.append(time.perf_counter() - start)
+
+            first_token, total = [], []
+            for question in questions:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    answer = query_session.stream(client_query=question)
+                    for _ in answer:
+                        pass
+                first_token.append(answer.timings["time_to_first_token_seconds"])
+                total.append(answer.timings["total_seconds"])
+
+            print(f"{model_name:16s}  blocking: first text {statistics.mean(blocking) * 1000:6.1f}ms  |  "
+                  f"streaming: first token {statistics.mean(first_token) * 1000:6.1f}ms, total {statistics.mean(total) * 1000:6.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=5)
+    args = parser.parse_args()
+    run(args.queries)
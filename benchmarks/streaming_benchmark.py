@@ -0,0 +1,63 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Phased vs. streaming ingestion of one large PDF against local fakes: total time,
+time until the first chunks are searchable and peak Python memory.
+
+Usage: python -m benchmarks.streaming_benchmark [--pages 100]
+"""
+
+import argparse
+import contextlib
+import io
+import time
+import tracemalloc
+
+from benchmarks.fakes import fake_gcp_backend, FakeIndexServiceClient
+from benchmarks.preprocessing_benchmark import blank_pdf
+from rsc.IngestionSession import IngestionSession
+
+
+def run(pages: int) -> None:
+    file_bytes = blank_pdf(pages)
+    stage_stats = None
+
+    print(f"Pages: {pages}")
+    for streaming in (False, True):
+        with fake_gcp_backend():
+            ingestion = IngestionSession()
+            tracemalloc.start()
+            start = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                report = ingestion(new_file_name="benchmark.pdf", file_to_ingest=file_bytes, ingest_pdf=True, streaming=streaming)
+            seconds = time.time() - start
+            first_searchable = FakeIndexServiceClient.first_upsert_time - start
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        stage_stats = report.get("stages", stage_stats)
+        print(f"{'Streaming' if streaming else 'Phased':9s}  total {seconds:6.2f}s  first searchable {first_searchable:6.2f}s  "
+              f"peak memory {peak_bytes / 2**20:6.1f} MiB")
+
+    for stage_name, stage in stage_stats.items():
+        print(f"  {stage_name:9s} {stage['items_in']:4d} in  {stage['items_out']:4d} out  "
+              f"{stage['items_per_second']:8.1f} items/sec  max queue depth {stage['max_queue_depth']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=100)
+    args = parser.parse_args()
+    run(args.pages)
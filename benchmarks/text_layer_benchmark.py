@@ -0,0 +1,87 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Ingestion of a mostly digital PDF (with a few scanned pages) with Document AI
+OCR for every page vs. the native text-layer fast path, against local fakes.
+
+Usage: python -m benchmarks.text_layer_benchmark [--pages 100] [--scanned-every 10]
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+import PyPDF2
+from PyPDF2 import PageObject
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from benchmarks.fakes import fake_gcp_backend, fake_page_text, FakeDocumentProcessorServiceClient
+from rsc.PreprocessingSession import PreprocessingSession
+
+
+def text_page(text: str) -> PageObject:
+    font = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    })
+    page = PageObject.create_blank_page(width=595, height=842)
+    page[NameObject("/Resources")] = DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+
+    lines = [text[i:i + 90].replace("\\", "").replace("(", "").replace(")", "") for i in range(0, len(text), 90)]
+    content = "BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+    stream = DecodedStreamObject()
+    stream.set_data(content.encode("latin-1"))
+    page[NameObject("/Contents")] = stream
+    return page
+
+
+def mixed_pdf(pages: int, scanned_every: int) -> bytes:
+    # digitally generated pages with a text layer, every n-th page blank like a scan
+    pdf_writer = PyPDF2.PdfWriter()
+    for page_num in range(pages):
+        if page_num % scanned_every == scanned_every - 1:
+            pdf_writer.add_blank_page(width=595, height=842)
+        else:
+            pdf_writer.add_page(text_page(fake_page_text(page_num)))
+    tmp = io.BytesIO()
+    pdf_writer.write(tmp)
+    return tmp.getvalue()
+
+
+def run(pages: int, scanned_every: int) -> None:
+    file_bytes = mixed_pdf(pages, scanned_every)
+
+    print(f"Pages: {pages}, every {scanned_every}th page scanned")
+    for native_text_layer in (False, True):
+        with fake_gcp_backend():
+            preprocessing = PreprocessingSession(native_text_layer=native_text_layer)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                report = preprocessing(new_file_name="benchmark.pdf", file_to_ingest=file_bytes, max_pages_per_file=15)
+            seconds = time.perf_counter() - start
+            ocr_pages = FakeDocumentProcessorServiceClient.pages_processed
+
+        print(f"{'Text layer' if native_text_layer else 'OCR only':10s}  {seconds:6.2f}s  "
+              f"Document AI pages {ocr_pages:4d}  parts ingested {len(report['ingested'])}/{report['parts']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--scanned-every", type=int, default=10)
+    args = parser.parse_args()
+    run(args.pages, args.scanned_every)
@@ -0,0 +1,94 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Per-stage latency histograms of one PDF ingestion & a series of queries against
+local fakes, as collected by the tracer, plus the overhead of a single span.
+
+Usage: python -m benchmarks.tracing_benchmark [--pages 20] [--queries 100] [--export tracing_benchmark.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import time
+
+from benchmarks.fakes import FakeFirestoreClient, fake_gcp_backend
+from benchmarks.preprocessing_benchmark import blank_pdf
+from rsc.IngestionSession import IngestionSession
+from rsc.SearchQuerySession import SearchQuerySession
+from rsc.tracing import Tracer, get_tracer
+
+
+def span_overhead(iterations: int = 100000) -> float:
+    # seconds per empty span with attributes, minus the bare loop
+    tracer = Tracer(max_spans=1)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        pass
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for idx in range(iterations):
+        with tracer.span("overhead", model="gemini-1.5-pro", chunks=idx) as overhead_span:
+            overhead_span.set_attribute("tokens", idx)
+    return (time.perf_counter() - start - loop_seconds) / iterations
+
+
+def print_histograms(stats: dict) -> None:
+    print(f"{'span':<40} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, histogram in stats.items():
+        print(f"{name:<40} {histogram['count']:>6} {histogram['p50_seconds'] * 1000:>9.1f} {histogram['p95_seconds'] * 1000:>9.1f} "
+              f"{histogram['p99_seconds'] * 1000:>9.1f} {histogram['max_seconds'] * 1000:>9.1f}")
+    return None
+
+
+def run(pages: int, queries: int, export_path: str) -> None:
+    with fake_gcp_backend():
+        tracer = get_tracer()
+        tracer.reset()
+        with contextlib.redirect_stdout(io.StringIO()):
+            IngestionSession()(new_file_name="benchmark.pdf", file_to_ingest=blank_pdf(pages), ingest_pdf=True, streaming=True)
+            query_session = SearchQuerySession(model_name="gemini-1.5-pro")
+        query_session.answer_cache = None
+        chunks = sorted(FakeFirestoreClient.store[query_session.firestore_collection_name].values(), key=lambda doc: doc["id"])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            for idx in range(queries):
+                question = f"{chunks[idx % len(chunks)]['page_content'][:200]} ({idx})"
+                if idx % 4 == 3:
+                    "".join(query_session.stream(question))
+                else:
+                    query_session(question)
+
+        print(f"Pages: {pages}  Queries: {queries} (every 4th streamed)")
+        print_histograms(tracer.stats())
+        tracer.export(export_path)
+
+    with open(export_path) as f:
+        exported = json.load(f)
+    print(f"Exported {len(exported['histograms'])} histograms & {len(exported['spans'])} spans to {export_path}")
+    print(f"Span overhead: {span_overhead() * 1e6:.1f}us per span")
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--export", default="tracing_benchmark.json")
+    args = parser.parse_args()
+    run(args.pages, args.queries, args.export)
@@ -0,0 +1,84 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Embed & upsert time of a large document: embedding everything and sending one
+upsert request vs. size-bounded upsert batches pipelined with embedding,
+against local fakes.
+
+Usage: python -m benchmarks.upsert_benchmark [--chunks 3000]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import time
+
+from google.cloud import aiplatform_v1
+
+from benchmarks.fakes import fake_gcp_backend, FakeIndexServiceClient
+from rsc.IngestionSession import IngestionSession
+
+
+def upsert_single_request(ingestion: IngestionSession, list_of_chunks: list) -> None:
+    # previous behaviour: embed everything, serialise every embedding to a JSON line,
+    # parse it back & send all datapoints of the document in one UpsertDatapointsRequest
+    embeddings = ingestion.embedding_session.get_vertex_embeddings([d.page_content for d in list_of_chunks])
+    upsert_datapoints = [
+        json.dumps({"id": d.metadata["chunk_identifier"], "embedding": embedding}) + "\n"
+        for d, embedding in zip(list_of_chunks, embeddings)
+    ]
+    datapoints = []
+    for dp in upsert_datapoints:
+        dp_dict = json.loads(dp)
+        datapoints.append(aiplatform_v1.IndexDatapoint(datapoint_id=dp_dict["id"], feature_vector=dp_dict["embedding"], restricts=[]))
+    upsert_request = aiplatform_v1.UpsertDatapointsRequest(index="benchmark-index", datapoints=datapoints)
+    ingestion.vector_index_writer.index_client.upsert_datapoints(request=upsert_request)
+
+
+class Chunk:
+    def __init__(self, idx: int):
+        self.page_content = f"chunk {idx} " * 100
+        self.metadata = {"chunk_identifier": f"benchmark-part1-chunk{idx}", "document_name": "benchmark-part1.pdf"}
+
+
+def run(chunks: int) -> None:
+    list_of_chunks = [Chunk(idx) for idx in range(chunks)]
+
+    with fake_gcp_backend():
+        ingestion = IngestionSession()
+        ingestion.embedding_session.cache = None
+
+        start = time.perf_counter()
+        upsert_single_request(ingestion, list_of_chunks)
+        before_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ingestion._embed_and_upsert(list_of_chunks)
+        after_seconds = time.perf_counter() - start
+
+        assert len(FakeIndexServiceClient.datapoints) >= chunks
+
+    print(f"Chunks: {chunks}")
+    print(f"Sequential: {before_seconds:6.2f}s")
+    print(f"Pipelined:  {after_seconds:6.2f}s  speedup {before_seconds / after_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=3000)
+    args = parser.parse_args()
+    run(args.chunks)
@@ -14,22 +14,20 @@
 
 import math
 import datetime
-from dotenv import dotenv_values
-
 import streamlit as st
 import pandas as pd
 
 from google.cloud import storage
-import google.auth
 
-from rsc.SearchQuerySession import SearchQuerySession
+from rsc.ClientRegistry import get_credentials, get_search_query_session, get_secrets
 from rsc.IngestionSession import IngestionSession
 from rsc.retrievers.NotionRetriever import NotionRetrievalSession
 from rsc.PreprocessingSession import PreprocessingSession
 from rsc.DeletionSession import DeletionSession
 
-secrets = dotenv_values(".env")
-credentials, _ = google.auth.load_credentials_from_file(secrets['GCP_CREDENTIAL_FILE'])
+# Streamlit re-runs this script on every interaction, clients & sessions are shared via the registry.
+secrets = get_secrets()
+credentials, _ = get_credentials(secrets['GCP_CREDENTIAL_FILE'])
 
 class DocPreview:
     def __init__(self, list_of_docs: list):
@@ -71,18 +69,16 @@ class DocPreview:
 
 def main(client_query:str, model_name: str, uploaded_img_bytes=None) -> None:  
 
-    with st.spinner('Processing... This might take a minute or two.'):
+    with st.spinner('Searching your knowledge base...'):
 
-        query_session = SearchQuerySession(model_name=model_name)
-        if uploaded_img is not None:
-            answer, sources = query_session(client_query=client_query, image=uploaded_img_bytes)
-        else:
-            answer, sources = query_session(client_query=client_query)
-    
-        df = pd.DataFrame({"Sources": sources})
+        query_session = get_search_query_session(model_name=model_name)
+        answer = query_session.stream(client_query=client_query, image=uploaded_img_bytes)
+
+        # sources are shown before the answer starts streaming
+        df = pd.DataFrame({"Sources": answer.sources})
         st.dataframe(df)
 
-    st.write(answer['text'])
+    st.write_stream(answer)
 
     return None
 
@@ -123,7 +119,10 @@ def get_current_files(bucket_name, secrets=secrets, credentials=credentials) ->
 def upload_new_file(new_file:bytes, new_file_name:str) -> None:
     
     preprocessing = PreprocessingSession()
-    preprocessing(new_file_name=new_file_name, file_to_ingest=new_file, ingest_local_file=False, max_pages_per_file=15, ingest_pdf=True)
+    report = preprocessing(new_file_name=new_file_name, file_to_ingest=new_file, ingest_local_file=False, max_pages_per_file=15, ingest_pdf=True)
+
+    for part_name, error in report["failed"].items():
+        st.error(f"Failed to ingest {part_name}: {error}")
 
     return None
 
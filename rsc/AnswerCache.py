@@ -0,0 +1,235 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+
+DEFAULT_ANSWER_CACHE_PATH = ".cache/answers.sqlite"
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10000
+
+
+class AnswerCache:
+    """
+    Persistent two-level query cache on SQLite.
+
+    Level one maps the normalized query text to its embedding, level two maps
+    (normalized query, model name, sorted retrieved chunk ids, generation
+    params) to the answer & sources. Entries expire after ttl_seconds, each
+    level keeps at most max_entries least recently used entries, and answers
+    are dropped as soon as one of the chunks they were built from changes.
+    """
+
+    def __init__(self, path: str = DEFAULT_ANSWER_CACHE_PATH, ttl_seconds: float = DEFAULT_TTL_SECONDS, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.embedding_hits = 0
+        self.embedding_misses = 0
+        self.answer_hits = 0
+        self.answer_misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS query_embeddings (
+                query_key BLOB PRIMARY KEY,
+                vector BLOB NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            ) WITHOUT ROWID"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS answers (
+                answer_key BLOB PRIMARY KEY,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            ) WITHOUT ROWID"""
+        )
+        # reverse index used to invalidate answers when a chunk changes
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS answer_chunks (
+                chunk_id TEXT NOT NULL,
+                answer_key BLOB NOT NULL,
+                PRIMARY KEY (chunk_id, answer_key)
+            ) WITHOUT ROWID"""
+        )
+        for table in ("query_embeddings", "answers"):
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_last_access ON {table} (last_access)"
+            )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS answer_chunks_answer_key ON answer_chunks (answer_key)"
+        )
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        # case, surrounding punctuation & whitespace differences map to the same entry
+        return re.sub(r"\s+", " ", query).strip(" ?!.").lower()
+
+    @classmethod
+    def _digest(cls, *parts) -> bytes:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).digest()
+
+    def _is_fresh(self, created: float) -> bool:
+        return time.time() - created < self.ttl_seconds
+
+    def get_query_embedding(self, model_name: str, query: str):
+        """
+        Look up the cached embedding of a query. Returns None on a miss.
+        """
+        key = self._digest(model_name, self.normalize_query(query))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector, created FROM query_embeddings WHERE query_key = ?", (key,)
+            ).fetchone()
+            if row is None or not self._is_fresh(row[1]):
+                self.embedding_misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE query_embeddings SET last_access = ? WHERE query_key = ?", (time.time(), key)
+            )
+            self.embedding_hits += 1
+        return array("f", row[0]).tolist()
+
+    def put_query_embedding(self, model_name: str, query: str, vector: list) -> None:
+        key = self._digest(model_name, self.normalize_query(query))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)",
+                (key, array("f", vector).tobytes(), now, now),
+            )
+            self._evict("query_embeddings", "query_key")
+        return None
+
+    def answer_key(self, query: str, model_name: str, chunk_ids: list, params: dict) -> bytes:
+        return self._digest(self.normalize_query(query), model_name, sorted(chunk_ids), params)
+
+    def get_answer(self, answer_key: bytes):
+        """
+        Look up a cached (answer, sources) tuple. Returns None on a miss.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer, sources, created FROM answers WHERE answer_key = ?", (answer_key,)
+            ).fetchone()
+            if row is None or not self._is_fresh(row[2]):
+                self.answer_misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE answers SET last_access = ? WHERE answer_key = ?", (time.time(), answer_key)
+            )
+            self.answer_hits += 1
+        return json.loads(row[0]), json.loads(row[1])
+
+    def put_answer(self, answer_key: bytes, chunk_ids: list, answer, sources: list) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                (answer_key, json.dumps(answer, default=str), json.dumps(sources), now, now),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO answer_chunks VALUES (?, ?)",
+                [(chunk_id, answer_key) for chunk_id in set(chunk_ids)],
+            )
+            self._conn.execute("COMMIT")
+            self._evict("answers", "answer_key")
+        return None
+
+    def invalidate_chunks(self, chunk_ids: list) -> int:
+        """
+        Drop every cached answer built from one of chunk_ids. Returns the number of dropped answers.
+        """
+        chunk_ids = list(set(chunk_ids))
+        answer_keys = set()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            # stay well below SQLite's bound parameter limit
+            for start in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[start:start + 500]
+                answer_keys.update(
+                    row[0] for row in self._conn.execute(
+                        f"SELECT answer_key FROM answer_chunks WHERE chunk_id IN ({','.join('?' * len(batch))})",
+                        batch,
+                    )
+                )
+            self._delete_answers(list(answer_keys))
+            self._conn.execute("COMMIT")
+            self.invalidations += len(answer_keys)
+        return len(answer_keys)
+
+    def _delete_answers(self, answer_keys: list) -> None:
+        self._conn.executemany("DELETE FROM answers WHERE answer_key = ?", [(key,) for key in answer_keys])
+        self._conn.executemany("DELETE FROM answer_chunks WHERE answer_key = ?", [(key,) for key in answer_keys])
+        return None
+
+    def _evict(self, table: str, key_column: str) -> None:
+        # drop expired entries, then least recently used ones until the table is back under max_entries
+        expired_before = time.time() - self.ttl_seconds
+        expired = [row[0] for row in self._conn.execute(f"SELECT {key_column} FROM {table} WHERE created < ?", (expired_before,))]
+        count = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] - len(expired)
+        overflow = [
+            row[0] for row in self._conn.execute(
+                f"SELECT {key_column} FROM {table} WHERE created >= ? ORDER BY last_access LIMIT ?",
+                (expired_before, max(count - self.max_entries, 0)),
+            )
+        ]
+        to_delete = expired + overflow
+        if not to_delete:
+            return None
+
+        if table == "answers":
+            self._delete_answers(to_delete)
+        else:
+            self._conn.executemany(f"DELETE FROM {table} WHERE {key_column} = ?", [(key,) for key in to_delete])
+        self.evictions += len(to_delete)
+        return None
+
+    def stats(self) -> dict:
+        embedding_lookups = self.embedding_hits + self.embedding_misses
+        answer_lookups = self.answer_hits + self.answer_misses
+        return {
+            "embedding_hits": self.embedding_hits,
+            "embedding_misses": self.embedding_misses,
+            "embedding_hit_rate": self.embedding_hits / embedding_lookups if embedding_lookups else 0.0,
+            "answer_hits": self.answer_hits,
+            "answer_misses": self.answer_misses,
+            "answer_hit_rate": self.answer_hits / answer_lookups if answer_lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            for table in ("query_embeddings", "answers", "answer_chunks"):
+                self._conn.execute(f"DELETE FROM {table}")
+        return None
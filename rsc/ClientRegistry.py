@@ -0,0 +1,267 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Process-wide registry of long-lived clients & sessions.
+
+Clients are created once per configuration and shared by every entry point
+(Streamlit app, scripts, benchmarks), so warm requests skip connection, auth &
+model setup.
+"""
+
+import os
+import threading
+import weakref
+
+from dotenv import dotenv_values
+import google.auth
+
+_instances = {}
+_instance_locks = {}
+_registry_lock = threading.Lock()
+
+# {env path: (mtime, values)}, one entry per .env file
+_secrets = {}
+
+# {event loop: {(kind,) + key: instance}}, dropped with their loop
+_loop_instances = weakref.WeakKeyDictionary()
+_loop_lock = threading.Lock()
+
+
+def get_or_create(kind: str, key: tuple, factory):
+    """
+    Return the instance registered under (kind, key), creating it with factory() on first use.
+    Concurrent first calls for the same key create the instance only once.
+    """
+    registry_key = (kind,) + tuple(key)
+    instance = _instances.get(registry_key)
+    if instance is not None:
+        return instance
+
+    with _registry_lock:
+        instance_lock = _instance_locks.setdefault(registry_key, threading.Lock())
+
+    with instance_lock:
+        if registry_key not in _instances:
+            _instances[registry_key] = factory()
+        return _instances[registry_key]
+
+
+def clear() -> None:
+    """
+    Drop all registered instances, e.g. after credentials were rotated.
+    """
+    with _registry_lock:
+        _instances.clear()
+        _instance_locks.clear()
+        _secrets.clear()
+    with _loop_lock:
+        _loop_instances.clear()
+    return None
+
+
+def get_or_create_for_loop(kind: str, key: tuple, loop, factory):
+    """
+    Return the instance registered under (kind, key) for an event loop, creating it with factory() on first use.
+    Instances of closed or garbage collected loops are dropped.
+    """
+    registry_key = (kind,) + tuple(key)
+    with _loop_lock:
+        # clients may reference their loop, so closed loops are pruned explicitly
+        for closed_loop in [other for other in _loop_instances if other.is_closed()]:
+            del _loop_instances[closed_loop]
+
+        instances = _loop_instances.setdefault(loop, {})
+        if registry_key not in instances:
+            instances[registry_key] = factory()
+        return instances[registry_key]
+
+
+def get_secrets(env_path: str = ".env") -> dict:
+    # reloaded only when the .env file changes
+    path = os.path.abspath(env_path)
+    mtime = os.path.getmtime(env_path) if os.path.exists(env_path) else None
+    with _registry_lock:
+        cached = _secrets.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = _secrets[path] = (mtime, dotenv_values(env_path))
+        return cached[1]
+
+
+def config_key(secrets: dict) -> tuple:
+    # hashable fingerprint of a configuration
+    return tuple(sorted((k, str(v)) for k, v in secrets.items()))
+
+
+def get_credentials(credential_file: str) -> tuple:
+    return get_or_create("credentials", (credential_file,), lambda: google.auth.load_credentials_from_file(credential_file))
+
+
+def get_firestore_client(project: str, database: str, credential_file: str):
+    from firebase_admin import firestore
+
+    def factory():
+        credentials, _ = get_credentials(credential_file)
+        return firestore.Client(project=project, credentials=credentials, database=database)
+
+    return get_or_create("firestore", (project, database, credential_file), factory)
+
+
+def get_index_endpoint(index_endpoint_name: str, project: str, location: str, credentials):
+    from google.cloud import aiplatform
+
+    return get_or_create(
+        "index_endpoint",
+        (index_endpoint_name, project, location, id(credentials)),
+        lambda: aiplatform.MatchingEngineIndexEndpoint(
+            index_endpoint_name=index_endpoint_name, project=project, location=location, credentials=credentials
+        ),
+    )
+
+
+def get_match_client(api_endpoint: str, credentials):
+    # find_neighbors on the public endpoint of a deployed index, with per-call timeouts
+    from google.cloud import aiplatform_v1
+
+    return get_or_create(
+        "match_client",
+        (api_endpoint, id(credentials)),
+        lambda: aiplatform_v1.MatchServiceClient(credentials=credentials, client_options=dict(api_endpoint=api_endpoint)),
+    )
+
+
+def get_prediction_client(location: str, credentials):
+    # embedding & Gemini requests, with per-call timeouts
+    from google.cloud import aiplatform_v1
+
+    return get_or_create(
+        "prediction_client",
+        (location, id(credentials)),
+        lambda: aiplatform_v1.PredictionServiceClient(
+            credentials=credentials, client_options=dict(api_endpoint=f"{location}-aiplatform.googleapis.com")
+        ),
+    )
+
+
+def get_generative_model(model_name: str):
+    from vertexai.preview import generative_models
+
+    return get_or_create("generative_model", (model_name,), lambda: generative_models.GenerativeModel(model_name))
+
+
+def get_anthropic_client(region: str, project_id: str):
+    import anthropic
+
+    return get_or_create("anthropic", (region, project_id), lambda: anthropic.AnthropicVertex(region=region, project_id=project_id))
+
+
+# Async clients hold connections bound to the event loop they were first used
+# on, so they are registered per event loop & released with it.
+
+def get_async_firestore_client(project: str, database: str, credential_file: str, loop):
+    from firebase_admin import firestore
+
+    def factory():
+        credentials, _ = get_credentials(credential_file)
+        return firestore.AsyncClient(project=project, credentials=credentials, database=database)
+
+    return get_or_create_for_loop("async_firestore", (project, database, credential_file), loop, factory)
+
+
+def get_async_anthropic_client(region: str, project_id: str, loop):
+    import anthropic
+
+    return get_or_create_for_loop("async_anthropic", (region, project_id), loop, lambda: anthropic.AsyncAnthropicVertex(region=region, project_id=project_id))
+
+
+def get_latency_tracker():
+    # stage latencies of all query sessions, for hedging at their p95
+    from rsc.hedging import LatencyTracker
+
+    return get_or_create("latency_tracker", (), LatencyTracker)
+
+
+# vector search backends served from local files instead of Vertex AI
+LOCAL_VECTOR_BACKENDS = ("local", "ivfpq")
+
+
+def get_vector_search_backend(env_path: str = ".env") -> str:
+    # "vertex" (Vertex AI Vector Search, default), "local" (exact) or "ivfpq" (approximate)
+    return (get_secrets(env_path).get("VECTOR_SEARCH_BACKEND") or "vertex").lower()
+
+
+def get_local_vector_index(env_path: str = ".env"):
+    """
+    Shared local vector index of the configured backend, used by queries,
+    ingestion & deletion when VECTOR_SEARCH_BACKEND is local or ivfpq.
+    """
+    secrets = get_secrets(env_path)
+
+    if get_vector_search_backend(env_path) == "ivfpq":
+        from rsc.IVFPQIndex import IVFPQIndex, DEFAULT_IVFPQ_INDEX_PATH, DEFAULT_NLIST, DEFAULT_NPROBE
+
+        path = secrets.get("IVFPQ_INDEX_PATH") or DEFAULT_IVFPQ_INDEX_PATH
+        nlist = int(secrets.get("IVFPQ_NLIST") or DEFAULT_NLIST)
+        nprobe = int(secrets.get("IVFPQ_NPROBE") or DEFAULT_NPROBE)
+        return get_or_create(
+            "ivfpq_index",
+            (os.path.abspath(path), nlist, nprobe),
+            lambda: IVFPQIndex(path=path, nlist=nlist, nprobe=nprobe),
+        )
+
+    from rsc.LocalVectorIndex import LocalVectorIndex, DEFAULT_LOCAL_INDEX_PATH
+
+    path = secrets.get("LOCAL_VECTOR_INDEX_PATH") or DEFAULT_LOCAL_INDEX_PATH
+    return get_or_create("local_vector_index", (os.path.abspath(path),), lambda: LocalVectorIndex(path=path))
+
+
+def get_lexical_index(env_path: str = ".env"):
+    """
+    Shared BM25 index over chunk contents, or None when LEXICAL_INDEX_DISABLED is set.
+    """
+    from rsc.LexicalIndex import LexicalIndex, DEFAULT_LEXICAL_INDEX_PATH
+
+    secrets = get_secrets(env_path)
+    if str(secrets.get("LEXICAL_INDEX_DISABLED") or "").lower() in ("1", "true", "yes"):
+        return None
+
+    path = secrets.get("LEXICAL_INDEX_PATH") or DEFAULT_LEXICAL_INDEX_PATH
+    return get_or_create("lexical_index", (os.path.abspath(path),), lambda: LexicalIndex(path=path))
+
+
+def get_search_query_session(model_name: str, env_path: str = ".env"):
+    from rsc.SearchQuerySession import SearchQuerySession
+
+    secrets = get_secrets(env_path)
+    return get_or_create("search_query_session", (model_name,) + config_key(secrets), lambda: SearchQuerySession(model_name=model_name))
+
+
+def get_answer_cache(env_path: str = ".env"):
+    """
+    Shared answer cache, or None when ANSWER_CACHE_DISABLED is set.
+    """
+    from rsc.AnswerCache import AnswerCache, DEFAULT_ANSWER_CACHE_PATH, DEFAULT_MAX_ENTRIES, DEFAULT_TTL_SECONDS
+
+    secrets = get_secrets(env_path)
+    if str(secrets.get("ANSWER_CACHE_DISABLED") or "").lower() in ("1", "true", "yes"):
+        return None
+
+    path = secrets.get("ANSWER_CACHE_PATH") or DEFAULT_ANSWER_CACHE_PATH
+    ttl_seconds = float(secrets.get("ANSWER_CACHE_TTL_SECONDS") or DEFAULT_TTL_SECONDS)
+    max_entries = int(secrets.get("ANSWER_CACHE_MAX_ENTRIES") or DEFAULT_MAX_ENTRIES)
+    return get_or_create(
+        "answer_cache",
+        (os.path.abspath(path), ttl_seconds, max_entries),
+        lambda: AnswerCache(path=path, ttl_seconds=ttl_seconds, max_entries=max_entries),
+    )
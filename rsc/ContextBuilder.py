@@ -0,0 +1,147 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import re
+
+# token budget of the retrieved context: a quarter of the model's context window, capped
+# well below the large windows so prompt size (and with it latency & cost) stays bounded
+CONTEXT_WINDOW_SHARE = 4
+MAX_CONTEXT_TOKEN_BUDGET = 8000
+DEFAULT_CONTEXT_TOKEN_BUDGET = 2000
+
+# SentencePiece & BPE vocabularies average about 4 characters per token on English prose
+CHARS_PER_TOKEN = 4
+TOKEN_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# overlapping spans carried over by the chunker are searched up to this many characters
+MAX_OVERLAP_CHARS = 400
+MIN_OVERLAP_CHARS = 8
+
+CHUNK_ID_PATTERN = re.compile(r"^(?P<prefix>.*-chunk)(?P<index>\d+)$")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Local token estimate without a count_tokens request: every word counts one
+    token per started CHARS_PER_TOKEN characters, punctuation one token each.
+    """
+    return sum(math.ceil(len(piece) / CHARS_PER_TOKEN) for piece in TOKEN_PIECE_PATTERN.findall(text))
+
+
+def context_token_budget(context_tokens: int, override=None) -> int:
+    # context_tokens: the context window of the answering model (LLMBackend.context_tokens)
+    if override:
+        return int(override)
+    return min(context_tokens // CONTEXT_WINDOW_SHARE, MAX_CONTEXT_TOKEN_BUDGET)
+
+
+def overlap_length(previous: str, following: str) -> int:
+    # longest suffix of previous that starts following
+    for length in range(min(len(previous), len(following), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(following[:length]):
+            return length
+    return 0
+
+
+class ContextBuilder:
+    """
+    Packs retrieved chunks into the prompt context within a token budget.
+
+    Chunks are taken in rank order while the packed context fits the budget.
+    Selected chunks of the same document are put back in document order, runs of
+    adjacent chunks are merged and the text the chunker repeated between them
+    (chunk_overlap) is removed. Documents are ordered by their best ranked chunk.
+    """
+
+    def __init__(self, token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+
+    def build(self, chunks: list) -> tuple:
+        """
+        Pack chunks, dicts with id, page_content & document_name in rank order.
+        Returns the context text, the used chunks in rank order & packing stats.
+        """
+        selected = []
+        context = ""
+        for chunk in chunks:
+            candidate = self._pack(selected + [chunk])
+            if estimate_tokens(candidate) <= self.token_budget:
+                selected.append(chunk)
+                context = candidate
+
+        truncated = False
+        if not selected and chunks:
+            # a single chunk over the budget is cut, rather than answering without context
+            selected = chunks[:1]
+            context = self._truncate(chunks[0]["page_content"])
+            truncated = True
+
+        naive_tokens = estimate_tokens(" ".join(chunk["page_content"] for chunk in chunks))
+        context_tokens = estimate_tokens(context)
+        stats = {
+            "token_budget": self.token_budget,
+            "chunks_retrieved": len(chunks),
+            "chunks_used": len(selected),
+            "chunks_merged": len(selected) - len(self._runs(selected)),
+            "naive_tokens": naive_tokens,
+            "context_tokens": context_tokens,
+            "tokens_saved": naive_tokens - context_tokens,
+            "truncated": truncated,
+        }
+        return context, selected, stats
+
+    def _pack(self, chunks: list) -> str:
+        return "\n\n".join(self._merge_run(run) for run in self._runs(chunks))
+
+    @staticmethod
+    def _runs(chunks: list) -> list:
+        # group chunks into runs of consecutive chunk indices of one document, ordered by best rank
+        positions = {}
+        for rank, chunk in enumerate(chunks):
+            match = CHUNK_ID_PATTERN.match(str(chunk["id"]))
+            prefix, index = (match["prefix"], int(match["index"])) if match else (str(chunk["id"]), 0)
+            positions[chunk["id"]] = (prefix, index, rank)
+
+        runs = []
+        ordered = sorted(chunks, key=lambda chunk: positions[chunk["id"]][:2])
+        for chunk in ordered:
+            prefix, index, _ = positions[chunk["id"]]
+            if runs:
+                last_prefix, last_index, _ = positions[runs[-1][-1]["id"]]
+                if last_prefix == prefix and last_index + 1 == index:
+                    runs[-1].append(chunk)
+                    continue
+            runs.append([chunk])
+
+        return sorted(runs, key=lambda run: min(positions[chunk["id"]][2] for chunk in run))
+
+    @staticmethod
+    def _merge_run(run: list) -> str:
+        text = run[0]["page_content"]
+        for chunk in run[1:]:
+            following = chunk["page_content"]
+            overlap = overlap_length(text, following)
+            if overlap:
+                text += following[overlap:]
+            else:
+                text += " " + following
+        return text
+
+    def _truncate(self, text: str) -> str:
+        # cut at a word boundary, shrinking until the estimate fits
+        end = min(len(text), self.token_budget * CHARS_PER_TOKEN)
+        while end > 0 and estimate_tokens(text[:end]) > self.token_budget:
+            end = max(text.rfind(" ", 0, end), 0)
+        return text[:end]
@@ -17,7 +17,6 @@ from os import path
 from dotenv import dotenv_values
 
 from google.cloud import bigquery
-from google.cloud import aiplatform_v1
 from google.cloud import storage
 import google.auth
 
@@ -25,6 +24,10 @@ import firebase_admin
 from firebase_admin import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
 
+from rsc.FirestoreBulkWriter import FirestoreBulkWriter
+from rsc.VectorIndexWriter import VectorIndexWriter
+from rsc.ClientRegistry import LOCAL_VECTOR_BACKENDS, get_answer_cache, get_lexical_index, get_local_vector_index, get_vector_search_backend
+
 
 class DeletionSession:
     def __init__(self) -> None:
@@ -43,6 +46,20 @@ class DeletionSession:
             project=self.secrets["GCP_PROJECT_ID"], credentials=self.credentials, database=self.secrets["FIRESTORE_DATABASE_ID"])
 
         self.firestore_collection_name = self.secrets["FIRESTORE_COLLECTION_NAME"]
+        self.firestore_writer = FirestoreBulkWriter(
+            client=self.firestore_client, collection_name=self.firestore_collection_name)
+        if get_vector_search_backend() in LOCAL_VECTOR_BACKENDS:
+            # same upsert & remove interface as VectorIndexWriter
+            self.vector_index_writer = get_local_vector_index()
+        else:
+            self.vector_index_writer = VectorIndexWriter(
+                credentials=self.credentials,
+                gcp_project_number=self.secrets["GCP_PROJECT_NUMBER"],
+                gcp_region=self.secrets["GCP_REGION"],
+                index_id=self.secrets["VECTOR_SEARCH_INDEX_ID"],
+            )
+        self.answer_cache = get_answer_cache()
+        self.lexical_index = get_lexical_index()
 
     def __call__(self, document_name=None, ids_to_delete=None) -> None:
         """
@@ -77,6 +94,15 @@ class DeletionSession:
         print("Deleting from Vector Search...")
         self._delete_docs_from_vectorstore(ids_to_delete)
 
+        if self.lexical_index is not None:
+            print("Deleting from lexical index...")
+            self.lexical_index.remove(ids_to_delete)
+
+        # Drop cached answers built from the deleted chunks.
+        if self.answer_cache is not None:
+            invalidated = self.answer_cache.invalidate_chunks(ids_to_delete)
+            print(f"Invalidated {invalidated} cached answers")
+
         print("Deleting Docs from BigQuery...")
         # self._delete_doc_from_bigquery(ids_to_delete)
 
@@ -112,50 +138,30 @@ class DeletionSession:
         """
         Method to delete the documents from the firestore collection.
         """
-        # Get the document references you want to delete
-        document_refs = [
-            self.firestore_client.collection(self.firestore_collection_name).document(
-                doc_id
-            )
-            for doc_id in ids_to_delete
-        ]
+        # Delete in batched commits of at most 500 operations each
+        stats = self.firestore_writer.delete_documents(ids_to_delete)
 
-        # Create a batch and add delete operations
-        batch = self.firestore_client.batch()
-        for ref in document_refs:
-            batch.delete(ref)
+        print(f"Deleted {stats['written']} chunks from firestore in {stats['batches']} batches "
+              f"({stats['ops_per_second']:.1f} deletes/sec, {stats['failed']} failed)")
 
-        # Commit the batch
-        batch.commit()
+        if stats["failed"]:
+            raise RuntimeError(f"Failed to delete {stats['failed']} chunks from firestore: {stats['errors']}")
 
-        print(f"Deleted from firestore.")
         return None
 
     def _delete_docs_from_vectorstore(self, ids_to_delete: list) -> None:
         """
         Method to delete the documents from the vectorstore.
         """
-        # Create a client
-
-        index_client = aiplatform_v1.IndexServiceClient(credentials=self.credentials, client_options=dict(
-            api_endpoint=f"{self.secrets['GCP_REGION']}-aiplatform.googleapis.com"
-        ))
-
-        index_name = f"projects/{self.secrets['GCP_PROJECT_NUMBER']}/locations/{self.secrets['GCP_REGION']}/indexes/{self.secrets['VECTOR_SEARCH_INDEX_ID']}"
-
-        # Initialize request argument(s)
-        deletion_request = aiplatform_v1.RemoveDatapointsRequest(
-            index=index_name,
-            datapoint_ids=ids_to_delete,
-        )
+        # Remove in batched, retried requests
+        stats = self.vector_index_writer.remove(ids_to_delete)
 
-        # Make the request
-        response = index_client.remove_datapoints(request=deletion_request)
+        print(f"Deleted {stats['sent']} datapoints from vector store in {stats['requests']} requests "
+              f"({stats['seconds']:.1f}s, {stats['failed']} failed)")
 
-        # Handle the response
-        print(response)
+        if stats["failed"]:
+            raise RuntimeError(f"Failed to delete {stats['failed']} datapoints from vector store: {stats['errors']}")
 
-        print(f"Deleted from vector store.")
         return None
 
     def _delete_doc_from_gcs(self, document_name) -> None:
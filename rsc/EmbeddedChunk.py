@@ -0,0 +1,51 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+
+class EmbeddedChunk:
+    """
+    A document chunk together with its embedding, as consumed by the vector
+    search & BigQuery sinks. The vector is a float32 array (typically a row view
+    into the embedding matrix of its batch).
+    """
+
+    __slots__ = ("id", "document_name", "content", "vector")
+
+    def __init__(self, id: str, document_name: str, content: str, vector):
+        self.id = id
+        self.document_name = document_name
+        self.content = content
+        self.vector = np.asarray(vector, dtype=np.float32)
+
+    def __repr__(self) -> str:
+        return f"EmbeddedChunk(id={self.id!r}, document_name={self.document_name!r}, dimensions={len(self.vector)})"
+
+
+def embed_chunk_batch(list_of_chunks: list, embeddings: list) -> list:
+    """
+    Pair chunks with their embeddings, backed by one float32 matrix for the batch.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    return [
+        EmbeddedChunk(
+            id=d.metadata["chunk_identifier"],
+            document_name=d.metadata["document_name"],
+            content=d.page_content,
+            vector=matrix[idx],
+        )
+        for idx, d in enumerate(list_of_chunks)
+    ]
+
@@ -0,0 +1,188 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+DEFAULT_CACHE_PATH = ".cache/embeddings.sqlite"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed embedding cache on SQLite.
+
+    Entries are keyed by (model name, task type, SHA-256 of the text) and store
+    the vector as packed float32. Once the stored vectors exceed max_bytes the
+    least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                model_name TEXT NOT NULL,
+                task_type TEXT NOT NULL,
+                text_sha256 BLOB NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model_name, task_type, text_sha256)
+            ) WITHOUT ROWID"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)"
+        )
+        self._size_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    @staticmethod
+    def _digest(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def get_many(self, model_name: str, task_type, texts: list) -> list:
+        """
+        Look up cached vectors for texts. Misses are returned as None.
+        """
+        task_type = task_type or ""
+        digests = [self._digest(text) for text in texts]
+        found = {}
+
+        with self._lock:
+            # stay well below SQLite's bound parameter limit
+            for start in range(0, len(digests), 500):
+                batch = digests[start:start + 500]
+                rows = self._conn.execute(
+                    f"""SELECT text_sha256, vector FROM embeddings
+                    WHERE model_name = ? AND task_type = ?
+                    AND text_sha256 IN ({",".join("?" * len(batch))})""",
+                    [model_name, task_type, *batch],
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    """UPDATE embeddings SET last_access = ?
+                    WHERE model_name = ? AND task_type = ? AND text_sha256 = ?""",
+                    [(now, model_name, task_type, digest) for digest in found],
+                )
+
+            vectors = []
+            for digest in digests:
+                blob = found.get(digest)
+                if blob is None:
+                    self.misses += 1
+                    vectors.append(None)
+                else:
+                    self.hits += 1
+                    vectors.append(array("f", blob).tolist())
+
+        return vectors
+
+    def put_many(self, model_name: str, task_type, texts: list, vectors: list) -> None:
+        """
+        Store vectors for texts, evicting least recently used entries if needed.
+        """
+        task_type = task_type or ""
+        now = time.time()
+        rows = [
+            (model_name, task_type, self._digest(text), array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+
+        with self._lock:
+            added_bytes = 0
+            self._conn.execute("BEGIN")
+            try:
+                for row in rows:
+                    previous = self._conn.execute(
+                        """SELECT LENGTH(vector) FROM embeddings
+                        WHERE model_name = ? AND task_type = ? AND text_sha256 = ?""",
+                        row[:3],
+                    ).fetchone()
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", row
+                    )
+                    added_bytes += len(row[3]) - (previous[0] if previous else 0)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                # an open transaction would make every later BEGIN fail
+                self._conn.execute("ROLLBACK")
+                raise
+            # counted only once the rows are committed
+            self._size_bytes += added_bytes
+            self._evict()
+
+        return None
+
+    def _evict(self) -> None:
+        # drop least recently used entries until the cache is back under max_bytes
+        while self._size_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                """SELECT model_name, task_type, text_sha256, LENGTH(vector)
+                FROM embeddings ORDER BY last_access LIMIT 256"""
+            ).fetchall()
+            if not rows:
+                self._size_bytes = 0
+                break
+
+            to_delete = []
+            for row in rows:
+                if self._size_bytes <= self.max_bytes:
+                    break
+                to_delete.append(row[:3])
+                self._size_bytes -= row[3]
+
+            self._conn.executemany(
+                """DELETE FROM embeddings
+                WHERE model_name = ? AND task_type = ? AND text_sha256 = ?""",
+                to_delete,
+            )
+            self.evictions += len(to_delete)
+
+        return None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size_bytes": self._size_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._size_bytes = 0
+        return None
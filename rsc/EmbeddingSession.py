@@ -12,25 +12,69 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import threading
+
 import vertexai
-from vertexai.language_models import TextEmbeddingModel
+from google.cloud.aiplatform import initializer
+from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
+
+try:
+    from rsc.EmbeddingCache import EmbeddingCache, DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES
+    from rsc.ClientRegistry import get_credentials, get_prediction_client, get_secrets
+    from rsc.hedging import rpc_timeout
+    from rsc.tracing import span
+except:
+    from EmbeddingCache import EmbeddingCache, DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES
+    from ClientRegistry import get_credentials, get_prediction_client, get_secrets
+    from hedging import rpc_timeout
+    from tracing import span
 
-import google.auth
+EMBEDDING_MODEL_NAME = "text-embedding-004"
 
-from dotenv import dotenv_values
+# Per-request limits of the Vertex AI text embedding API.
+MAX_TEXTS_PER_REQUEST = 250
+MAX_TOKENS_PER_REQUEST = 20000
+MAX_TOKENS_PER_TEXT = 2048  # longer inputs are truncated by the API (auto_truncate)
 
 
 class EmbeddingSession:
-    def __init__(self):
-        self.secrets = dotenv_values(".env")
-        self.credentials, self.project_id = google.auth.load_credentials_from_file(
-            self.secrets["GCP_CREDENTIAL_FILE"]
-        )
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, use_cache: bool = True):
+        self.secrets = get_secrets()
+        self.credentials, self.project_id = get_credentials(self.secrets["GCP_CREDENTIAL_FILE"])
         vertexai.init(
             project=self.secrets["GCP_PROJECT_ID"], credentials=self.credentials
         )
+        self.model_name = model_name
+        self.location = initializer.global_config.location
+        self._model = None
+        self._model_lock = threading.Lock()
+
+        # on-disk embedding cache, bypassed with use_cache=False or EMBEDDING_CACHE_DISABLED=true
+        cache_disabled = str(self.secrets.get("EMBEDDING_CACHE_DISABLED") or "").lower() in ("1", "true", "yes")
+        if use_cache and not cache_disabled:
+            self.cache = EmbeddingCache(
+                path=self.secrets.get("EMBEDDING_CACHE_PATH") or DEFAULT_CACHE_PATH,
+                max_bytes=int(self.secrets.get("EMBEDDING_CACHE_MAX_MB") or DEFAULT_MAX_BYTES // 2**20) * 2**20,
+            )
+        else:
+            self.cache = None
         return None
 
+    @property
+    def model(self) -> TextEmbeddingModel:
+        """
+        SDK embedding model handle of the async path (aget_vertex_embeddings), loaded once
+        per session on first use. The sync path calls the prediction client directly, as
+        only that takes a per-request timeout; loading blocks, so aget_vertex_embeddings
+        loads it in a worker thread.
+        """
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = TextEmbeddingModel.from_pretrained(self.model_name)
+        return self._model
+
     def get_vertex_embedding(self, text_to_embed: str) -> list:
         """
         Get the embedding for a given text.
@@ -42,9 +86,139 @@ class EmbeddingSession:
             list: Array containing embedding dimensions.
         """
 
-        model = TextEmbeddingModel.from_pretrained("text-embedding-004")
-        embedding = model.get_embeddings([text_to_embed])
-        return embedding[0].values
+        return self.get_vertex_embeddings([text_to_embed])[0]
+
+    def get_vertex_embeddings(self, texts: list, task_type: str = None, timeout: float = None) -> list:
+        """
+        Get the embeddings for a list of texts. Cached embeddings are served
+        from the embedding cache, the rest is requested in batches of as many
+        texts as the API limits allow.
+
+        Args:
+            texts (list): The texts to embed.
+            task_type (str): Optional embedding task type, e.g. RETRIEVAL_QUERY.
+            timeout (float): Optional per-request timeout in seconds, e.g. the rest of a query deadline.
+
+        Returns:
+            list: One embedding per input text, in input order.
+        """
+
+        embeddings = []
+        for batch_embeddings in self.iter_vertex_embeddings(texts, task_type, timeout):
+            embeddings.extend(batch_embeddings)
+        return embeddings
+
+    def iter_vertex_embeddings(self, texts: list, task_type: str = None, timeout: float = None):
+        """
+        Embed texts batch by batch, so callers can process each batch as soon
+        as it is ready.
+
+        Args:
+            texts (list): The texts to embed.
+            task_type (str): Optional embedding task type, e.g. RETRIEVAL_QUERY.
+            timeout (float): Optional per-request timeout in seconds.
+
+        Yields:
+            list: The embeddings of the next batch of texts, in input order.
+        """
+
+        for batch in self._batch_texts(texts):
+            yield self._embed_batch(batch, task_type, timeout)
+
+    async def aget_vertex_embeddings(self, texts: list, task_type: str = None) -> list:
+        """
+        Async variant of get_vertex_embeddings, the requests of all batches are in flight concurrently.
+
+        Args:
+            texts (list): The texts to embed.
+            task_type (str): Optional embedding task type, e.g. RETRIEVAL_QUERY.
+
+        Returns:
+            list: One embedding per input text, in input order.
+        """
+
+        embeddings = self.cache.get_many(self.model_name, task_type, texts) if self.cache is not None else [None] * len(texts)
+        missing_texts = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+
+        if missing_texts:
+            if self._model is None:
+                # from_pretrained blocks, keep it off the event loop
+                await asyncio.to_thread(lambda: self.model)
+            batches = list(self._batch_texts(missing_texts))
+            results = await asyncio.gather(*(self._arequest_embeddings(batch, task_type) for batch in batches))
+            fresh_embeddings = [embedding for batch_embeddings in results for embedding in batch_embeddings]
+            if self.cache is not None:
+                self.cache.put_many(self.model_name, task_type, missing_texts, fresh_embeddings)
+
+            fresh_by_text = dict(zip(missing_texts, fresh_embeddings))
+            embeddings = [fresh_by_text[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+
+        return embeddings
+
+    async def _arequest_embeddings(self, batch: list, task_type: str = None) -> list:
+        # one async request for a batch within the API limits
+        with span("embed", model=self.model_name, texts=len(batch), chars=sum(len(text) for text in batch)):
+            if task_type is not None:
+                batch = [TextEmbeddingInput(text=text, task_type=task_type) for text in batch]
+            return [embedding.values for embedding in await self.model.get_embeddings_async(batch)]
+
+    def _embed_batch(self, texts: list, task_type: str = None, timeout: float = None) -> list:
+        # serve a batch from the embedding cache & request only the misses
+        if self.cache is None:
+            return self._request_embeddings(texts, task_type, timeout)
+
+        embeddings = self.cache.get_many(self.model_name, task_type, texts)
+        missing_idx = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+
+        if missing_idx:
+            # identical texts within one call are only embedded once
+            missing_texts = list(dict.fromkeys(texts[idx] for idx in missing_idx))
+            fresh_embeddings = self._request_embeddings(missing_texts, task_type, timeout)
+            self.cache.put_many(self.model_name, task_type, missing_texts, fresh_embeddings)
+
+            fresh_by_text = dict(zip(missing_texts, fresh_embeddings))
+            for idx in missing_idx:
+                embeddings[idx] = fresh_by_text[texts[idx]]
+
+        return embeddings
+
+    def _request_embeddings(self, texts: list, task_type: str = None, timeout: float = None) -> list:
+        # embed texts with the Vertex AI embedding model, one request per batch; the
+        # prediction client is called directly as the SDK model takes no per-call timeout
+        client = get_prediction_client(self.location, self.credentials)
+        endpoint = f"projects/{self.secrets['GCP_PROJECT_ID']}/locations/{self.location}/publishers/google/models/{self.model_name}"
+        embeddings = []
+        for batch in self._batch_texts(texts):
+            with span("embed", model=self.model_name, texts=len(batch), chars=sum(len(text) for text in batch)):
+                instances = [{"content": text} if task_type is None else {"content": text, "task_type": task_type} for text in batch]
+                response = client.predict(
+                    endpoint=endpoint, instances=instances, parameters={"autoTruncate": True}, **rpc_timeout(timeout)
+                )
+                embeddings.extend(list(prediction["embeddings"]["values"]) for prediction in response.predictions)
+        return embeddings
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        # conservative local estimate (~3 characters per token), no network call
+        return min(len(text) // 3 + 1, MAX_TOKENS_PER_TEXT)
+
+    def _batch_texts(self, texts: list):
+        # pack texts into request batches within the per-request count & token limits
+        batch = []
+        batch_tokens = 0
+        for text in texts:
+            tokens = self._estimate_tokens(text)
+            if batch and (
+                len(batch) >= MAX_TEXTS_PER_REQUEST
+                or batch_tokens + tokens > MAX_TOKENS_PER_REQUEST
+            ):
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from rsc.retry import call_with_retry
+except:
+    from retry import call_with_retry
+
+# Firestore allows at most 500 operations per batched write.
+MAX_BATCH_SIZE = 500
+
+
+class FirestoreBulkWriter:
+    """
+    Writes & deletes many Firestore documents with batched commits of at most
+    500 operations, committed in parallel and retried on contention.
+    """
+
+    def __init__(self, client, collection_name: str, max_workers: int = 8,
+                 batch_size: int = MAX_BATCH_SIZE, max_attempts: int = 5):
+        self.client = client
+        self.collection_name = collection_name
+        self.max_workers = max_workers
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_attempts = max_attempts
+
+    def set_documents(self, documents: dict) -> dict:
+        """
+        Set {document id: data} in the collection. Returns write statistics.
+        """
+        collection = self.client.collection(self.collection_name)
+        operations = [("set", collection.document(str(doc_id)), data) for doc_id, data in documents.items()]
+        return self._commit_all(operations)
+
+    def update_documents(self, documents: dict) -> dict:
+        """
+        Update fields of existing documents, {document id: fields}. Returns write statistics.
+        """
+        collection = self.client.collection(self.collection_name)
+        operations = [("update", collection.document(str(doc_id)), data) for doc_id, data in documents.items()]
+        return self._commit_all(operations)
+
+    def delete_documents(self, ids: list) -> dict:
+        """
+        Delete the documents with the given ids from the collection. Returns write statistics.
+        """
+        collection = self.client.collection(self.collection_name)
+        operations = [("delete", collection.document(str(doc_id)), None) for doc_id in ids]
+        return self._commit_all(operations)
+
+    def _commit_batch(self, operations: list) -> int:
+        batch = self.client.batch()
+        for operation, ref, data in operations:
+            if operation == "set":
+                batch.set(ref, data)
+            elif operation == "update":
+                batch.update(ref, data)
+            else:
+                batch.delete(ref)
+        batch.commit()
+        return len(operations)
+
+    def _commit_all(self, operations: list) -> dict:
+        start_time = time.time()
+        batches = [operations[i:i + self.batch_size] for i in range(0, len(operations), self.batch_size)]
+        written = 0
+        failed = 0
+        errors = []
+
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+                futures = [
+                    (executor.submit(call_with_retry, self._commit_batch, batch, max_attempts=self.max_attempts), batch)
+                    for batch in batches
+                ]
+                for future, batch in futures:
+                    try:
+                        written += future.result()
+                    except Exception as e:
+                        failed += len(batch)
+                        errors.append(f"{type(e).__name__}: {e}")
+
+        seconds = time.time() - start_time
+        return {
+            "operations": len(operations),
+            "written": written,
+            "failed": failed,
+            "batches": len(batches),
+            "seconds": seconds,
+            "ops_per_second": written / seconds if seconds > 0 else 0.0,
+            "errors": errors,
+        }
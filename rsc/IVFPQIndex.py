@@ -0,0 +1,282 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+
+import numpy as np
+
+try:
+    from rsc.LocalVectorIndex import LocalVectorIndex
+except:
+    from LocalVectorIndex import LocalVectorIndex
+
+DEFAULT_IVFPQ_INDEX_PATH = ".cache/ivfpq_index"
+DEFAULT_NLIST = 256
+DEFAULT_NPROBE = 16
+DEFAULT_SUBQUANTIZERS = 96  # 8 dimensions per sub-vector for 768-d embeddings
+PQ_CENTROIDS = 256  # one uint8 code per sub-vector
+
+# rows used to train the quantizers
+MAX_COARSE_TRAINING_ROWS = 50000
+MAX_PQ_TRAINING_ROWS = 16384
+
+
+def kmeans(data: np.ndarray, k: int, iterations: int = 8, seed: int = 0) -> np.ndarray:
+    """
+    Lloyd's k-means with squared L2 distance. Empty clusters are re-seeded with random rows.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), k, replace=len(data) < k)].copy()
+    for _ in range(iterations):
+        assignment = assign(data, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = data[rng.choice(len(data), int(empty.sum()))]
+    return centroids
+
+
+def assign(data: np.ndarray, centroids: np.ndarray, block_size: int = 16384) -> np.ndarray:
+    # nearest centroid per row, in blocks to bound the distance matrix size
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignment = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), block_size):
+        block = data[start:start + block_size]
+        assignment[start:start + block_size] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis=1)
+    return assignment
+
+
+class IVFPQIndex(LocalVectorIndex):
+    """
+    Approximate nearest neighbour index: inverted-file partitioning plus
+    product-quantized residuals, on top of the LocalVectorIndex files.
+
+    Every vector is assigned to one of nlist coarse lists, and its residual to
+    the list centroid is stored as one uint8 code per sub-vector (96 bytes
+    instead of 3072 for 768-d float32). A query scores the codes of the nprobe
+    closest lists with per-query lookup tables and re-ranks the best
+    rerank_factor * num_neighbors candidates exactly against the memory-mapped
+    float32 vectors, so only the shortlist is read from disk.
+
+    The quantizers are trained on the stored vectors once train_size rows exist
+    (or by calling train()); later upserts are encoded incrementally. Rows not
+    yet encoded are scored exactly. Deletes are tombstones, as in LocalVectorIndex.
+
+    Extra files in path: ivfpq.npz (quantizers), codes.u8 (codes per row), lists.i32 (list per row).
+    """
+
+    def __init__(self, path: str = DEFAULT_IVFPQ_INDEX_PATH, nlist: int = DEFAULT_NLIST, nprobe: int = DEFAULT_NPROBE,
+                 subquantizers: int = DEFAULT_SUBQUANTIZERS, rerank_factor: int = 10, train_size: int = None):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.subquantizers = subquantizers
+        self.rerank_factor = rerank_factor
+        # ~39 training points per coarse centroid at least
+        self.train_size = train_size or max(39 * nlist, 10000)
+        self._train_lock = threading.Lock()
+        super().__init__(path=path)
+
+    def _file_sizes(self) -> tuple:
+        return super()._file_sizes() + tuple(
+            os.path.getsize(self._file(name)) if os.path.exists(self._file(name)) else 0
+            for name in ("codes.u8", "lists.i32", "ivfpq.npz")
+        )
+
+    def _load(self) -> None:
+        super()._load()
+        self._coarse_centroids = None
+        self._codebooks = None
+        self._codes = np.empty((0, self.subquantizers), dtype=np.uint8)
+        self._lists = np.empty(0, dtype=np.int32)
+        self._inverted = None
+
+        if os.path.exists(self._file("ivfpq.npz")):
+            with np.load(self._file("ivfpq.npz")) as model:
+                self._coarse_centroids = model["coarse_centroids"]
+                self._codebooks = model["codebooks"]
+            self.nlist, self.subquantizers = len(self._coarse_centroids), len(self._codebooks)
+            codes = np.fromfile(self._file("codes.u8"), dtype=np.uint8) if os.path.exists(self._file("codes.u8")) else np.empty(0, np.uint8)
+            lists = np.fromfile(self._file("lists.i32"), dtype=np.int32) if os.path.exists(self._file("lists.i32")) else np.empty(0, np.int32)
+            encoded = min(len(codes) // self.subquantizers, len(lists), len(self._ids))
+            self._codes = codes[:encoded * self.subquantizers].reshape(encoded, self.subquantizers)
+            self._lists = lists[:encoded]
+        return None
+
+    def _discard_partial_writes(self) -> None:
+        # codes & lists of rows whose encoding was interrupted, appended to by _encode_pending otherwise
+        super()._discard_partial_writes()
+        for name, size in (("codes.u8", self._codes.nbytes), ("lists.i32", self._lists.nbytes)):
+            if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) > size:
+                os.truncate(self._file(name), size)
+        return None
+
+    @property
+    def is_trained(self) -> bool:
+        return self._coarse_centroids is not None
+
+    def upsert(self, datapoints: list) -> dict:
+        stats = super().upsert(datapoints)
+        if not self.is_trained and len(self._ids) >= self.train_size:
+            self.train()
+        else:
+            self._encode_pending()
+        return stats
+
+    def train(self, sample: np.ndarray = None) -> None:
+        """
+        Train the coarse & product quantizers on sample (default: the stored vectors) and encode all rows.
+        """
+        with self._train_lock:
+            rng = np.random.default_rng(0)
+            if sample is None:
+                rows = np.flatnonzero(~self._deleted[:len(self._matrix)])
+                rows = np.sort(rng.choice(rows, min(len(rows), MAX_COARSE_TRAINING_ROWS), replace=False))
+                sample = np.asarray(self._matrix[rows], dtype=np.float32)
+            sample = self._normalize(np.asarray(sample, dtype=np.float32))
+            dimensions = sample.shape[1]
+            if dimensions % self.subquantizers:
+                raise ValueError(f"{dimensions} dimensions can not be split into {self.subquantizers} sub-vectors")
+
+            coarse_centroids = kmeans(sample, min(self.nlist, len(sample)))
+            residuals = sample - coarse_centroids[assign(sample, coarse_centroids)]
+            residuals = residuals[rng.choice(len(residuals), min(len(residuals), MAX_PQ_TRAINING_ROWS), replace=False)]
+            sub_dimensions = dimensions // self.subquantizers
+            codebooks = np.stack([
+                kmeans(residuals[:, j * sub_dimensions:(j + 1) * sub_dimensions], PQ_CENTROIDS, seed=j)
+                for j in range(self.subquantizers)
+            ])
+
+            with self._lock:
+                np.savez(self._file("ivfpq.npz.tmp.npz"), coarse_centroids=coarse_centroids, codebooks=codebooks)
+                os.replace(self._file("ivfpq.npz.tmp.npz"), self._file("ivfpq.npz"))
+                for name in ("codes.u8", "lists.i32"):
+                    if os.path.exists(self._file(name)):
+                        os.remove(self._file(name))
+                self._coarse_centroids, self._codebooks = coarse_centroids, codebooks
+                self.nlist = len(coarse_centroids)
+                self._codes = np.empty((0, self.subquantizers), dtype=np.uint8)
+                self._lists = np.empty(0, dtype=np.int32)
+                self._inverted = None
+
+        self._encode_pending()
+        return None
+
+    def _encode(self, vectors: np.ndarray) -> tuple:
+        # coarse list & PQ codes of the residual per (unit-normalized) vector
+        lists = assign(vectors, self._coarse_centroids)
+        residuals = vectors - self._coarse_centroids[lists]
+        sub_dimensions = vectors.shape[1] // self.subquantizers
+        codes = np.empty((len(vectors), self.subquantizers), dtype=np.uint8)
+        for j, codebook in enumerate(self._codebooks):
+            codes[:, j] = assign(residuals[:, j * sub_dimensions:(j + 1) * sub_dimensions], codebook)
+        return lists, codes
+
+    def _encode_pending(self, block_size: int = 16384) -> None:
+        # encode rows appended since the last call
+        if not self.is_trained:
+            return None
+        with self._train_lock:
+            while len(self._codes) < len(self._matrix):
+                start = len(self._codes)
+                vectors = np.asarray(self._matrix[start:start + block_size], dtype=np.float32)
+                lists, codes = self._encode(vectors)
+                with self._lock:
+                    with open(self._file("codes.u8"), "ab") as f:
+                        f.write(codes.tobytes())
+                    with open(self._file("lists.i32"), "ab") as f:
+                        f.write(lists.tobytes())
+                    self._codes = np.concatenate([self._codes, codes])
+                    self._lists = np.concatenate([self._lists, lists])
+                    self._inverted = None
+                    self._sizes = self._file_sizes()
+        return None
+
+    def _compact(self) -> None:
+        live = np.flatnonzero(~self._deleted)
+        encoded_live = live[live < len(self._codes)]
+        codes, lists = self._codes[encoded_live], self._lists[encoded_live]
+        super()._compact()
+        if self.is_trained:
+            codes.tofile(self._file("codes.u8"))
+            lists.tofile(self._file("lists.i32"))
+            self._codes, self._lists, self._inverted = codes, lists, None
+        return None
+
+    def _inverted_lists(self) -> tuple:
+        # rows grouped by coarse list: rows[offsets[l]:offsets[l + 1]] belong to list l
+        if self._inverted is None:
+            rows = np.argsort(self._lists, kind="stable").astype(np.int64)
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(self._lists, minlength=self.nlist))])
+            self._inverted = (rows, offsets)
+        return self._inverted
+
+    def search(self, query_vecs: np.ndarray, num_neighbors: int = 10, nprobe: int = None) -> list:
+        """
+        Approximate top num_neighbors (ids, cosine similarities) per query vector, best first.
+        """
+        self._refresh()
+        if not self.is_trained:
+            return super().search(query_vecs, num_neighbors)
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        with self._lock:
+            matrix, ids, deleted = self._matrix, self._ids, self._deleted
+            codes, lists = self._codes, self._lists
+            coarse_centroids, codebooks = self._coarse_centroids, self._codebooks
+            rows_by_list, offsets = self._inverted_lists()
+
+        queries = self._normalize(np.asarray(query_vecs, dtype=np.float32))
+        sub_dimensions = queries.shape[1] // len(codebooks)
+        subquantizer_idx = np.arange(len(codebooks))
+        # rows appended after the last encoding are scored exactly
+        unencoded = np.arange(len(codes), len(matrix))
+
+        results = []
+        for query in queries:
+            coarse_scores = coarse_centroids @ query
+            probes = np.argpartition(-coarse_scores, nprobe - 1)[:nprobe]
+            candidates = np.concatenate([rows_by_list[offsets[l]:offsets[l + 1]] for l in probes])
+            candidates = candidates[~deleted[candidates]]
+
+            # inner product with the residual codes via per-query lookup tables
+            lookup = np.einsum("md,mkd->mk", query.reshape(len(codebooks), sub_dimensions), codebooks)
+            approximate = coarse_scores[lists[candidates]] + lookup[subquantizer_idx, codes[candidates]].sum(axis=1)
+
+            shortlist_size = min(self.rerank_factor * num_neighbors, len(candidates))
+            if shortlist_size:
+                shortlist = candidates[np.argpartition(-approximate, shortlist_size - 1)[:shortlist_size]]
+            else:
+                shortlist = candidates
+            shortlist = np.concatenate([np.sort(shortlist), unencoded[~deleted[unencoded]]])
+
+            # exact re-ranking on the memory-mapped vectors
+            exact = matrix[shortlist] @ query
+            k = min(num_neighbors, len(shortlist))
+            top = np.argpartition(-exact, k - 1)[:k] if k else shortlist[:0]
+            top = top[np.argsort(-exact[top])]
+            results.append(([ids[row] for row in shortlist[top]], exact[top].tolist()))
+        return results
+
+    def memory_bytes(self) -> dict:
+        """
+        Resident index size (codes, lists & quantizers) vs. a flat float32 matrix of all rows.
+        """
+        quantizers = 0 if not self.is_trained else self._coarse_centroids.nbytes + self._codebooks.nbytes
+        return {
+            "ivfpq": self._codes.nbytes + self._lists.nbytes + quantizers,
+            "flat": len(self._matrix) * (self.dimensions or 0) * 4,
+        }
@@ -0,0 +1,160 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextvars
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class PipelineStage:
+    """
+    One generator stage of an IngestionPipeline. The stage function takes an
+    iterator of input items and yields output items.
+    """
+
+    def __init__(self, name: str, func, max_queue_size: int):
+        self.name = name
+        self.func = func
+        self.input_queue = queue.Queue(maxsize=max_queue_size)
+        self.items_in = 0
+        self.items_out = 0
+        self.wait_seconds = 0.0
+        self.start_time = None
+        self.end_time = None
+        self.max_queue_depth = 0
+
+    def stats(self) -> dict:
+        elapsed = ((self.end_time or time.time()) - self.start_time) if self.start_time else 0.0
+        busy = max(elapsed - self.wait_seconds, 0.0)
+        return {
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "seconds": elapsed,
+            "busy_seconds": busy,
+            "items_per_second": self.items_in / busy if busy > 0 else 0.0,
+            "queue_depth": self.input_queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+class IngestionPipeline:
+    """
+    Runs a source iterator through generator stages connected by bounded queues,
+    one thread per stage. A full queue blocks the stage before it, so at most
+    max_queue_size items wait between two stages and memory stays flat.
+    """
+
+    def __init__(self, source, stages: list, max_queue_size: int = 4):
+        self.source = source
+        self.stages = [PipelineStage(name, func, max_queue_size) for name, func in stages]
+        self._stop = threading.Event()
+        self._errors = []
+
+    def _put(self, q: queue.Queue, item) -> None:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return None
+            except queue.Full:
+                continue
+        raise _Stopped()
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise _Stopped()
+
+    def _inputs(self, stage: PipelineStage):
+        while True:
+            wait_start = time.time()
+            item = self._get(stage.input_queue)
+            stage.wait_seconds += time.time() - wait_start
+            if item is _DONE:
+                return
+            stage.items_in += 1
+            yield item
+
+    def _run_source(self) -> None:
+        first = self.stages[0]
+        try:
+            for item in self.source:
+                self._put(first.input_queue, item)
+                first.max_queue_depth = max(first.max_queue_depth, first.input_queue.qsize())
+            self._put(first.input_queue, _DONE)
+        except _Stopped:
+            pass
+        except Exception as e:
+            self._fail(e)
+
+    def _run_stage(self, idx: int) -> None:
+        stage = self.stages[idx]
+        next_stage = self.stages[idx + 1] if idx + 1 < len(self.stages) else None
+        stage.start_time = time.time()
+        try:
+            for item in stage.func(self._inputs(stage)):
+                stage.items_out += 1
+                if next_stage is not None:
+                    wait_start = time.time()
+                    self._put(next_stage.input_queue, item)
+                    stage.wait_seconds += time.time() - wait_start
+                    next_stage.max_queue_depth = max(next_stage.max_queue_depth, next_stage.input_queue.qsize())
+            if next_stage is not None:
+                self._put(next_stage.input_queue, _DONE)
+        except _Stopped:
+            pass
+        except Exception as e:
+            self._fail(e)
+        finally:
+            stage.end_time = time.time()
+
+    def _fail(self, error: Exception) -> None:
+        self._errors.append(error)
+        self._stop.set()
+
+    def run(self) -> dict:
+        """
+        Run the pipeline to completion. Re-raises the first error of any stage.
+        Returns the per-stage statistics.
+        """
+        # every thread runs in a copy of the caller's context, so stage spans nest under the caller's span
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(self._run_source,), name="pipeline-source", daemon=True)]
+        threads += [
+            threading.Thread(target=contextvars.copy_context().run, args=(self._run_stage, idx), name=f"pipeline-{stage.name}", daemon=True)
+            for idx, stage in enumerate(self.stages)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        return self.stats()
+
+    def stats(self) -> dict:
+        """
+        Per-stage throughput & queue depth; safe to call while the pipeline is running.
+        """
+        return {stage.name: stage.stats() for stage in self.stages}
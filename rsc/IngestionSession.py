@@ -13,27 +13,37 @@
 # limitations under the License.
 
 from rsc.EmbeddingSession import EmbeddingSession
+from rsc.EmbeddedChunk import embed_chunk_batch
+from rsc.FirestoreBulkWriter import FirestoreBulkWriter
+from rsc.VectorIndexWriter import VectorIndexWriter
+from rsc.IngestionPipeline import IngestionPipeline
+from rsc.ClientRegistry import LOCAL_VECTOR_BACKENDS, get_answer_cache, get_lexical_index, get_local_vector_index, get_vector_search_backend
+from rsc.tracing import span
 
 import os
-import json
 from dotenv import dotenv_values
 import io
+import re
+import hashlib
+import contextvars
+import PyPDF2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from google.api_core.client_options import ClientOptions
 from google.cloud import documentai
 from google.cloud import storage
-from google.cloud import aiplatform_v1
 from google.cloud import bigquery
 import google.auth
 
 import firebase_admin
 from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
 
-from langchain.docstore.document import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from rsc.TextChunker import TextChunker
 
 class IngestionSession:
-    def __init__(self, chunk_size=1000, chunk_overlap=50):
+    def __init__(self, chunk_size=1000, chunk_overlap=50, pages_per_ocr_request=5, ocr_concurrency=4, embedding_batch_size=64):
         self.secrets = dotenv_values(".env")
 
         if not firebase_admin._apps:
@@ -51,29 +61,72 @@ class IngestionSession:
         self.docai_processor_version = str(self.secrets["DOCUMENT_AI_PROCESSOR_VERSION"])
         self.gcp_multiregion = str(self.secrets["GCP_MULTIREGION"])
         self.embedding_session = EmbeddingSession()
+        self.firestore_client = firestore.Client(
+            project=self.secrets["GCP_PROJECT_ID"], credentials=self.credentials, database=self.secrets["FIRESTORE_DATABASE_ID"])
+        self.firestore_writer = FirestoreBulkWriter(
+            client=self.firestore_client, collection_name=self.secrets["FIRESTORE_COLLECTION_NAME"])
+        if get_vector_search_backend() in LOCAL_VECTOR_BACKENDS:
+            # same upsert & remove interface as VectorIndexWriter
+            self.vector_index_writer = get_local_vector_index()
+        else:
+            self.vector_index_writer = VectorIndexWriter(
+                credentials=self.credentials,
+                gcp_project_number=self.secrets["GCP_PROJECT_NUMBER"],
+                gcp_region=self.secrets["GCP_REGION"],
+                index_id=self.secrets["VECTOR_SEARCH_INDEX_ID"],
+            )
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        # streaming ingestion mode settings
+        self.streaming = str(self.secrets.get("INGESTION_STREAMING") or "").lower() in ("1", "true", "yes")
+        self.pages_per_ocr_request = pages_per_ocr_request
+        self.ocr_concurrency = ocr_concurrency
+        self.embedding_batch_size = embedding_batch_size
+        self.answer_cache = get_answer_cache()
+        self.lexical_index = get_lexical_index()
+
+    def __call__(self, new_file_name: str, file_to_ingest=None, ingest_local_file: bool = False, ingest_pdf: bool = False, ingest_json: bool = False, ingest_notion_database: bool = False, data_to_ingest=None, notion_page_titles=None, streaming: bool = None, incremental: bool = True, document_text: str = None) -> dict:
+
+        # every span of the ingestion, including those of the pipeline stage threads, nests under "ingest"
+        with span("ingest", document=new_file_name.split("/")[-1], incremental=incremental) as ingest_span:
+            report = self._ingest(new_file_name, file_to_ingest, ingest_local_file, ingest_pdf, ingest_json, ingest_notion_database,
+                                  data_to_ingest, notion_page_titles, streaming, incremental, document_text)
+            ingest_span.set_attributes(reused=report["reused"], recomputed=report["recomputed"], removed=report["removed"])
+        return report
+
+    def _ingest(self, new_file_name: str, file_to_ingest=None, ingest_local_file: bool = False, ingest_pdf: bool = False, ingest_json: bool = False, ingest_notion_database: bool = False, data_to_ingest=None, notion_page_titles=None, streaming: bool = None, incremental: bool = True, document_text: str = None) -> dict:
+
+        # document_text: already extracted PDF text (e.g. from the native text layer), skips OCR
+        if ingest_pdf and document_text is None and (self.streaming if streaming is None else streaming):
+            print("+++++ Upload raw PDF... +++++")
+            self._store_raw_upload(new_file_name=new_file_name, file_to_ingest=file_to_ingest, ingest_local_file=ingest_local_file)
 
-    def __call__(self, new_file_name: str, file_to_ingest=None, ingest_local_file: bool = False, ingest_pdf: bool = False, ingest_json: bool = False, ingest_notion_database: bool = False, data_to_ingest=None, notion_page_titles=None) -> None:
+            print("+++++ Streaming Ingestion... +++++")
+            return self._ingest_pdf_streaming(new_file_name=new_file_name, file_to_ingest=file_to_ingest, ingest_local_file=ingest_local_file, incremental=incremental)
 
         if ingest_pdf:
             print("+++++ Upload raw PDF... +++++")
             self._store_raw_upload(new_file_name=new_file_name, file_to_ingest=file_to_ingest, ingest_local_file=ingest_local_file)
 
-            print("+++++ Document OCR... +++++")
-            document_string = self._ocr_pdf(processor_id=self.docai_processor_id,
-                        processor_version=self.docai_processor_version,
-                        location=self.gcp_multiregion,
-                        file_path=new_file_name,
-                        file_to_ingest=file_to_ingest,
-                        ingest_local_file=ingest_local_file)
-            print (document_string)
+            if document_text is not None:
+                document_string = document_text
+            else:
+                print("+++++ Document OCR... +++++")
+                document_string = self._ocr_pdf(processor_id=self.docai_processor_id,
+                            processor_version=self.docai_processor_version,
+                            location=self.gcp_multiregion,
+                            file_path=new_file_name,
+                            file_to_ingest=file_to_ingest,
+                            ingest_local_file=ingest_local_file)
+                print (document_string)
 
             print("+++++ Chunking Document... +++++")
             list_of_chunks = self._chunk_doc(stringified_doc=document_string,
                                             file_name=new_file_name,
                                             chunk_size=self.chunk_size,
                                             chunk_overlap=self.chunk_overlap)
+            id_prefix = self._chunk_id_prefix(new_file_name)
+            id_suffix = r"\d+"
         elif ingest_notion_database:
             list_of_chunks = [] 
             counter = 0
@@ -88,6 +141,9 @@ class IngestionSession:
                                                 chunk_size=self.chunk_size,
                                                 chunk_overlap=self.chunk_overlap)
                 list_of_chunks.append(chunk[0])
+            # page chunk ids are <database>: <page title>-chunk<index>
+            id_prefix = new_file_name.split("/")[-1] + ': '
+            id_suffix = r"(?:(?!: ).)*-chunk\d+"
                  
 
         elif ingest_json:
@@ -102,23 +158,40 @@ class IngestionSession:
                                             file_name=new_file_name,
                                             chunk_size=self.chunk_size,
                                             chunk_overlap=self.chunk_overlap)
+            id_prefix = self._chunk_id_prefix(new_file_name)
+            id_suffix = r"\d+"
                  
         print (list_of_chunks)
-        print("+++++ Store Embeddings & Document Identifiers in Firestore... +++++")
-        self._firestore_index_embeddings(list_of_chunks)
+        print("+++++ Comparing Chunks with Stored Version... +++++")
+        existing_hashes = self._fetch_existing_chunk_hashes(id_prefix, id_suffix) if incremental else {}
+        changed_chunks, removed_ids = self._diff_chunks(list_of_chunks, existing_hashes)
+        report = {
+            "reused": len(list_of_chunks) - len(changed_chunks),
+            "recomputed": len(changed_chunks),
+            "removed": len(removed_ids),
+        }
+        print(f"Chunks reused: {report['reused']}, recomputed: {report['recomputed']}, removed: {report['removed']}")
+
+        if removed_ids:
+            print("+++++ Removing Stale Chunks... +++++")
+            self._remove_chunks(removed_ids)
 
-        print("+++++ Generating Document Embeddings... +++++")
-        embeddings_to_ingest = self._chunk_to_index_input(list_of_chunks)
+        if changed_chunks:
+            print("+++++ Store Embeddings & Document Identifiers in Firestore... +++++")
+            self._firestore_index_embeddings(changed_chunks)
 
-        print("+++++ Updating Vector Search Index... +++++")
-        self._vector_index_streaming_upsert(embeddings_to_ingest)
+            print("+++++ Generating Document Embeddings & Updating Vector Search Index... +++++")
+            embedded_chunks = self._embed_and_upsert(changed_chunks)
 
-        #print("+++++ Updating BigQuery Index... +++++")
-        #self._bigquery_index_streaming_upsert(list_of_chunks=list_of_chunks, upsert_datapoints=embeddings_to_ingest)
+            # hashes last, so chunks of a failed ingestion are recomputed on the next run
+            self._firestore_commit_hashes(changed_chunks)
+
+            #print("+++++ Updating BigQuery Index... +++++")
+            #self._bigquery_index_streaming_upsert(embedded_chunks)
 
         print("+++++ Ingestion Done. +++++")
 
-        return None
+        return report
 
     def _process_document(
         self,
@@ -160,7 +233,9 @@ class IngestionSession:
             process_options=process_options,
         )
 
-        result = client.process_document(request=request)
+        with span("ocr", bytes=len(image_content), mime_type=mime_type) as ocr_span:
+            result = client.process_document(request=request)
+            ocr_span.set_attribute("chars", len(result.document.text))
 
         return result.document
 
@@ -201,50 +276,212 @@ class IngestionSession:
         return document.text
 
     def _chunk_doc(
-        self, stringified_doc: str, file_name, chunk_size, chunk_overlap
+        self, stringified_doc: str, file_name, chunk_size, chunk_overlap, start_index=0
     ) -> list:
         # method to chunk a given doc
-        doc =  Document(page_content=stringified_doc)
-        doc.metadata["document_name"] = file_name.split("/")[-1]
-
-        text_splitter = RecursiveCharacterTextSplitter(
+        text_chunker = TextChunker(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
             separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
         )
 
-        doc_splits = text_splitter.split_documents([doc])
-
-        for idx, split in enumerate(doc_splits):
-            split.metadata["chunk_identifier"] = (
-                file_name.split("/")[-1].split(".pdf")[0] + "-chunk" + str(idx)
+        with span("chunking", chars=len(stringified_doc), chunk_size=chunk_size) as chunking_span:
+            doc_splits = text_chunker.create_chunks(
+                [stringified_doc], metadatas=[{"document_name": file_name.split("/")[-1]}]
             )
+            chunking_span.set_attribute("chunks", len(doc_splits))
+
+        for idx, split in enumerate(doc_splits, start=start_index):
+            split.metadata["chunk_identifier"] = self._chunk_id_prefix(file_name) + str(idx)
 
         return doc_splits
 
-    def _generate_embedding(self, text_to_embed):
-        # method to generate embedding for a given text
-        embedding = self.embedding_session.get_vertex_embedding(
-            text_to_embed=text_to_embed
+    @staticmethod
+    def _chunk_id_prefix(file_name: str) -> str:
+        # chunk identifiers are <file name without .pdf>-chunk<index>; being positional, an
+        # inserted paragraph shifts the ids of all following chunks, which are then rewritten
+        # (their embeddings still come from the embedding cache)
+        return file_name.split("/")[-1].split(".pdf")[0] + "-chunk"
+
+    @staticmethod
+    def _content_hash(page_content: str) -> str:
+        return hashlib.sha256(page_content.encode("utf-8")).hexdigest()
+
+    def _fetch_existing_chunk_hashes(self, id_prefix: str, id_suffix: str = r"\d+") -> dict:
+        # {chunk id: content hash} of the stored chunks id_prefix + id_suffix (a regex); the range
+        # query also returns other documents sharing the prefix (a-chunky.pdf for a.pdf), which
+        # must not be diffed against & deleted
+        own_id = re.compile(re.escape(id_prefix) + id_suffix)
+        query = (
+            self.firestore_client.collection(self.secrets["FIRESTORE_COLLECTION_NAME"])
+            .where(filter=FieldFilter("id", ">=", id_prefix))
+            .where(filter=FieldFilter("id", "<", id_prefix + "\uf8ff"))
+            .select(["content_hash"])
         )
-        return embedding
+        return {
+            snapshot.id: (snapshot.to_dict() or {}).get("content_hash")
+            for snapshot in query.stream()
+            if own_id.fullmatch(snapshot.id)
+        }
 
-    def _chunk_to_index_input(self, list_of_chunks: list) -> list:
-        # turning chunk strings into jsons ready to be indexed by vector search
-
-        # generate embeddings & merge with chunk embedding identifier
-        embedded_docs = [
-            json.dumps(
-                {
-                    "id": d.metadata["chunk_identifier"],
-                    "embedding": self._generate_embedding(d.page_content),
-                }
-            )
-            + "\n"
-            for d in list_of_chunks
+    def _diff_chunks(self, list_of_chunks: list, existing_hashes: dict) -> tuple:
+        """
+        Compare chunks against the stored chunk hashes.
+
+        Returns the new or changed chunks & the ids of stored chunks that no longer exist.
+        """
+        changed_chunks = [
+            chunk for chunk in list_of_chunks
+            if existing_hashes.get(chunk.metadata["chunk_identifier"]) != self._content_hash(chunk.page_content)
         ]
+        new_ids = {chunk.metadata["chunk_identifier"] for chunk in list_of_chunks}
+        removed_ids = [chunk_id for chunk_id in existing_hashes if chunk_id not in new_ids]
+        return changed_chunks, removed_ids
+
+    def _remove_chunks(self, ids_to_remove: list) -> None:
+        # remove stale chunks from firestore & the vector search index
+        firestore_stats = self.firestore_writer.delete_documents(ids_to_remove)
+        vector_stats = self.vector_index_writer.remove(ids_to_remove)
+
+        if firestore_stats["failed"] or vector_stats["failed"]:
+            raise RuntimeError(f"Failed to remove stale chunks: {firestore_stats['errors'] + vector_stats['errors']}")
+
+        if self.lexical_index is not None:
+            self.lexical_index.remove(ids_to_remove)
+
+        print(f"Removed {len(ids_to_remove)} stale chunks")
+        self._invalidate_cached_answers(ids_to_remove)
+        return None
+
+    def _invalidate_cached_answers(self, chunk_ids: list) -> None:
+        # drop cached answers built from chunks that were changed or removed
+        if self.answer_cache is not None and chunk_ids:
+            invalidated = self.answer_cache.invalidate_chunks(chunk_ids)
+            if invalidated:
+                print(f"Invalidated {invalidated} cached answers")
+        return None
+
+    def _ingest_pdf_streaming(self, new_file_name: str, file_to_ingest=None, ingest_local_file: bool = False, incremental: bool = True) -> dict:
+        """
+        Streaming ingestion: OCR page groups -> chunks -> embedding batches -> firestore & vector search.
+
+        The stages run concurrently, connected by bounded queues, so memory stays flat
+        and the first chunks are searchable while later pages are still being OCR'd.
+        Returns the chunk diff counts and per-stage throughput & queue depth statistics.
+        """
+        if ingest_local_file:
+            with open(new_file_name, "rb") as f:
+                file_to_ingest = f.read()
+
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_to_ingest))
+        num_pages = len(pdf_reader.pages)
+
+        existing_hashes = self._fetch_existing_chunk_hashes(self._chunk_id_prefix(new_file_name)) if incremental else {}
+        seen_ids = set()
+        report = {"reused": 0, "recomputed": 0, "removed": 0}
+
+        def page_groups():
+            for first_page in range(0, num_pages, self.pages_per_ocr_request):
+                pdf_writer = PyPDF2.PdfWriter()
+                for page_num in range(first_page, min(first_page + self.pages_per_ocr_request, num_pages)):
+                    pdf_writer.add_page(pdf_reader.pages[page_num])
+                tmp = io.BytesIO()
+                pdf_writer.write(tmp)
+                yield tmp.getvalue()
+
+        def ocr_page_group(page_group_file):
+            return self._ocr_pdf(processor_id=self.docai_processor_id,
+                                 processor_version=self.docai_processor_version,
+                                 location=self.gcp_multiregion,
+                                 file_path=new_file_name,
+                                 file_to_ingest=page_group_file,
+                                 ingest_local_file=False)
+
+        def ocr_stage(page_group_files):
+            # keep up to ocr_concurrency requests in flight, yielding texts in page order
+            with ThreadPoolExecutor(max_workers=self.ocr_concurrency) as executor:
+                in_flight = deque()
+                for page_group_file in page_group_files:
+                    # the OCR spans nest under the ingestion span, as in the stage threads
+                    in_flight.append(executor.submit(contextvars.copy_context().run, ocr_page_group, page_group_file))
+                    if len(in_flight) >= self.ocr_concurrency:
+                        yield in_flight.popleft().result()
+                while in_flight:
+                    yield in_flight.popleft().result()
+
+        def chunking_stage(page_group_texts):
+            next_index = 0
+            for text in page_group_texts:
+                chunks = self._chunk_doc(stringified_doc=text,
+                                         file_name=new_file_name,
+                                         chunk_size=self.chunk_size,
+                                         chunk_overlap=self.chunk_overlap,
+                                         start_index=next_index)
+                next_index += len(chunks)
+
+                # only new or changed chunks continue to embedding
+                seen_ids.update(chunk.metadata["chunk_identifier"] for chunk in chunks)
+                changed_chunks, _ = self._diff_chunks(chunks, existing_hashes)
+                report["reused"] += len(chunks) - len(changed_chunks)
+                report["recomputed"] += len(changed_chunks)
+                yield changed_chunks
+
+        def embedding_stage(chunk_lists):
+            batch = []
+            for chunks in chunk_lists:
+                batch.extend(chunks)
+                while len(batch) >= self.embedding_batch_size:
+                    yield batch[:self.embedding_batch_size], self._chunk_to_index_input(batch[:self.embedding_batch_size])
+                    batch = batch[self.embedding_batch_size:]
+            if batch:
+                yield batch, self._chunk_to_index_input(batch)
+
+        def sink_stage(embedded_batches):
+            for chunks, embedded_chunks in embedded_batches:
+                # firestore first, so every vector search match can be resolved to its content
+                self._firestore_index_embeddings(chunks)
+                self._vector_index_streaming_upsert(embedded_chunks)
+                self._firestore_commit_hashes(chunks)
+                yield len(chunks)
+
+        pipeline = IngestionPipeline(
+            source=page_groups(),
+            stages=[
+                ("ocr", ocr_stage),
+                ("chunking", chunking_stage),
+                ("embedding", embedding_stage),
+                ("sink", sink_stage),
+            ],
+        )
+        report["stages"] = pipeline.run()
+
+        removed_ids = [chunk_id for chunk_id in existing_hashes if chunk_id not in seen_ids]
+        if removed_ids:
+            self._remove_chunks(removed_ids)
+        report["removed"] = len(removed_ids)
+
+        for stage_name, stage_stats in report["stages"].items():
+            print(f"{stage_name}: {stage_stats['items_in']} in, {stage_stats['items_out']} out, "
+                  f"{stage_stats['items_per_second']:.1f} items/sec, max queue depth {stage_stats['max_queue_depth']}")
+        print(f"Chunks reused: {report['reused']}, recomputed: {report['recomputed']}, removed: {report['removed']}")
+        print("+++++ Ingestion Done. +++++")
+
+        return report
+
+    def _chunk_to_index_input(self, list_of_chunks: list) -> list:
+        # turning chunks into embedded chunk records ready to be indexed by vector search
 
-        return embedded_docs
+        # generate embeddings in batched requests & merge with chunk embedding identifier
+        embeddings = self.embedding_session.get_vertex_embeddings(
+            [d.page_content for d in list_of_chunks]
+        )
+
+        embedded_chunks = embed_chunk_batch(list_of_chunks, embeddings)
+
+        if self.embedding_session.cache is not None:
+            print(f"Embedding cache: {self.embedding_session.cache.stats()}")
+
+        return embedded_chunks
 
     def _store_raw_upload(
         self, new_file_name: str, file_to_ingest, ingest_local_file: bool = False
@@ -297,85 +534,109 @@ class IngestionSession:
 
 
     def _firestore_index_embeddings(self, doc_splits: list) -> None:
-        # upload embeddings to firestore
+        # upload chunk contents & identifiers to firestore in batched commits; the content
+        # hash is left out until the vector search upsert succeeded (_firestore_commit_hashes)
 
-        if not firebase_admin._apps:
-            credentials = firebase_admin.credentials.Certificate(
-                self.secrets["GCP_CREDENTIAL_FILE"]
-            )
-            app = firebase_admin.initialize_app(credentials)
-
-        db = firestore.Client(project=self.secrets["GCP_PROJECT_ID"], credentials=self.credentials, database=self.secrets["FIRESTORE_DATABASE_ID"])
-    
-        for split in doc_splits:
-            data = {
+        documents = {
+            str(split.metadata["chunk_identifier"]): {
                 "id": split.metadata["chunk_identifier"],
                 "document_name": split.metadata["document_name"],
                 "page_content": split.page_content,
             }
+            for split in doc_splits
+        }
+
+        with span("firestore_write", chunks=len(documents),
+                  bytes=sum(len(data["page_content"].encode("utf-8")) for data in documents.values())) as write_span:
+            stats = self.firestore_writer.set_documents(documents)
+            write_span.set_attributes(batches=stats["batches"], failed=stats["failed"])
+
+        print(f"Added {stats['written']} chunks to firestore in {stats['batches']} batches "
+              f"({stats['ops_per_second']:.1f} writes/sec, {stats['failed']} failed)")
+
+        if stats["failed"]:
+            raise RuntimeError(f"Failed to write {stats['failed']} chunks to firestore: {stats['errors']}")
+
+        # keep the BM25 index in sync with the stored chunk contents
+        if self.lexical_index is not None:
+            self.lexical_index.upsert([(doc_id, data["page_content"]) for doc_id, data in documents.items()])
+
+        self._invalidate_cached_answers(list(documents))
+        return None
 
-            # Add a new doc in collection with embedding, doc name & chunk identifier
-            db.collection(self.secrets["FIRESTORE_COLLECTION_NAME"]).document(
-                str(split.metadata["chunk_identifier"])
-            ).set(data)
+    def _firestore_commit_hashes(self, doc_splits: list) -> None:
+        # mark chunks as up to date, so incremental re-ingestion can reuse them
+        stats = self.firestore_writer.update_documents({
+            str(split.metadata["chunk_identifier"]): {"content_hash": self._content_hash(split.page_content)}
+            for split in doc_splits
+        })
 
-        print(f"Added {[split.metadata['chunk_identifier'] for split in doc_splits]}")
+        if stats["failed"]:
+            raise RuntimeError(f"Failed to store {stats['failed']} chunk hashes in firestore: {stats['errors']}")
 
         return None
 
-    def _vector_index_streaming_upsert(self, upsert_datapoints: list) -> None:
+    def _embed_and_upsert(self, list_of_chunks: list) -> list:
+        # embed chunks batch by batch & upsert each batch as soon as its embeddings are ready
+        embedded_chunks = []
+
+        def datapoint_batches():
+            start = 0
+            texts = [d.page_content for d in list_of_chunks]
+            for embeddings in self.embedding_session.iter_vertex_embeddings(texts):
+                batch_chunks = embed_chunk_batch(list_of_chunks[start:start + len(embeddings)], embeddings)
+                start += len(embeddings)
+
+                embedded_chunks.extend(batch_chunks)
+                yield [(chunk.id, chunk.vector) for chunk in batch_chunks]
+
+        # the embedding requests stream into the upsert, their "embed" spans nest under it
+        with span("upsert", backend=get_vector_search_backend(), chunks=len(list_of_chunks)) as upsert_span:
+            stats = self.vector_index_writer.upsert_stream(datapoint_batches())
+            upsert_span.set_attributes(datapoints=stats["sent"], requests=stats["requests"], failed=stats["failed"])
+        self._check_upsert_stats(stats)
+
+        if self.embedding_session.cache is not None:
+            print(f"Embedding cache: {self.embedding_session.cache.stats()}")
+
+        return embedded_chunks
+
+    def _vector_index_streaming_upsert(self, embedded_chunks: list) -> None:
         # method to upsert embeddings to vector search index
 
+        with span("upsert", backend=get_vector_search_backend(), chunks=len(embedded_chunks)) as upsert_span:
+            stats = self.vector_index_writer.upsert([(chunk.id, chunk.vector) for chunk in embedded_chunks])
+            upsert_span.set_attributes(datapoints=stats["sent"], requests=stats["requests"], failed=stats["failed"])
+        self._check_upsert_stats(stats)
 
-        index_client = aiplatform_v1.IndexServiceClient(credentials=self.credentials, client_options=dict(
-            api_endpoint=f"{self.secrets['GCP_REGION']}-aiplatform.googleapis.com"
-        ))
-
-        index_name = f"projects/{self.secrets['GCP_PROJECT_NUMBER']}/locations/{self.secrets['GCP_REGION']}/indexes/{self.secrets['VECTOR_SEARCH_INDEX_ID']}"
-        insert_datapoints_payload = []
-        for dp in upsert_datapoints:
-            dp_dict = json.loads(dp)
-            insert_datapoints_payload.append(
-                aiplatform_v1.IndexDatapoint(
-                    datapoint_id=dp_dict["id"],
-                    feature_vector=dp_dict["embedding"],
-                    restricts=[],
-                )
-            )
-          
-        upsert_request = aiplatform_v1.UpsertDatapointsRequest(index=index_name, datapoints=insert_datapoints_payload)
-        print('test3')
-        index_client.upsert_datapoints(request=upsert_request)
+        return None
+
+    def _check_upsert_stats(self, stats: dict) -> None:
+        print(f"Upserted {stats['sent']} datapoints in {stats['requests']} requests "
+              f"({stats['seconds']:.1f}s, {stats['failed']} failed)")
+
+        if stats["failed"]:
+            raise RuntimeError(f"Failed to upsert {stats['failed']} datapoints to vector search: {stats['errors']}")
 
         return None
     
-    def _bigquery_index_streaming_upsert(self, list_of_chunks: list, upsert_datapoints: list) -> None:
-        """Appends a single data point (dictionary) to a BigQuery table.
+    def _bigquery_index_streaming_upsert(self, embedded_chunks: list) -> None:
+        """Appends embedded chunks as rows to a BigQuery table.
         Args:
-            project_id (str): Google Cloud project ID.
-            dataset_id (str): BigQuery dataset ID.
-            table_id (str): BigQuery table ID.
-            data (dict): A dictionary representing a single row of data.
+            embedded_chunks (list): EmbeddedChunk records to insert.
         """
-        if len(list_of_chunks) != len(upsert_datapoints):
-            raise ValueError("list_of_chunks and upsert_datapoints must be of the same length"
-            )
-
         client = bigquery.Client(project=self.project_id, credentials=self.credentials, location=self.secrets['BIGQUERY_LOCATION'])
         table_ref = f"{self.secrets['BIGQUERY_DATASET']}.{self.secrets['BIGQUERY_TABLE']}"
         
-        rows_to_insert = []
-
-        for count, dp in enumerate(upsert_datapoints):
-            dp_dict = json.loads(dp)
-                    
-            bq_row = {
-                "id": dp_dict["id"],
-                "document_name": list_of_chunks[count].metadata["document_name"],
-                "page_content": list_of_chunks[count].page_content,
-                "embedding": dp_dict["embedding"],
+        rows_to_insert = [
+            {
+                "id": chunk.id,
+                "document_name": chunk.document_name,
+                "page_content": chunk.content,
+                "embedding": chunk.vector.tolist(),
             }
-            rows_to_insert.append(bq_row)
+            for chunk in embedded_chunks
+        ]
 
         errors = client.insert_rows_json(table_ref, rows_to_insert)
         if errors == []:
@@ -384,6 +645,30 @@ class IngestionSession:
             print("Encountered errors while inserting rows: {}".format(errors))
         return None
 
+    def backfill_lexical_index(self, batch_size: int = 500) -> int:
+        """
+        Add every chunk stored in Firestore to the BM25 index, e.g. chunks ingested
+        before the lexical index was enabled. Chunks already indexed are replaced.
+
+        Returns the number of indexed chunks.
+        """
+        if self.lexical_index is None:
+            raise ValueError("The lexical index is disabled (LEXICAL_INDEX_DISABLED is set)")
+
+        query = self.firestore_client.collection(self.secrets["FIRESTORE_COLLECTION_NAME"]).select(["page_content"])
+        count = 0
+        batch = []
+        for snapshot in query.stream():
+            batch.append((snapshot.id, (snapshot.to_dict() or {}).get("page_content") or ""))
+            if len(batch) == batch_size:
+                count += self.lexical_index.upsert(batch)["sent"]
+                batch = []
+        if batch:
+            count += self.lexical_index.upsert(batch)["sent"]
+
+        print(f"Added {count} chunks to the lexical index")
+        return count
+
 
 if __name__ == "__main__":
     cwd = os.getcwd()
@@ -0,0 +1,435 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Registry of LLM backends.
+
+Every model offered to the sessions is a registered provider with a long-lived
+client, declared limits and a uniform generate / stream / agenerate interface.
+New models are added with register_llm_backend, without touching LLMSession.
+"""
+
+import asyncio
+import threading
+import time
+
+from google.cloud.aiplatform import initializer
+
+try:
+    from rsc import ClientRegistry
+    from rsc.ContextBuilder import estimate_tokens
+    from rsc.hedging import DeadlineExceeded, rpc_timeout
+    from rsc.tracing import get_tracer, span
+except:
+    import ClientRegistry
+    from ContextBuilder import estimate_tokens
+    from hedging import DeadlineExceeded, rpc_timeout
+    from tracing import get_tracer, span
+
+
+class LLMBackend:
+    """
+    Base class of the LLM providers.
+
+    Subclasses declare their limits and implement _generate, _stream and
+    optionally _agenerate (which defaults to _generate in a worker thread).
+    The optional timeout (seconds) is passed on to the provider request; a stream
+    is ended with DeadlineExceeded once it runs longer than the timeout.
+    Requests, errors, latency & estimated token counts are collected per backend.
+    """
+
+    context_tokens = 8192  # prompt + output tokens the model accepts
+    max_output_tokens = 1024
+    supports_images = False
+    supports_streaming = True
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0,
+            "errors": 0,
+            "prompt_tokens": 0,
+            "output_tokens": 0,
+            "seconds": 0.0,
+            "streams": 0,
+            "first_token_seconds": 0.0,
+        }
+
+    def generate(self, prompt: str, image: bytes = None, timeout: float = None, **generation_config) -> str:
+        """
+        Answer text of prompt (and image, if supported).
+        """
+        start_time = time.perf_counter()
+        with span("llm", model=self.name, stream=False) as llm_span:
+            try:
+                text = self._generate(prompt, self._image(image), self._generation_config(generation_config), timeout)
+            except Exception:
+                self._count(errors=1)
+                raise
+            self._count(prompt_tokens=estimate_tokens(prompt), output_tokens=estimate_tokens(text), seconds=time.perf_counter() - start_time)
+            llm_span.set_attributes(prompt_tokens=estimate_tokens(prompt), output_tokens=estimate_tokens(text))
+        return text
+
+    def stream(self, prompt: str, image: bytes = None, timeout: float = None, **generation_config):
+        """
+        Yield the answer text as deltas while it is generated. Backends without
+        streaming support yield the whole answer at once.
+        """
+        if not self.supports_streaming:
+            yield self.generate(prompt, image, timeout, **generation_config)
+            return
+
+        start_time = time.perf_counter()
+        first_token_seconds = None
+        output_tokens = 0
+        deltas = self._stream(prompt, self._image(image), self._generation_config(generation_config), timeout)
+        try:
+            for delta in deltas:
+                if first_token_seconds is None:
+                    first_token_seconds = time.perf_counter() - start_time
+                output_tokens += estimate_tokens(delta)
+                yield delta
+                # the timeout bounds the whole stream, not only each read
+                if timeout is not None and time.perf_counter() - start_time > timeout:
+                    raise DeadlineExceeded("llm_stream", timeout)
+        except Exception:
+            self._count(errors=1)
+            raise
+        finally:
+            deltas.close()
+        self._count(
+            prompt_tokens=estimate_tokens(prompt), output_tokens=output_tokens, seconds=time.perf_counter() - start_time,
+            streams=1, first_token_seconds=first_token_seconds or 0.0,
+        )
+        # streams may be consumed across threads, so the span is recorded once finished
+        get_tracer().record(
+            "llm", time.perf_counter() - start_time, model=self.name, stream=True, prompt_tokens=estimate_tokens(prompt),
+            output_tokens=output_tokens, first_token_seconds=first_token_seconds,
+        )
+
+    async def agenerate(self, prompt: str, image: bytes = None, timeout: float = None, **generation_config) -> str:
+        """
+        Async variant of generate. The timeout also cancels requests of clients without one.
+        """
+        start_time = time.perf_counter()
+        with span("llm", model=self.name, stream=False) as llm_span:
+            try:
+                text = await asyncio.wait_for(
+                    self._agenerate(prompt, self._image(image), self._generation_config(generation_config), timeout), timeout
+                )
+            except Exception:
+                self._count(errors=1)
+                raise
+            self._count(prompt_tokens=estimate_tokens(prompt), output_tokens=estimate_tokens(text), seconds=time.perf_counter() - start_time)
+            llm_span.set_attributes(prompt_tokens=estimate_tokens(prompt), output_tokens=estimate_tokens(text))
+        return text
+
+    def warm_up(self, loop=None) -> None:
+        # create the clients ahead of the first request, the async ones for loop
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+        completed = stats["requests"] - stats["errors"]
+        stats["mean_seconds"] = stats["seconds"] / completed if completed else 0.0
+        stats["mean_first_token_seconds"] = stats["first_token_seconds"] / stats["streams"] if stats["streams"] else 0.0
+        return stats
+
+    def _count(self, **counts) -> None:
+        with self._lock:
+            self._counters["requests"] += 1
+            for counter, value in counts.items():
+                self._counters[counter] += value
+        return None
+
+    def _image(self, image: bytes):
+        if image is not None and not self.supports_images:
+            print(f"+++++ {self.name} does not support images, answering from the text only. +++++")
+            return None
+        return image
+
+    def _generation_config(self, generation_config: dict) -> dict:
+        # requested output length, capped at the model limit
+        config = dict(generation_config)
+        config["max_output_tokens"] = min(config.get("max_output_tokens") or self.max_output_tokens, self.max_output_tokens)
+        return config
+
+    def _generate(self, prompt: str, image, generation_config: dict, timeout: float = None) -> str:
+        raise NotImplementedError
+
+    def _stream(self, prompt: str, image, generation_config: dict, timeout: float = None):
+        raise NotImplementedError
+
+    async def _agenerate(self, prompt: str, image, generation_config: dict, timeout: float = None) -> str:
+        return await asyncio.to_thread(self._generate, prompt, image, generation_config, timeout)
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Gemini models on Vertex AI. Blocking & streamed requests go through the
+    prediction client, which takes a per-call timeout; async ones through the SDK model.
+    """
+
+    def __init__(self, name: str, model_version: str, context_tokens: int, max_output_tokens: int, supports_images: bool):
+        super().__init__(name)
+        self.model_version = model_version
+        self.context_tokens = context_tokens
+        self.max_output_tokens = max_output_tokens
+        self.supports_images = supports_images
+
+    @property
+    def model(self):
+        return ClientRegistry.get_generative_model(self.model_version)
+
+    @property
+    def client(self):
+        return ClientRegistry.get_prediction_client(initializer.global_config.location, _credentials())
+
+    def warm_up(self, loop=None) -> None:
+        if loop is not None:
+            self.model
+        else:
+            self.client
+        return None
+
+    def _request(self, prompt: str, image, generation_config: dict):
+        from google.cloud import aiplatform_v1
+
+        parts = [aiplatform_v1.Part(text=prompt)]
+        if image is not None:
+            parts.insert(0, aiplatform_v1.Part(inline_data=aiplatform_v1.Blob(mime_type="image/png", data=image)))
+        return aiplatform_v1.GenerateContentRequest(
+            model=f"projects/{_project_id()}/locations/{initializer.global_config.location}/publishers/google/models/{self.model_version}",
+            contents=[aiplatform_v1.Content(role="user", parts=parts)],
+            generation_config=aiplatform_v1.GenerationConfig(**generation_config),
+        )
+
+    @staticmethod
+    def _text(response) -> str:
+        # responses without candidates or text, e.g. the final safety ratings, have no text
+        if not response.candidates:
+            return ""
+        return "".join(part.text for part in response.candidates[0].content.parts)
+
+    def _generate(self, prompt: str, image, generation_config: dict, timeout: float = None) -> str:
+        return self._text(self.client.generate_content(request=self._request(prompt, image, generation_config), **rpc_timeout(timeout)))
+
+    def _stream(self, prompt: str, image, generation_config: dict, timeout: float = None):
+        responses = self.client.stream_generate_content(request=self._request(prompt, image, generation_config), **rpc_timeout(timeout))
+        for response in responses:
+            text = self._text(response)
+            if text:
+                yield text
+
+    async def _agenerate(self, prompt: str, image, generation_config: dict, timeout: float = None) -> str:
+        return (await self.model.generate_content_async(self._contents(prompt, image), generation_config=generation_config)).text
+
+    @staticmethod
+    def _contents(prompt: str, image):
+        if image is None:
+            return prompt
+        from vertexai.preview.generative_models import Part
+
+        return [Part.from_data(mime_type="image/png", data=image), prompt]
+
+
+class AnthropicVertexBackend(LLMBackend):
+    """
+    Claude models on Vertex AI.
+    """
+
+    def __init__(self, name: str, model: str, region: str, context_tokens: int, max_output_tokens: int):
+        super().__init__(name)
+        self.model = model
+        self.region = region
+        self.context_tokens = context_tokens
+        self.max_output_tokens = max_output_tokens
+
+    def warm_up(self, loop=None) -> None:
+        if loop is not None:
+            ClientRegistry.get_async_anthropic_client(region=self.region, project_id=_project_id(), loop=loop)
+        else:
+            ClientRegistry.get_anthropic_client(region=self.region, project_id=_project_id())
+        return None
+
+    def _request(self, prompt: str, generation_config: dict, timeout: float = None) -> dict:
+        request = {
+            "model": self.model,
+            "max_tokens": generation_config["max_output_tokens"],
+            "messages": [{"role": "user", "content": prompt}],
+            **rpc_timeout(timeout),
+        }
+        for parameter in ("temperature", "top_p", "top_k"):
+            if generation_config.get(parameter) is not None:
+                request[parameter] = generation_config[parameter]
+        return request
+
+    def _generate(self, prompt: str, image, generation_config: dict, timeout: float = None) -> str:
+        client = ClientRegistry.get_anthropic_client(region=self.region, project_id=_project_id())
+        return client.messages.create(**self._request(prompt, generation_config, timeout)).content[0].text
+
+    def _stream(self, prompt: str, image, generation_config: dict, timeout: float = None):
+        client = ClientRegistry.get_anthropic_client(region=self.region, project_id=_project_id())
+        with client.messages.stream(**self._request(prompt, generation_config, timeout)) as stream:
+            for text in stream.text_stream:
+                yield text
+
+    async def _agenerate(self, prompt: str, image, generation_config: dict, timeout: float = None) -> str:
+        client = ClientRegistry.get_async_anthropic_client(
+            region=self.region, project_id=_project_id(), loop=asyncio.get_running_loop()
+        )
+        return (await client.messages.create(**self._request(prompt, generation_config, timeout))).content[0].text
+
+
+class VertexTextBackend(LLMBackend):
+    """
+    PaLM text models (text-bison, text-unicorn). Blocking requests go through the
+    prediction client, which takes a per-call timeout; streamed & async ones through
+    langchain's VertexAI wrapper.
+    """
+
+    def __init__(self, name: str, context_tokens: int = 8192, max_output_tokens: int = 1024):
+        super().__init__(name)
+        self.context_tokens = context_tokens
+        self.max_output_tokens = max_output_tokens
+
+    def _llm(self, generation_config: dict):
+        from langchain_community.llms import VertexAI
+
+        # one wrapper per generation config, as VertexAI holds the parameters
+        return ClientRegistry.get_or_create(
+            "vertexai_llm",
+            (self.name,) + tuple(sorted(generation_config.items())),
+            lambda: VertexAI(model_name=self.name, verbose=True, **generation_config),
+        )
+
+    def _generate(self, prompt: str, image, generation_config: dict, timeout: float = None) -> str:
+        parameters = {"maxOutputTokens": generation_config["max_output_tokens"]}
+        for key, parameter in (("temperature", "temperature"), ("topP", "top_p"), ("topK", "top_k")):
+            if generation_config.get(parameter) is not None:
+                parameters[key] = generation_config[parameter]
+
+        location = initializer.global_config.location
+        response = ClientRegistry.get_prediction_client(location, _credentials()).predict(
+            endpoint=f"projects/{_project_id()}/locations/{location}/publishers/google/models/{self.name}",
+            instances=[{"prompt": prompt}],
+            parameters=parameters,
+            **rpc_timeout(timeout),
+        )
+        return response.predictions[0]["content"]
+
+    def _stream(self, prompt: str, image, generation_config: dict, timeout: float = None):
+        for text in self._llm(generation_config).stream(prompt):
+            yield text
+
+    async def _agenerate(self, prompt: str, image, generation_config: dict, timeout: float = None) -> str:
+        return await self._llm(generation_config).ainvoke(prompt)
+
+
+class EchoBackend(LLMBackend):
+    """
+    Local backend without any network call, for tests & benchmarks.
+
+    Answers with the question and the start of the context found in the prompt,
+    streamed word by word, after the configured simulated latencies.
+    """
+
+    context_tokens = 1000000
+    max_output_tokens = 8192
+    supports_images = True
+
+    def __init__(self, name: str = "echo", first_token_seconds: float = 0.0, token_seconds: float = 0.0):
+        super().__init__(name)
+        self.first_token_seconds = first_token_seconds
+        self.token_seconds = token_seconds
+
+    def _answer(self, prompt: str, generation_config: dict) -> list:
+        words = ("Echo: " + " ".join(prompt.split())).split(" ")
+        return [word + " " for word in words[: generation_config["max_output_tokens"]]]
+
+    def _generate(self, prompt: str, image, generation_config: dict, timeout: float = None) -> str:
+        return "".join(self._stream(prompt, image, generation_config))
+
+    def _stream(self, prompt: str, image, generation_config: dict, timeout: float = None):
+        if self.first_token_seconds:
+            time.sleep(self.first_token_seconds)
+        for index, word in enumerate(self._answer(prompt, generation_config)):
+            if index and self.token_seconds:
+                time.sleep(self.token_seconds)
+            yield word
+
+    async def _agenerate(self, prompt: str, image, generation_config: dict, timeout: float = None) -> str:
+        await asyncio.sleep(self.first_token_seconds)
+        words = self._answer(prompt, generation_config)
+        await asyncio.sleep(self.token_seconds * max(len(words) - 1, 0))
+        return "".join(words)
+
+
+def _project_id() -> str:
+    return str(ClientRegistry.get_secrets()["GCP_PROJECT_ID"])
+
+
+def _credentials():
+    return ClientRegistry.get_credentials(ClientRegistry.get_secrets()["GCP_CREDENTIAL_FILE"])[0]
+
+
+# model name -> factory of its backend
+LLM_BACKENDS = {
+    "gemini-1.0-pro": lambda: GeminiBackend("gemini-1.0-pro", "gemini-1.0-pro-002", context_tokens=32760, max_output_tokens=8192, supports_images=False),
+    "gemini-1.5-pro": lambda: GeminiBackend("gemini-1.5-pro", "gemini-1.5-pro-001", context_tokens=1048576, max_output_tokens=8192, supports_images=True),
+    "gemini-1.5-flash": lambda: GeminiBackend("gemini-1.5-flash", "gemini-1.5-flash-001", context_tokens=1048576, max_output_tokens=8192, supports_images=True),
+    "claude3-sonnet": lambda: AnthropicVertexBackend("claude3-sonnet", "claude-3-sonnet@20240229", region="us-central1", context_tokens=200000, max_output_tokens=4096),
+    "text-unicorn@001": lambda: VertexTextBackend("text-unicorn@001", context_tokens=8192, max_output_tokens=1024),
+    "text-bison@002": lambda: VertexTextBackend("text-bison@002", context_tokens=8192, max_output_tokens=2048),
+    "text-bison@001": lambda: VertexTextBackend("text-bison@001", context_tokens=8192, max_output_tokens=1024),
+    "echo": lambda: EchoBackend("echo"),
+}
+
+_created_backends = {}
+_created_backends_lock = threading.Lock()
+
+
+def register_llm_backend(name: str, factory) -> None:
+    """
+    Offer a new model: factory() returns its LLMBackend. Re-registering a name replaces its backend.
+    """
+    LLM_BACKENDS[name] = factory
+    return None
+
+
+def get_llm_backend(name: str) -> LLMBackend:
+    """
+    The shared backend of a model name. Names without a registered backend are
+    served as Vertex AI text models, as before.
+    """
+    factory = LLM_BACKENDS.get(name)
+    if factory is None:
+        # the table is left as is, so a later register_llm_backend(name, ...) still takes over
+        backend = ClientRegistry.get_or_create("llm_backend", (name, None), lambda: VertexTextBackend(name))
+    else:
+        backend = ClientRegistry.get_or_create("llm_backend", (name, id(factory)), factory)
+    with _created_backends_lock:
+        _created_backends[name] = backend
+    return backend
+
+
+def llm_backend_stats() -> dict:
+    """
+    Counters of every backend used so far, by model name.
+    """
+    with _created_backends_lock:
+        backends = dict(_created_backends)
+    return {name: backend.stats() for name, backend in backends.items()}
@@ -12,16 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from click import prompt
-from dotenv import dotenv_values
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-#from langchain.llms import VertexAI
-from langchain_community.llms import VertexAI
-from vertexai.preview.generative_models import GenerativeModel, Part
-from anthropic import AnthropicVertex
-
-import base64
+try:
+    from rsc.ClientRegistry import get_generative_model, get_secrets
+    from rsc.LLMBackends import get_llm_backend
+except:
+    from ClientRegistry import get_generative_model, get_secrets
+    from LLMBackends import get_llm_backend
 
 QA_PROMPT_TEMPLATE = """SYSTEM: You are an intelligent assistant helping to answer questions related to a given knowledge base and provided images. 
 Question: {question}
@@ -47,126 +43,87 @@ class LLMSession:
         self.context_docs = context_docs
         self.prompt_template = QA_PROMPT_TEMPLATE
         self.model_name = model_name
-        self.secrets = dotenv_values(".env")
-        if image is not None:
-            self.image_data = Part.from_data(
-                mime_type="image/png",
-                data=image)
-        else: 
-            self.image_data = None
+        self.secrets = get_secrets()
+        self.image_data = image # raw png bytes, passed to backends that support images
+        self.backend = get_llm_backend(model_name)
+
     def llm_prediction(
         self,
         max_output_tokens: int = 1024,
         temperature: float = 0.2,
         top_p: float = 0.8,
         top_k: int = 40,
+        timeout: float = None,
     ) -> dict:
-        if self.model_name == "gemini-1.0-pro":
-            model = GenerativeModel("gemini-1.0-pro-002")
-            responses = model.generate_content(
-                self.prompt_template.format(
-                    question=self.client_query_string, context=self.context_docs
-                ),
-                generation_config={
-                    "max_output_tokens": 2048,
-                    "temperature": 1,
-                    "top_p": 1,
-                },
-            )
-            response = {"text": responses.text}
-        elif self.model_name == "gemini-1.5-pro":
-            model = GenerativeModel("gemini-1.5-pro-001")
-            if self.image_data is not None:
-                responses = model.generate_content(
-                    [self.image_data, self.prompt_template.format(
-                        question=self.client_query_string, context=self.context_docs
-                    )],
-                    generation_config={
-                        "max_output_tokens": 2048,
-                        "temperature": 1,
-                        "top_p": 1,
-                    },
-                )
-                response = {"text": responses.text}
-            else:
-                responses = model.generate_content(
-                    self.prompt_template.format(
-                        question=self.client_query_string, context=self.context_docs
-                    ),
-                    generation_config={
-                        "max_output_tokens": 2048,
-                        "temperature": 1,
-                        "top_p": 1,
-                    },
-                )
-                response = {"text": responses.text}
-
-        elif self.model_name == "gemini-1.5-flash":
-            model = GenerativeModel("gemini-1.5-flash-001")
-            if self.image_data is not None:
-                responses = model.generate_content(
-                    [self.image_data, self.prompt_template.format(
-                        question=self.client_query_string, context=self.context_docs
-                    )],
-                    generation_config={
-                        "max_output_tokens": 2048,
-                        "temperature": 1,
-                        "top_p": 1,
-                    },
-                )
-                response = {"text": responses.text}
-            else:
-                responses = model.generate_content(
-                    self.prompt_template.format(
-                        question=self.client_query_string, context=self.context_docs
-                    ),
-                    generation_config={
-                        "max_output_tokens": 2048,
-                        "temperature": 1,
-                        "top_p": 1,
-                    },
-                )
-                response = {"text": responses.text}
-
-        elif self.model_name == "claude3-sonnet":
-            client = AnthropicVertex(region=str("us-central1"), project_id=str(self.secrets["GCP_PROJECT_ID"]))
-            response = client.messages.create(
-                model="claude-3-sonnet@20240229",
-                max_tokens=max_output_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                top_k=top_k,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": self.prompt_template.format(
-                            question=self.client_query_string, context=self.context_docs
-                        ),
-                    }
-                ],
-            )
-            return {"text": response.content[0].text}
-        else:
-            llm = VertexAI(
-                model_name=self.model_name,
-                max_output_tokens=max_output_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                top_k=top_k,
-                verbose=True,
-            )
-
-            llm_chain = LLMChain(
-                llm=llm, prompt=PromptTemplate.from_template(self.prompt_template)
-            )
-
-            response = llm_chain(
-                {"question": self.client_query_string, "context": self.context_docs}
-            )
-        return response
+        text = self.backend.generate(
+            self._prompt(),
+            image=self.image_data,
+            max_output_tokens=max_output_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            timeout=timeout,
+        )
+        return {"text": text}
+
+    def llm_prediction_stream(
+        self,
+        max_output_tokens: int = 1024,
+        temperature: float = 0.2,
+        top_p: float = 0.8,
+        top_k: int = 40,
+        timeout: float = None,
+    ):
+        """
+        Streaming variant of llm_prediction, yields the answer text as deltas while it is generated.
+        The timeout bounds the whole stream.
+        """
+        return self.backend.stream(
+            self._prompt(),
+            image=self.image_data,
+            max_output_tokens=max_output_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            timeout=timeout,
+        )
+
+    def warm_up(self, loop=None) -> None:
+        """
+        Create the model client ahead of the prediction call. Passing the event loop warms up the async client.
+        """
+        self.backend.warm_up(loop)
+        return None
+
+    async def allm_prediction(
+        self,
+        max_output_tokens: int = 1024,
+        temperature: float = 0.2,
+        top_p: float = 0.8,
+        top_k: int = 40,
+        timeout: float = None,
+    ) -> dict:
+        """
+        Async variant of llm_prediction on the async model clients.
+        """
+        text = await self.backend.agenerate(
+            self._prompt(),
+            image=self.image_data,
+            max_output_tokens=max_output_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            timeout=timeout,
+        )
+        return {"text": text}
+
+    def _prompt(self) -> str:
+        return self.prompt_template.format(
+            question=self.client_query_string, context=self.context_docs
+        )
 
     def llm_function_call(self, tools: list):
-        model = GenerativeModel("gemini-pro")
+        model = get_generative_model("gemini-pro")
 
         print("++++ Function Call Session Prompt ++++")
         print(self.client_query_string)
@@ -201,7 +158,7 @@ class LLMSession:
 if __name__ == "__main__":
     prompt = "Which is the city with the most bridges?"
     llm = LLMSession(
-        client_query_string=prompt, context_docs=None, model_name="claude3-sonnet"
+        client_query_string=prompt, context_docs=None, model_name="claude3-sonnet", image=None
     )
     response = llm.llm_prediction()
     print(response)
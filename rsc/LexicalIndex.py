@@ -0,0 +1,280 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+DEFAULT_LEXICAL_INDEX_PATH = ".cache/lexical_index"
+
+# compact the document log once more than this share of the documents is deleted
+COMPACTION_RATIO = 0.5
+
+# words joined by - _ . / stay one token (product codes, error ids, versions), their parts are indexed too
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what when where which who will with".split()
+)
+
+
+def tokenize(text: str) -> list:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token not in STOPWORDS:
+            tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-_./]", token) if part and part not in STOPWORDS)
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """
+    Fuse ranked id lists: every id scores sum(1 / (k + rank)) over the lists it appears in.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, datapoint_id in enumerate(ranking, start=1):
+            scores[datapoint_id] = scores.get(datapoint_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over chunk contents.
+
+    Every term maps to a compact posting list: sorted int32 document rows plus
+    float32 term frequencies, with document lengths precomputed per row.
+    Queries are scored term at a time with MaxScore pruning: once the score
+    upper bounds of the remaining terms can no longer lift an unseen document
+    into the top k, those posting lists are only probed for the current
+    candidates instead of being scanned.
+
+    Documents are persisted in an append-only log (documents.jsonl) of term
+    frequencies & deletions, replayed on open and compacted once most
+    documents are deleted. upsert & remove return VectorIndexWriter-style statistics.
+    """
+
+    def __init__(self, path: str = DEFAULT_LEXICAL_INDEX_PATH, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._log_path = os.path.join(path, "documents.jsonl")
+        self._reset()
+        self._refresh()
+
+    def _reset(self) -> None:
+        self._doc_ids = []
+        self._doc_lengths = []
+        self._deleted = []
+        self._row_of = {}
+        self._live_length_sum = 0
+        # term -> (rows, term frequencies, max term frequency, min document length)
+        self._postings = {}
+        # appended since the last merge into the compact posting lists
+        self._pending = {}
+        self._log_offset = 0
+        return None
+
+    def _refresh(self) -> None:
+        # replay log records written since the last read, including those of other processes
+        size = os.path.getsize(self._log_path) if os.path.exists(self._log_path) else 0
+        if size == self._log_offset:
+            return None
+        with self._lock:
+            if size < self._log_offset:  # compacted by another process
+                self._reset()
+            with open(self._log_path, "rb") as f:
+                f.seek(self._log_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):  # partially written record
+                        break
+                    self._apply(json.loads(line))
+                    self._log_offset += len(line)
+        return None
+
+    def _apply(self, record: dict) -> None:
+        row = self._row_of.pop(record["id"], None)
+        if row is not None:
+            self._deleted[row] = True
+            self._live_length_sum -= self._doc_lengths[row]
+        if record.get("deleted"):
+            return None
+
+        row = len(self._doc_ids)
+        self._doc_ids.append(record["id"])
+        self._doc_lengths.append(record["length"])
+        self._deleted.append(False)
+        self._row_of[record["id"]] = row
+        self._live_length_sum += record["length"]
+        for term, frequency in record["terms"].items():
+            self._pending.setdefault(term, []).append((row, frequency))
+        return None
+
+    def _append_records(self, records: list) -> None:
+        with open(self._log_path, "ab") as f:
+            f.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records).encode("utf-8"))
+        return None
+
+    def upsert(self, documents: list) -> dict:
+        """
+        Index (id, text) documents. Documents with an existing id are replaced.
+        """
+        start_time = time.perf_counter()
+        records = []
+        for datapoint_id, text in documents:
+            tokens = tokenize(text)
+            records.append({"id": datapoint_id, "length": len(tokens), "terms": Counter(tokens)})
+
+        with self._lock:
+            self._append_records(records)
+        # replaying keeps the order of concurrent writers
+        self._refresh()
+        return self._stats(len(records), start_time)
+
+    def remove(self, ids: list) -> dict:
+        start_time = time.perf_counter()
+        self._refresh()
+        records = [{"id": i, "deleted": True} for i in dict.fromkeys(ids) if i in self._row_of]
+        with self._lock:
+            self._append_records(records)
+        self._refresh()
+
+        with self._lock:
+            if self._doc_ids and len(self._doc_ids) - len(self._row_of) > COMPACTION_RATIO * len(self._doc_ids):
+                self._compact()
+        return self._stats(len(records), start_time)
+
+    def _compact(self) -> None:
+        # rewrite the log with the live documents only
+        self._merge_pending()
+        terms_of = {row: {} for row in self._row_of.values()}
+        for term, (rows, frequencies, _, _) in self._postings.items():
+            for row, frequency in zip(rows.tolist(), frequencies.tolist()):
+                if row in terms_of:
+                    terms_of[row][term] = int(frequency)
+        records = [
+            {"id": self._doc_ids[row], "length": self._doc_lengths[row], "terms": terms_of[row]}
+            for row in sorted(terms_of)
+        ]
+
+        temporary_path = self._log_path + ".tmp"
+        with open(temporary_path, "wb") as f:
+            f.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records).encode("utf-8"))
+        os.replace(temporary_path, self._log_path)
+
+        self._reset()
+        for record in records:
+            self._apply(record)
+        self._log_offset = os.path.getsize(self._log_path)
+        return None
+
+    def _merge_pending(self) -> None:
+        # fold pending postings into the compact arrays; rows only grow, so lists stay sorted
+        deleted = np.asarray(self._deleted, dtype=bool)
+        lengths = np.asarray(self._doc_lengths, dtype=np.float32)
+        for term, entries in self._pending.items():
+            new_rows = np.fromiter((row for row, _ in entries), dtype=np.int32, count=len(entries))
+            new_frequencies = np.fromiter((frequency for _, frequency in entries), dtype=np.float32, count=len(entries))
+            if term in self._postings:
+                rows, frequencies, _, _ = self._postings[term]
+                new_rows = np.concatenate([rows, new_rows])
+                new_frequencies = np.concatenate([frequencies, new_frequencies])
+            # drop deleted documents while rewriting the list anyway
+            live = ~deleted[new_rows]
+            new_rows, new_frequencies = new_rows[live], new_frequencies[live]
+            if len(new_rows):
+                self._postings[term] = (new_rows, new_frequencies, float(new_frequencies.max()), float(lengths[new_rows].min()))
+            else:
+                self._postings.pop(term, None)
+        self._pending = {}
+        return None
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._row_of)
+
+    def search(self, query: str, num_results: int = 10) -> tuple:
+        """
+        Ids & BM25 scores of the top num_results documents for query, best first.
+        """
+        self._refresh()
+        with self._lock:
+            if self._pending:
+                self._merge_pending()
+            postings = [self._postings[term] for term in dict.fromkeys(tokenize(query)) if term in self._postings]
+            document_count = len(self._row_of)
+            if not postings or not document_count:
+                return [], []
+            deleted = np.asarray(self._deleted, dtype=bool)
+            lengths = np.asarray(self._doc_lengths, dtype=np.float32)
+            average_length = self._live_length_sum / document_count
+            doc_ids = self._doc_ids
+
+        k1, b = self.k1, self.b
+
+        def term_scores(idf, frequencies, document_lengths):
+            return idf * frequencies * (k1 + 1) / (frequencies + k1 * (1 - b + b * document_lengths / average_length))
+
+        terms = []
+        for rows, frequencies, max_frequency, min_length in postings:
+            idf = math.log(1 + (document_count - len(rows) + 0.5) / (len(rows) + 0.5))
+            # term score is increasing in frequency & decreasing in document length
+            upper_bound = float(term_scores(idf, max_frequency, min_length))
+            terms.append((upper_bound, idf, rows, frequencies))
+        terms.sort(key=lambda term: term[0], reverse=True)
+        remaining_bounds = np.cumsum([term[0] for term in terms][::-1])[::-1]
+
+        scores = np.zeros(len(lengths), dtype=np.float32)
+        candidates = np.empty(0, dtype=np.int32)
+        threshold = 0.0
+        for i, (_, idf, rows, frequencies) in enumerate(terms):
+            if len(candidates) < num_results or remaining_bounds[i] > threshold:
+                # essential list: unseen documents can still reach the top k
+                live = ~deleted[rows]
+                rows, frequencies = rows[live], frequencies[live]
+                scores[rows] += term_scores(idf, frequencies, lengths[rows])
+                candidates = np.union1d(candidates, rows)
+            else:
+                # non-essential list: only probe candidates that can still reach the top k
+                candidates = candidates[scores[candidates] + remaining_bounds[i] >= threshold]
+                positions = np.minimum(np.searchsorted(rows, candidates), len(rows) - 1)
+                hits = rows[positions] == candidates
+                matched = candidates[hits]
+                scores[matched] += term_scores(idf, frequencies[positions[hits]], lengths[matched])
+
+            if len(candidates) >= num_results:
+                threshold = float(np.partition(scores[candidates], -num_results)[-num_results])
+
+        top = candidates[np.argsort(-scores[candidates], kind="stable")[:num_results]]
+        return [doc_ids[row] for row in top], scores[top].tolist()
+
+    @staticmethod
+    def _stats(count: int, start_time: float) -> dict:
+        # same keys as VectorIndexWriter statistics
+        return {
+            "datapoints": count,
+            "sent": count,
+            "failed": 0,
+            "requests": 1 if count else 0,
+            "seconds": time.perf_counter() - start_time,
+            "errors": [],
+        }
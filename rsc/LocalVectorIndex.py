@@ -0,0 +1,279 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_LOCAL_INDEX_PATH = ".cache/vector_index"
+
+# compact the files once more than this share of the rows is deleted
+COMPACTION_RATIO = 0.5
+
+
+class LocalVectorIndex:
+    """
+    Exact nearest neighbour index on a memory-mapped float32 matrix.
+
+    The files in path are append-only between compactions:
+        meta.json       vector dimensions
+        vectors.f32     unit-normalized vectors, one row per upsert
+        ids.txt         datapoint id of every row, one per line
+        tombstones.i64  rows that were deleted or replaced by a later upsert
+
+    Opening the index maps vectors.f32 instead of reading it. Queries are scored
+    by cosine similarity, matching find_matches of the remote index. upsert,
+    upsert_stream & remove return the same statistics as VectorIndexWriter, so
+    the index can stand in for it in the ingestion & deletion sessions.
+    """
+
+    def __init__(self, path: str = DEFAULT_LOCAL_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _file_sizes(self) -> tuple:
+        return tuple(
+            os.path.getsize(self._file(name)) if os.path.exists(self._file(name)) else 0
+            for name in ("vectors.f32", "ids.txt", "tombstones.i64")
+        )
+
+    def _load(self) -> None:
+        self.dimensions = None
+        if os.path.exists(self._file("meta.json")):
+            with open(self._file("meta.json")) as f:
+                self.dimensions = json.load(f)["dimensions"]
+
+        ids = []
+        if os.path.exists(self._file("ids.txt")):
+            with open(self._file("ids.txt"), encoding="utf-8", newline="\n") as f:
+                # a last line without newline is an id that was cut off
+                ids = f.read().split("\n")[:-1]
+
+        # rows written without their id (interrupted append) are ignored
+        rows = os.path.getsize(self._file("vectors.f32")) // (4 * self.dimensions) if self.dimensions else 0
+        count = min(len(ids), rows)
+        self._ids = ids[:count]
+        self._matrix = self._map(count)
+
+        self._deleted = np.zeros(count, dtype=bool)
+        if os.path.exists(self._file("tombstones.i64")):
+            tombstones = np.fromfile(self._file("tombstones.i64"), dtype=np.int64)
+            self._deleted[tombstones[tombstones < count]] = True
+
+        self._row_of = {datapoint_id: row for row, datapoint_id in enumerate(self._ids) if not self._deleted[row]}
+        self._sizes = self._file_sizes()
+        return None
+
+    def _discard_partial_writes(self) -> None:
+        # cut what an interrupted append left behind the loaded rows (vectors without an id, a
+        # partial id or tombstone), so the next append lines up with the ids again; only writers
+        # do this, a reader may load while a writer is between appending the vectors & their ids
+        if self._file_sizes() != self._sizes:
+            # rows another process appended since the last load are kept
+            self._load()
+        if self.dimensions is None:
+            return None
+        ids_size = sum(len(i.encode("utf-8")) + 1 for i in self._ids)
+        for name, size in (("vectors.f32", len(self._ids) * 4 * self.dimensions), ("ids.txt", ids_size)):
+            if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) > size:
+                os.truncate(self._file(name), size)
+        if os.path.exists(self._file("tombstones.i64")):
+            size = os.path.getsize(self._file("tombstones.i64"))
+            if size % 8:
+                os.truncate(self._file("tombstones.i64"), size - size % 8)
+        return None
+
+    def _map(self, count: int):
+        if not count:
+            return np.empty((0, self.dimensions or 0), dtype=np.float32)
+        return np.memmap(self._file("vectors.f32"), dtype=np.float32, mode="r", shape=(count, self.dimensions))
+
+    def _refresh(self) -> None:
+        # pick up writes of other processes
+        if self._file_sizes() != self._sizes:
+            with self._lock:
+                if self._file_sizes() != self._sizes:
+                    self._load()
+        return None
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def upsert(self, datapoints: list) -> dict:
+        """
+        Append (id, vector) datapoints. Rows of ids that already exist are replaced.
+        """
+        start_time = time.perf_counter()
+        if not datapoints:
+            return self._stats(0, start_time)
+
+        # the last vector of an id within the batch wins
+        latest = dict(datapoints)
+        ids = list(latest)
+        vectors = self._normalize(np.asarray([latest[i] for i in ids], dtype=np.float32))
+
+        with self._lock:
+            self._discard_partial_writes()
+            if self.dimensions is None:
+                self.dimensions = int(vectors.shape[1])
+                with open(self._file("meta.json"), "w") as f:
+                    json.dump({"dimensions": self.dimensions}, f)
+            if vectors.shape[1] != self.dimensions:
+                raise ValueError(f"Expected {self.dimensions} dimensions, got {vectors.shape[1]}")
+
+            replaced = [self._row_of[i] for i in ids if i in self._row_of]
+            first_row = len(self._ids)
+
+            # vectors before ids, so an interrupted append leaves no id without a vector
+            with open(self._file("vectors.f32"), "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._file("ids.txt"), "a", encoding="utf-8") as f:
+                f.write("".join(f"{i}\n" for i in ids))
+            self._write_tombstones(replaced)
+
+            self._ids.extend(ids)
+            self._deleted = np.concatenate([self._deleted, np.zeros(len(ids), dtype=bool)])
+            self._deleted[replaced] = True
+            self._row_of.update((i, first_row + idx) for idx, i in enumerate(ids))
+            self._matrix = self._map(len(self._ids))
+            self._sizes = self._file_sizes()
+
+        return self._stats(len(ids), start_time)
+
+    def upsert_stream(self, datapoint_batches) -> dict:
+        """
+        Upsert batches of (id, vector) datapoints as they are produced.
+        """
+        start_time = time.perf_counter()
+        count = 0
+        for batch in datapoint_batches:
+            count += self.upsert(batch)["sent"]
+        return self._stats(count, start_time)
+
+    def remove(self, ids: list) -> dict:
+        """
+        Tombstone the rows of ids. The files are compacted once most rows are deleted.
+        """
+        start_time = time.perf_counter()
+        with self._lock:
+            self._discard_partial_writes()
+            rows = [self._row_of.pop(i) for i in dict.fromkeys(ids) if i in self._row_of]
+            self._write_tombstones(rows)
+            self._deleted[rows] = True
+            if len(self._ids) and self._deleted.sum() > COMPACTION_RATIO * len(self._ids):
+                self._compact()
+            self._sizes = self._file_sizes()
+
+        return self._stats(len(rows), start_time)
+
+    def _write_tombstones(self, rows: list) -> None:
+        if rows:
+            with open(self._file("tombstones.i64"), "ab") as f:
+                f.write(np.asarray(rows, dtype=np.int64).tobytes())
+        return None
+
+    def _compact(self) -> None:
+        # rewrite the live rows; readers keep their mapping of the replaced file
+        live = np.flatnonzero(~self._deleted)
+        ids = [self._ids[row] for row in live]
+
+        np.asarray(self._matrix[live], dtype=np.float32).tofile(self._file("vectors.f32.tmp"))
+        with open(self._file("ids.txt.tmp"), "w", encoding="utf-8") as f:
+            f.write("".join(f"{i}\n" for i in ids))
+        os.replace(self._file("vectors.f32.tmp"), self._file("vectors.f32"))
+        os.replace(self._file("ids.txt.tmp"), self._file("ids.txt"))
+        if os.path.exists(self._file("tombstones.i64")):
+            os.remove(self._file("tombstones.i64"))
+
+        self._ids = ids
+        self._deleted = np.zeros(len(ids), dtype=bool)
+        self._row_of = {datapoint_id: row for row, datapoint_id in enumerate(ids)}
+        self._matrix = self._map(len(ids))
+        return None
+
+    def find_matches(self, query_vec: list, num_neighbors: int = 10, match_thresh: float = 0.6) -> list:
+        """
+        Ids of the num_neighbors most similar vectors with a cosine similarity of at least match_thresh.
+        """
+        return self.find_matches_batch([query_vec], num_neighbors, match_thresh)[0]
+
+    def find_matches_batch(self, query_vecs: list, num_neighbors: int = 10, match_thresh: float = 0.6) -> list:
+        """
+        find_matches for many query vectors in one matrix product, one id list per query.
+        """
+        return [
+            [datapoint_id for datapoint_id, score in zip(ids, scores) if score >= match_thresh]
+            for ids, scores in self.search(np.asarray(query_vecs, dtype=np.float32), num_neighbors)
+        ]
+
+    def get_vectors(self, ids: list) -> np.ndarray:
+        """
+        Stored (normalized) vectors of ids, one row per id; zeros for ids not in the index.
+        """
+        self._refresh()
+        with self._lock:
+            matrix, row_of = self._matrix, self._row_of
+        vectors = np.zeros((len(ids), matrix.shape[1]), dtype=np.float32)
+        for idx, datapoint_id in enumerate(ids):
+            row = row_of.get(datapoint_id)
+            if row is not None:
+                vectors[idx] = matrix[row]
+        return vectors
+
+    def search(self, query_vecs: np.ndarray, num_neighbors: int = 10) -> list:
+        """
+        Top num_neighbors (ids, cosine similarities) per query vector, best first.
+        """
+        self._refresh()
+        with self._lock:
+            matrix, ids, deleted = self._matrix, self._ids, self._deleted
+        if not len(matrix):
+            return [([], []) for _ in query_vecs]
+
+        scores = self._normalize(np.asarray(query_vecs, dtype=np.float32)) @ matrix.T
+        scores[:, deleted] = -np.inf
+        k = min(num_neighbors, len(matrix))
+
+        results = []
+        for query_scores in scores:
+            top = np.argpartition(-query_scores, k - 1)[:k]
+            top = top[np.argsort(-query_scores[top])]
+            top = top[np.isfinite(query_scores[top])]
+            results.append(([ids[row] for row in top], query_scores[top].tolist()))
+        return results
+
+    @staticmethod
+    def _stats(count: int, start_time: float) -> dict:
+        # same keys as VectorIndexWriter statistics
+        return {
+            "datapoints": count,
+            "sent": count,
+            "failed": 0,
+            "requests": 1 if count else 0,
+            "seconds": time.perf_counter() - start_time,
+            "errors": [],
+        }
@@ -16,61 +16,163 @@
 from rsc.IngestionSession import IngestionSession
 from dotenv import dotenv_values
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from io import BytesIO
+import time
 import PyPDF2
 
+DEFAULT_MAX_WORKERS = 4
+
+# minimum number of extracted characters for a page's text layer to be used instead of OCR
+MIN_TEXT_LAYER_CHARS = 100
+
 
 class PreprocessingSession:
-    def __init__(self) -> None:
+    def __init__(self, max_workers: int = None, native_text_layer: bool = None, min_text_layer_chars: int = MIN_TEXT_LAYER_CHARS) -> None:
         self.secrets = dotenv_values(".env")
+        # number of PDF parts that are ingested concurrently
+        self.max_workers = max_workers or int(self.secrets.get("INGESTION_MAX_WORKERS") or DEFAULT_MAX_WORKERS)
+        # use the PDF's own text layer where usable & send only scanned pages to Document AI
+        if native_text_layer is None:
+            native_text_layer = str(self.secrets.get("NATIVE_TEXT_LAYER") or "").lower() in ("1", "true", "yes")
+        self.native_text_layer = native_text_layer
+        self.min_text_layer_chars = min_text_layer_chars
 
-    def __call__(self, new_file_name:str, max_pages_per_file:int, file_to_ingest=None, ingest_local_file: bool = False, ingest_pdf: bool = True) -> None:
+    def __call__(self, new_file_name:str, max_pages_per_file:int, file_to_ingest=None, ingest_local_file: bool = False, ingest_pdf: bool = True, streaming: bool = None) -> dict:
 
         ingestion = IngestionSession() 
 
         pdf_file = BytesIO(file_to_ingest)
         pdf_reader = PyPDF2.PdfReader(pdf_file)
         num_pages = len(pdf_reader.pages)
-        ingest_pdf = ingest_pdf
         
         # print number of pages 
         print(f"Total Pages: {num_pages}") 
 
         # check if PDF file exceeds the page limit
         if num_pages > max_pages_per_file:
-            output_file_index = 1
-            output_file_name = f"{new_file_name[:-4]}-part{output_file_index}.pdf"
-            pdf_writer = PyPDF2.PdfWriter()
-            tmp = BytesIO()
+            parts = self._split_pdf(pdf_reader=pdf_reader, new_file_name=new_file_name, max_pages_per_file=max_pages_per_file)
+            report = self._ingest_parts(ingestion=ingestion, parts=parts, ingest_pdf=ingest_pdf, streaming=streaming)
+            print("Splitting & Ingestion completed.")
 
-            for page_num in range(num_pages):
-                pdf_writer.add_page(pdf_reader.pages[page_num])
+        else:
+            parts = [(f"{new_file_name[:-4]}-part0.pdf", file_to_ingest)]
+            report = self._ingest_parts(ingestion=ingestion, parts=parts, ingest_pdf=ingest_pdf, streaming=streaming)
+            print("PDF file has", num_pages, "pages or less, no splitting was needed. Ingestion completed.")
 
-                if page_num % max_pages_per_file == max_pages_per_file - 1:
-                    pdf_writer.write(tmp)
-                    output_file_bytes = tmp.getvalue()
-                    ingestion(new_file_name=output_file_name, file_to_ingest=output_file_bytes, ingest_local_file=False, ingest_pdf = ingest_pdf)
+        return report
 
-                    output_file_index += 1
-                    output_file_name = f"{new_file_name[:-4]}-part{output_file_index}.pdf"
-                    pdf_writer = PyPDF2.PdfWriter()
-                    tmp = BytesIO()
+    def _split_pdf(self, pdf_reader, new_file_name: str, max_pages_per_file: int) -> list:
+        """
+        Split the PDF into parts of at most max_pages_per_file pages.
 
-            # Write any remaining pages to the last output file
-            if page_num % max_pages_per_file != max_pages_per_file - 1:
-                pdf_writer.write(tmp)
-                output_file_bytes = tmp.getvalue()
-                ingestion(new_file_name=output_file_name, file_to_ingest=output_file_bytes, ingest_local_file=False, ingest_pdf = ingest_pdf)
+        Returns a list of (part file name, part bytes) tuples, named -part1 ... -partN in page order.
+        """
+        parts = []
+        num_pages = len(pdf_reader.pages)
 
-            print("Splitting & Ingestion completed.")
+        for part_index, first_page in enumerate(range(0, num_pages, max_pages_per_file), start=1):
+            pdf_writer = PyPDF2.PdfWriter()
+            for page_num in range(first_page, min(first_page + max_pages_per_file, num_pages)):
+                pdf_writer.add_page(pdf_reader.pages[page_num])
 
-        else:
-            new_file_name = f"{new_file_name[:-4]}-part0.pdf"
-            ingestion(new_file_name=new_file_name, file_to_ingest=file_to_ingest, ingest_local_file=False, ingest_pdf = ingest_pdf)
-            print("PDF file has", num_pages, "pages or less, no splitting was needed. Ingestion completed.")
+            tmp = BytesIO()
+            pdf_writer.write(tmp)
+            parts.append((f"{new_file_name[:-4]}-part{part_index}.pdf", tmp.getvalue()))
+
+        return parts
+
+    def _ingest_parts(self, ingestion: IngestionSession, parts: list, ingest_pdf: bool = True, streaming: bool = None) -> dict:
+        """
+        Ingest PDF parts on a bounded worker pool and aggregate the per-part results into one report.
+        """
+        start_time = time.time()
+        ingested = []
+        failed = {}
+
+        ingest_part = partial(self._ingest_part_with_text_layer, ingestion) if self.native_text_layer else ingestion
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(parts))) as executor:
+            futures = {
+                executor.submit(ingest_part, new_file_name=part_name, file_to_ingest=part_bytes, ingest_local_file=False, ingest_pdf=ingest_pdf, streaming=streaming): part_name
+                for part_name, part_bytes in parts
+            }
+            for future in as_completed(futures):
+                part_name = futures[future]
+                try:
+                    future.result()
+                    ingested.append(part_name)
+                except Exception as e:
+                    failed[part_name] = f"{type(e).__name__}: {e}"
+
+        part_names = [part_name for part_name, _ in parts]
+        report = {
+            "parts": len(parts),
+            "ingested": [name for name in part_names if name in ingested],
+            "failed": {name: failed[name] for name in part_names if name in failed},
+            "seconds": time.time() - start_time,
+        }
+
+        print(f"Ingested {len(report['ingested'])}/{report['parts']} parts in {report['seconds']:.1f}s with {self.max_workers} workers.")
+        for part_name, error in report["failed"].items():
+            print(f"Failed to ingest {part_name}: {error}")
+
+        return report
+
+    def _has_usable_text_layer(self, page_text: str) -> bool:
+        # digitally generated pages have enough extractable, mostly printable text
+        text = (page_text or "").strip()
+        if len(text) < self.min_text_layer_chars:
+            return False
+        printable = sum(1 for char in text if char.isprintable() or char.isspace())
+        return printable / len(text) >= 0.95
+
+    def _extract_document_text(self, ingestion: IngestionSession, new_file_name: str, file_to_ingest: bytes) -> str:
+        """
+        Extract the text of a PDF page by page: pages with a usable text layer are read
+        locally with PyPDF2, runs of scanned or image-only pages are sent to Document AI.
+        The texts of both sources are merged in page order.
+        """
+        pdf_reader = PyPDF2.PdfReader(BytesIO(file_to_ingest))
+        page_texts = [page.extract_text() for page in pdf_reader.pages]
+        usable = [self._has_usable_text_layer(text) for text in page_texts]
+
+        # group consecutive pages without a usable text layer into one OCR request each
+        ocr_runs = []
+        for page_num, page_usable in enumerate(usable):
+            if page_usable:
+                continue
+            if ocr_runs and ocr_runs[-1][1] == page_num:
+                ocr_runs[-1][1] = page_num + 1
+            else:
+                ocr_runs.append([page_num, page_num + 1])
+
+        texts = {page_num: text for page_num, text in enumerate(page_texts) if usable[page_num]}
+        for first_page, end_page in ocr_runs:
+            pdf_writer = PyPDF2.PdfWriter()
+            for page_num in range(first_page, end_page):
+                pdf_writer.add_page(pdf_reader.pages[page_num])
+            tmp = BytesIO()
+            pdf_writer.write(tmp)
+
+            texts[first_page] = ingestion._ocr_pdf(processor_id=ingestion.docai_processor_id,
+                                                   processor_version=ingestion.docai_processor_version,
+                                                   location=ingestion.gcp_multiregion,
+                                                   file_path=new_file_name,
+                                                   file_to_ingest=tmp.getvalue(),
+                                                   ingest_local_file=False)
+
+        ocr_pages = sum(end_page - first_page for first_page, end_page in ocr_runs)
+        print(f"{new_file_name}: {len(page_texts) - ocr_pages} pages from text layer, "
+              f"{ocr_pages} pages OCR'd in {len(ocr_runs)} Document AI requests")
 
+        return "\n".join(texts[page_num] for page_num in sorted(texts))
 
-        return None
+    def _ingest_part_with_text_layer(self, ingestion: IngestionSession, new_file_name: str, file_to_ingest: bytes, ingest_local_file: bool = False, ingest_pdf: bool = True, streaming: bool = None):
+        document_text = self._extract_document_text(ingestion, new_file_name, file_to_ingest)
+        return ingestion(new_file_name=new_file_name, file_to_ingest=file_to_ingest, ingest_local_file=ingest_local_file,
+                         ingest_pdf=ingest_pdf, streaming=streaming, document_text=document_text)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+
+def maximal_marginal_relevance(
+    query_vec, candidate_vecs, k: int = 10, lambda_mult: float = 0.5, duplicate_thresh: float = None
+) -> list:
+    """
+    Pick k diverse candidates with Maximal Marginal Relevance.
+
+    Each step selects the candidate maximizing
+    lambda_mult * sim(query, c) - (1 - lambda_mult) * max sim(c, selected),
+    with cosine similarities. Candidates at least duplicate_thresh similar to a
+    selected one are dropped as near-duplicates, so fewer than k may be returned.
+
+    Returns the selected candidate positions, in selection order.
+    """
+    candidates = np.asarray(candidate_vecs, dtype=np.float32)
+    if not len(candidates) or k <= 0:
+        return []
+
+    candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vec, dtype=np.float32)
+    query = query / max(np.linalg.norm(query), 1e-12)
+
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+    # highest similarity of every candidate to the selected ones
+    redundancy = np.full(len(candidates), -np.inf, dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+
+    selected = []
+    while len(selected) < k and available.any():
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy if selected else relevance.copy()
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+        if duplicate_thresh is not None:
+            available &= redundancy < duplicate_thresh
+
+    return selected
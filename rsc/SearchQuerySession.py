@@ -19,21 +19,49 @@
 from rsc.EmbeddingSession import EmbeddingSession
 from rsc.VectorSearchSession import VectorSearchSession
 from rsc.LLMSession import LLMSession
+from rsc.LLMBackends import get_llm_backend
+from rsc.ClientRegistry import get_answer_cache, get_async_firestore_client, get_credentials, get_firestore_client, get_latency_tracker, get_lexical_index, get_secrets
+from rsc.LexicalIndex import reciprocal_rank_fusion
+from rsc.ContextBuilder import ContextBuilder, context_token_budget
+from rsc.Reranking import maximal_marginal_relevance
+from rsc.hedging import Deadline, ahedged_call, hedged_call, rpc_timeout
+from rsc.tracing import span
 
-from dotenv import dotenv_values
+import asyncio
+import contextvars
+import hashlib
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import firebase_admin
-from firebase_admin import firestore
-import google.auth
+
+# chunk fields read from Firestore to build the prompt
+CONTEXT_FIELDS = ["page_content", "document_name"]
+
+GENERATION_PARAMS = {"max_output_tokens": 1024, "temperature": 0.1, "top_p": 0.6, "top_k": 20}
+
+NUM_NEIGHBORS = 10
+MATCH_THRESH = 0.6
+
+# vector: embedding search only, lexical: BM25 only, hybrid: both fused by reciprocal rank
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+
+# MMR re-ranking defaults: relevance vs. diversity weight & near-duplicate similarity
+DEFAULT_MMR_LAMBDA = 0.5
+DEFAULT_MMR_DUPLICATE_THRESH = 0.95
+
+# every query has to be answered within its deadline; hedged requests go to the fallback model
+DEFAULT_QUERY_DEADLINE_SECONDS = 60
+DEFAULT_HEDGE_FALLBACK_MODEL = "gemini-1.5-flash"
 
 
 class SearchQuerySession:
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, retrieval_mode: str = None, mmr_fetch_k: int = None, mmr_lambda: float = None,
+                 deadline_seconds: float = None, hedging: bool = None):
         self.embedding_session = EmbeddingSession()
-        self.secrets = dotenv_values(".env")
-        self.credentials, _ = google.auth.load_credentials_from_file(
-            self.secrets["GCP_CREDENTIAL_FILE"]
-        )
+        self.secrets = get_secrets()
+        self.credentials, _ = get_credentials(self.secrets["GCP_CREDENTIAL_FILE"])
         self.vector_search_session = VectorSearchSession(
             gcp_project_id=self.secrets["GCP_PROJECT_ID"],
             gcp_project_number=self.secrets["GCP_PROJECT_NUMBER"],
@@ -45,6 +73,43 @@ class SearchQuerySession:
         )
         self.firestore_collection_name = self.secrets["FIRESTORE_COLLECTION_NAME"]
         self.model_name = model_name
+        self.answer_cache = get_answer_cache()
+        self.context_builder = ContextBuilder(
+            token_budget=context_token_budget(get_llm_backend(model_name).context_tokens, self.secrets.get("CONTEXT_TOKEN_BUDGET"))
+        )
+
+        self.retrieval_mode = (retrieval_mode or self.secrets.get("RETRIEVAL_MODE") or "vector").lower()
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {self.retrieval_mode}, expected one of {RETRIEVAL_MODES}")
+        self.lexical_index = get_lexical_index() if self.retrieval_mode != "vector" else None
+        if self.retrieval_mode != "vector" and self.lexical_index is None:
+            raise ValueError(f"Retrieval mode {self.retrieval_mode} requires the lexical index (LEXICAL_INDEX_DISABLED is set)")
+
+        # MMR re-ranking of the vector matches is enabled by fetching more than NUM_NEIGHBORS candidates
+        self.mmr_fetch_k = int(mmr_fetch_k or self.secrets.get("MMR_FETCH_K") or 0)
+        if self.mmr_fetch_k and self.mmr_fetch_k <= NUM_NEIGHBORS:
+            raise ValueError(f"MMR fetch k ({self.mmr_fetch_k}) must be larger than the {NUM_NEIGHBORS} chunks it selects")
+        self.mmr_lambda = float(mmr_lambda if mmr_lambda is not None else self.secrets.get("MMR_LAMBDA") or DEFAULT_MMR_LAMBDA)
+        self.mmr_duplicate_thresh = float(self.secrets.get("MMR_DUPLICATE_THRESH") or DEFAULT_MMR_DUPLICATE_THRESH)
+
+        # Stages slower than their p95 latency get a hedged duplicate request, if enabled.
+        self.deadline_seconds = float(deadline_seconds or self.secrets.get("QUERY_DEADLINE_SECONDS") or DEFAULT_QUERY_DEADLINE_SECONDS)
+        self.hedging = hedging if hedging is not None else str(self.secrets.get("HEDGING_ENABLED") or "").lower() in ("1", "true", "yes")
+        self.hedge_model_name = self.secrets.get("HEDGE_FALLBACK_MODEL") or DEFAULT_HEDGE_FALLBACK_MODEL
+        self.latency_tracker = get_latency_tracker()
+
+        if not firebase_admin._apps:
+            credentials = firebase_admin.credentials.Certificate(
+                self.secrets["GCP_CREDENTIAL_FILE"]
+            )
+            app = firebase_admin.initialize_app(credentials)
+
+        # Setup & auth firestore client.
+        self.firestore_client = get_firestore_client(
+            project=self.secrets["GCP_PROJECT_ID"],
+            database=self.secrets["FIRESTORE_DATABASE_ID"],
+            credential_file=self.secrets["GCP_CREDENTIAL_FILE"],
+        )
 
     def __call__(self, client_query, image=None) -> tuple:
         if image is not None:
@@ -55,73 +120,507 @@ class SearchQuerySession:
         print(sources)
         return answer, sources
 
+    async def aquery(self, client_query, image=None) -> tuple:
+        """
+        Async variant of __call__. Many concurrent questions can share one event
+        loop; within a query the LLM client is warmed up while the chunks are retrieved.
+        """
+        deadline = Deadline(self.deadline_seconds)
+        with span("query", model=self.model_name) as query_span:
+            warm_up = asyncio.create_task(
+                asyncio.to_thread(get_llm_backend(self.model_name).warm_up, asyncio.get_running_loop())
+            )
+
+            context = await self._aretrieve_context(client_query, image, deadline)
+            await warm_up
+            query_span.set_attribute("cached", context["cached_answer"] is not None)
+            if context["cached_answer"] is not None:
+                return context["cached_answer"]
+
+            # call LLM with final prompt
+            print("+++++ Prompting LLM with final prompt... +++++")
+            llm_session = self._llm_session(client_query, context, image)
+            hedge_session = self._llm_session(client_query, context, image, model_name=self.hedge_model_name)
+            llm_answer = await self._astage(
+                "llm", lambda: llm_session.allm_prediction(**GENERATION_PARAMS, timeout=deadline.remaining()), deadline,
+                hedge=lambda: self._hedged_answer(hedge_session.allm_prediction(**GENERATION_PARAMS, timeout=deadline.remaining())),
+            )
+            self._cache_answer(context, llm_answer)
+
+        return llm_answer, context["sources"]
+
+    def stream(self, client_query, image=None) -> "StreamingAnswer":
+        """
+        Streaming variant of __call__. Retrieves the sources right away & returns
+        a StreamingAnswer that yields the answer text deltas while they are generated.
+        """
+        start_time = time.perf_counter()
+        deadline = Deadline(self.deadline_seconds)
+        # the query span ends with the first token, the full stream is traced as an "llm" span
+        with span("query", model=self.model_name, stream=True) as query_span:
+            context = self._retrieve_context(client_query, image, deadline)
+            retrieval_time = time.perf_counter()
+
+            query_span.set_attribute("cached", context["cached_answer"] is not None)
+            if context["cached_answer"] is not None:
+                answer, sources = context["cached_answer"]
+                return StreamingAnswer(deltas=iter([answer["text"]]), sources=sources, start_time=start_time,
+                                       retrieval_time=retrieval_time, first_token_time=retrieval_time)
+
+            print("+++++ Streaming LLM answer... +++++")
+
+            def first_delta(model_name):
+                # hedging covers the time to the first token, the deadline the whole stream
+                deltas = self._llm_session(client_query, context, image, model_name=model_name).llm_prediction_stream(
+                    **GENERATION_PARAMS, timeout=deadline.remaining()
+                )
+                return model_name, next(deltas, ""), deltas
+
+            model_name, delta, deltas = self._stage(
+                "llm_first_token", lambda: first_delta(self.model_name), deadline,
+                hedge=lambda: first_delta(self.hedge_model_name), on_discard=lambda started: started[2].close(),
+            )
+            first_token_time = time.perf_counter()
+            deltas = itertools.chain([delta], deltas)
+
+        def on_complete(text):
+            self._cache_answer(context, {"text": text, "model_name": model_name})
+
+        return StreamingAnswer(deltas=deltas, sources=context["sources"], start_time=start_time, retrieval_time=retrieval_time,
+                               first_token_time=first_token_time, on_complete=on_complete)
+
+    def batch(self, client_queries: list, llm_concurrency: int = 8) -> list:
+        """
+        Answer many questions, e.g. evaluation sets or bulk Q&A.
+
+        The queries are embedded in batched requests, sent to the vector search
+        together and the union of their matched chunks is read from Firestore at
+        once. The LLM calls run with at most llm_concurrency in flight.
+
+        Returns one dict per query in input order, with the answer, sources,
+        per-query timings in seconds and the error if the query failed.
+        """
+        with span("query_batch", model=self.model_name, queries=len(client_queries)):
+            batch_start = time.perf_counter()
+            results = [
+                {"query": client_query, "answer": None, "sources": [], "timings": {}, "error": None}
+                for client_query in client_queries
+            ]
+
+            # Embed all queries without a cached embedding in batched requests.
+            matched = [[] for _ in client_queries]
+            if self.retrieval_mode != "lexical":
+                print(f"+++++ Generating {len(client_queries)} Client Query Embeddings... +++++")
+                start_time = time.perf_counter()
+                embeddings = [self._cached_query_embedding(client_query) for client_query in client_queries]
+                missing = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+                if missing:
+                    new_embeddings = self.embedding_session.get_vertex_embeddings([client_queries[idx] for idx in missing])
+                    for idx, embedding in zip(missing, new_embeddings):
+                        embeddings[idx] = embedding
+                        self._cache_query_embedding(client_queries[idx], embedding)
+                self._record_batch_timing(results, "embedding", start_time)
+
+                print("+++++ Finding Client Query Matches... +++++")
+                if self.mmr_fetch_k:
+                    # re-ranking needs the candidate vectors, which come with per-query lookups
+                    matched = [self._find_vector_matches(embedding, result["timings"]) for embedding, result in zip(embeddings, results)]
+                else:
+                    start_time = time.perf_counter()
+                    matched = self.vector_search_session.find_matches_batch(
+                        query_vecs=embeddings, num_neighbors=NUM_NEIGHBORS, match_thresh=MATCH_THRESH
+                    )
+                    self._record_batch_timing(results, "vector_search", start_time)
+
+            contexts = []
+            for result, vector_ids in zip(results, matched):
+                matched_ids = self._add_lexical_matches(result["query"], vector_ids, result["timings"])
+                contexts.append(self._lookup_answer(result["query"], matched_ids))
+
+            # One Firestore read for the union of the chunks matched by the uncached queries.
+            uncached = [idx for idx, context in enumerate(contexts) if context["cached_answer"] is None]
+            union_ids = list(dict.fromkeys(id for idx in uncached for id in contexts[idx]["matched_ids"]))
+            print(f"+++++ Pulling {len(union_ids)} Docs from Firestore... +++++")
+            start_time = time.perf_counter()
+            docs = {}
+            if union_ids:
+                relevant_docs, _ = self._get_doc_from_firestore(union_ids)
+                docs = {doc["id"]: doc for doc in relevant_docs}
+            self._record_batch_timing([results[idx] for idx in uncached], "firestore", start_time)
+
+            for idx in uncached:
+                matched_ids = contexts[idx]["matched_ids"]
+                self._add_docs_to_context(
+                    contexts[idx], [docs[id] for id in matched_ids if id in docs], [id for id in matched_ids if id not in docs]
+                )
+
+            def answer(idx):
+                result, context = results[idx], contexts[idx]
+                start_time = time.perf_counter()
+                try:
+                    if context["cached_answer"] is not None:
+                        result["answer"], result["sources"] = context["cached_answer"]
+                    else:
+                        result["answer"] = self._predict(result["query"], context, None, Deadline(self.deadline_seconds))
+                        result["sources"] = context["sources"]
+                        self._cache_answer(context, result["answer"])
+                except Exception as e:
+                    result["error"] = f"{type(e).__name__}: {e}"
+                result["timings"]["llm"] = time.perf_counter() - start_time
+                result["timings"]["total"] = time.perf_counter() - batch_start
+
+            print(f"+++++ Prompting LLM for {len(uncached)} queries ({len(results) - len(uncached)} cached)... +++++")
+            with ThreadPoolExecutor(max_workers=max(1, llm_concurrency)) as executor:
+                # each answer runs in a copy of this context, so its spans nest under the batch span
+                list(executor.map(lambda idx: contextvars.copy_context().run(answer, idx), range(len(results))))
+
+            failed = sum(result["error"] is not None for result in results)
+            print(f"+++++ Answered {len(results) - failed}/{len(results)} queries +++++")
+        return results
+
+    @staticmethod
+    def _record_batch_timing(results: list, stage: str, start_time: float) -> None:
+        # batched stages are shared, each query reports the duration of the whole stage
+        seconds = time.perf_counter() - start_time
+        for result in results:
+            result["timings"][stage] = seconds
+        return None
+
     def _main(self, client_query, image=None):
         """
         Orchestrates answer generation steps.
         """
-        # Generate Client Query Embedding.
-        
-        print("+++++ Generating Client Query Embedding... +++++")
-        client_query_embedding = self.embedding_session.get_vertex_embedding(
-            text_to_embed=client_query
+        deadline = Deadline(self.deadline_seconds)
+        with span("query", model=self.model_name) as query_span:
+            context = self._retrieve_context(client_query, image, deadline)
+            query_span.set_attribute("cached", context["cached_answer"] is not None)
+            if context["cached_answer"] is not None:
+                return context["cached_answer"]
+
+            # call LLM with final prompt
+            print("+++++ Prompting LLM with final prompt... +++++")   
+            llm_answer = self._predict(client_query, context, image, deadline)
+            self._cache_answer(context, llm_answer)
+
+        return llm_answer, context["sources"]
+
+    def _predict(self, client_query, context: dict, image, deadline: Deadline) -> dict:
+        # LLM answer within the deadline, hedged with the fallback model
+        return self._stage(
+            "llm",
+            lambda: self._llm_session(client_query, context, image).llm_prediction(**GENERATION_PARAMS, timeout=deadline.remaining()),
+            deadline,
+            hedge=lambda: dict(
+                self._llm_session(client_query, context, image, model_name=self.hedge_model_name).llm_prediction(
+                    **GENERATION_PARAMS, timeout=deadline.remaining()
+                ),
+                model_name=self.hedge_model_name,
+            ),
+        )
+
+    def _stage(self, stage: str, call, deadline: Deadline, hedge=None, on_discard=None):
+        """
+        Run one pipeline stage within the query deadline. With hedging enabled a
+        duplicate (hedge, or the same call) is sent once the stage exceeds its p95 latency.
+        """
+        return hedged_call(
+            stage, call, deadline=deadline, hedge=(hedge or call) if self.hedging else None,
+            tracker=self.latency_tracker, on_discard=on_discard,
         )
 
-        # Find nearest matches for client query embedding.
-        print("+++++ Finding Client Query Matches... +++++")
-        matched_ids = self.vector_search_session.find_matches(
-            query_vec=client_query_embedding, num_neighbors=10, match_thresh=0.6
+    async def _astage(self, stage: str, call, deadline: Deadline, hedge=None):
+        # async variant of _stage, call & hedge return coroutines
+        return await ahedged_call(
+            stage, call, deadline=deadline, hedge=(hedge or call) if self.hedging else None, tracker=self.latency_tracker
         )
 
+    async def _hedged_answer(self, prediction) -> dict:
+        return dict(await prediction, model_name=self.hedge_model_name)
+
+    def _retrieve_context(self, client_query, image=None, deadline: Deadline = None) -> dict:
+        """
+        Embed the query, find the matching chunks & pull their content from Firestore,
+        or the cached answer if the same question was answered over the same chunks.
+        Per-stage latencies are reported in context["timings"].
+        """
+        deadline = deadline or Deadline(self.deadline_seconds)
+        timings = {}
+        vector_ids = []
+        if self.retrieval_mode != "lexical":
+            # Generate Client Query Embedding.
+            print("+++++ Generating Client Query Embedding... +++++")
+            start_time = time.perf_counter()
+            client_query_embedding = self._cached_query_embedding(client_query)
+            if client_query_embedding is None:
+                client_query_embedding = self._stage(
+                    "embedding",
+                    lambda: self.embedding_session.get_vertex_embeddings([client_query], timeout=deadline.remaining())[0],
+                    deadline,
+                )
+                self._cache_query_embedding(client_query, client_query_embedding)
+            timings["embedding"] = time.perf_counter() - start_time
+
+            # Find nearest matches for client query embedding.
+            print("+++++ Finding Client Query Matches... +++++")
+            vector_ids = self._stage(
+                "vector_search", lambda: self._find_vector_matches(client_query_embedding, timings, deadline.remaining()), deadline
+            )
+
+        deadline.check("lexical_search")
+        matched_ids = self._add_lexical_matches(client_query, vector_ids, timings)
+        context = self._lookup_answer(client_query, matched_ids, image)
+        context["timings"] = timings
+        if context["cached_answer"] is not None:
+            return context
+
         # Get matched documents from Firestore.
         print("+++++ Pulling Docs from Firestore... +++++")
-        relevant_docs_content, relevant_docs_names = self._get_doc_from_firestore(
-            matched_ids
+        start_time = time.perf_counter()
+        relevant_docs, missing_ids = self._stage(
+            "firestore", lambda: self._get_doc_from_firestore(matched_ids, deadline.remaining()), deadline
         )
-        joined_docs_content = " ".join(relevant_docs_content)
-        
-        # call LLM with final prompt
-        print("+++++ Prompting LLM with final prompt... +++++")   
-        llm_answer = LLMSession(
+        timings["firestore"] = time.perf_counter() - start_time
+        return self._add_docs_to_context(context, relevant_docs, missing_ids)
+
+    async def _aretrieve_context(self, client_query, image=None, deadline: Deadline = None) -> dict:
+        """
+        Async variant of _retrieve_context.
+        """
+        deadline = deadline or Deadline(self.deadline_seconds)
+        timings = {}
+        vector_ids = []
+        if self.retrieval_mode != "lexical":
+            start_time = time.perf_counter()
+            client_query_embedding = self._cached_query_embedding(client_query)
+            if client_query_embedding is None:
+                client_query_embedding = (await self._astage(
+                    "embedding", lambda: self.embedding_session.aget_vertex_embeddings([client_query]), deadline
+                ))[0]
+                self._cache_query_embedding(client_query, client_query_embedding)
+            timings["embedding"] = time.perf_counter() - start_time
+
+            # the match client has no async API, the lookup runs in a worker thread; the
+            # thread cannot be cancelled, the request timeout ends it with the deadline
+            vector_ids = await self._astage(
+                "vector_search",
+                lambda: asyncio.to_thread(self._find_vector_matches, client_query_embedding, timings, deadline.remaining()),
+                deadline,
+            )
+
+        deadline.check("lexical_search")
+        matched_ids = self._add_lexical_matches(client_query, vector_ids, timings)
+        context = self._lookup_answer(client_query, matched_ids, image)
+        context["timings"] = timings
+        if context["cached_answer"] is not None:
+            return context
+
+        start_time = time.perf_counter()
+        relevant_docs, missing_ids = await self._astage(
+            "firestore", lambda: self._aget_doc_from_firestore(matched_ids, deadline.remaining()), deadline
+        )
+        timings["firestore"] = time.perf_counter() - start_time
+        return self._add_docs_to_context(context, relevant_docs, missing_ids)
+
+    def _find_vector_matches(self, client_query_embedding, timings: dict, timeout: float = None) -> list:
+        """
+        Nearest chunks of the query embedding. With MMR re-ranking enabled, mmr_fetch_k
+        candidates are fetched with their stored vectors and a diverse top NUM_NEIGHBORS
+        is picked, dropping near-duplicates of already picked chunks.
+        """
+        start_time = time.perf_counter()
+        if not self.mmr_fetch_k:
+            matched_ids = self.vector_search_session.find_matches(
+                query_vec=client_query_embedding, num_neighbors=NUM_NEIGHBORS, match_thresh=MATCH_THRESH, timeout=timeout
+            )
+            timings["vector_search"] = time.perf_counter() - start_time
+            return matched_ids
+
+        candidate_ids, candidate_vecs = self.vector_search_session.find_candidates(
+            query_vec=client_query_embedding, num_neighbors=self.mmr_fetch_k, match_thresh=MATCH_THRESH, timeout=timeout
+        )
+        timings["vector_search"] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        selected = maximal_marginal_relevance(
+            client_query_embedding, candidate_vecs, k=NUM_NEIGHBORS,
+            lambda_mult=self.mmr_lambda, duplicate_thresh=self.mmr_duplicate_thresh,
+        )
+        matched_ids = [candidate_ids[idx] for idx in selected]
+        timings["mmr"] = time.perf_counter() - start_time
+
+        top_ids = candidate_ids[:NUM_NEIGHBORS]
+        print(f"+++++ MMR: picked {len(matched_ids)} of {len(candidate_ids)} candidates, "
+              f"{len(top_ids) - len(set(top_ids) & set(matched_ids))} of the top {len(top_ids)} replaced or dropped as redundant +++++")
+        return matched_ids
+
+    def _add_lexical_matches(self, client_query, vector_ids: list, timings: dict) -> list:
+        # BM25 matches according to the retrieval mode, fused with the vector matches in hybrid mode
+        if self.retrieval_mode == "vector":
+            return vector_ids
+        if self.retrieval_mode == "hybrid" and not len(self.lexical_index):
+            # nothing indexed yet (see IngestionSession.backfill_lexical_index), fusing would only reorder the vector matches
+            return vector_ids
+
+        start_time = time.perf_counter()
+        with span("lexical_search", mode=self.retrieval_mode) as lexical_span:
+            lexical_ids, _ = self.lexical_index.search(client_query, num_results=NUM_NEIGHBORS)
+            lexical_span.set_attribute("matches", len(lexical_ids))
+        timings["lexical_search"] = time.perf_counter() - start_time
+        if self.retrieval_mode == "lexical":
+            return lexical_ids
+
+        start_time = time.perf_counter()
+        matched_ids = reciprocal_rank_fusion([vector_ids, lexical_ids])[:NUM_NEIGHBORS]
+        timings["fusion"] = time.perf_counter() - start_time
+        return matched_ids
+
+    def _cached_query_embedding(self, client_query):
+        if self.answer_cache is None:
+            return None
+        return self.answer_cache.get_query_embedding(self.embedding_session.model_name, client_query)
+
+    def _cache_query_embedding(self, client_query, client_query_embedding) -> None:
+        if self.answer_cache is not None:
+            self.answer_cache.put_query_embedding(
+                self.embedding_session.model_name, client_query, client_query_embedding
+            )
+        return None
+
+    def _lookup_answer(self, client_query, matched_ids: list, image=None) -> dict:
+        # Serve repeated questions over the same chunks from the answer cache.
+        context = {"matched_ids": matched_ids, "answer_key": None, "cached_answer": None}
+        if self.answer_cache is not None:
+            params = dict(GENERATION_PARAMS, context_token_budget=self.context_builder.token_budget)
+            if image is not None:
+                params["image_sha256"] = hashlib.sha256(image).hexdigest()
+            context["answer_key"] = self.answer_cache.answer_key(client_query, self.model_name, matched_ids, params)
+            context["cached_answer"] = self.answer_cache.get_answer(context["answer_key"])
+            if context["cached_answer"] is not None:
+                print("+++++ Answer served from cache. +++++")
+        return context
+
+    def _add_docs_to_context(self, context: dict, relevant_docs: list, missing_ids: list) -> dict:
+        if missing_ids:
+            print(f"+++++ {len(missing_ids)} matched chunks missing from Firestore: {missing_ids} +++++")
+
+        # pack the chunks into the model's context token budget
+        with span("prompt_build", model=self.model_name) as build_span:
+            content, used_docs, stats = self.context_builder.build(relevant_docs)
+            build_span.set_attributes(
+                chunks_used=stats["chunks_used"], context_tokens=stats["context_tokens"], tokens_saved=stats["tokens_saved"]
+            )
+        print(f"+++++ Context: {stats['context_tokens']} tokens from {stats['chunks_used']}/{stats['chunks_retrieved']} chunks "
+              f"(budget {stats['token_budget']}, {stats['tokens_saved']} tokens saved) +++++")
+        context["content"] = content
+        context["sources"] = list(dict.fromkeys(doc["document_name"] for doc in used_docs))
+        context["context_stats"] = stats
+        return context
+
+    def _llm_session(self, client_query, context: dict, image=None, model_name: str = None) -> LLMSession:
+        return LLMSession(
             client_query_string=client_query,
-            context_docs=joined_docs_content,
-            model_name=self.model_name,
+            context_docs=context["content"],
+            model_name=model_name or self.model_name,
             image = image,
-        ).llm_prediction(max_output_tokens=1024, temperature=0.1, top_p=0.6, top_k=20)
+        )
 
-        return llm_answer, relevant_docs_names
+    def _cache_answer(self, context: dict, llm_answer) -> None:
+        # answers of a hedged fallback model are not cached under this model's key
+        if self.answer_cache is not None and llm_answer.get("model_name", self.model_name) == self.model_name:
+            self.answer_cache.put_answer(context["answer_key"], context["matched_ids"], llm_answer, context["sources"])
+        return None
 
-    def _get_doc_from_firestore(self, matched_ids):
-        # method to get document from firestore
-        if not firebase_admin._apps:
-            credentials = firebase_admin.credentials.Certificate(
-                self.secrets["GCP_CREDENTIAL_FILE"]
-            )
-            app = firebase_admin.initialize_app(credentials)
+    def _get_doc_from_firestore(self, matched_ids, timeout: float = None):
+        """
+        Fetch the matched chunks with a single multi-document read.
 
-        # Setup & auth firestore client.
-        db = firestore.Client(project=self.secrets["GCP_PROJECT_ID"], credentials=self.credentials, database=self.secrets["FIRESTORE_DATABASE_ID"])
+        Only the fields needed for the prompt are read; the vector search rank
+        order is kept and ids without a Firestore document are returned as missing_ids.
+        The optional timeout bounds the read, e.g. to the rest of the query deadline.
+        """
+        db = self.firestore_client
+        collection = db.collection(self.firestore_collection_name)
 
         # Pull relevant docs from Firestore collection.
+        references = [collection.document(id) for id in dict.fromkeys(matched_ids)]
+        with span("chunk_fetch", chunks=len(references)) as fetch_span:
+            snapshots = {
+                snapshot.id: snapshot
+                for snapshot in db.get_all(references, field_paths=CONTEXT_FIELDS, **rpc_timeout(timeout))
+            }
+            relevant_docs, missing_ids = self._collect_docs(matched_ids, snapshots)
+            fetch_span.set_attribute("missing", len(missing_ids))
+        return relevant_docs, missing_ids
+
+    async def _aget_doc_from_firestore(self, matched_ids, timeout: float = None):
+        """
+        Async variant of _get_doc_from_firestore on the async Firestore client of the running event loop.
+        """
+        db = get_async_firestore_client(
+            project=self.secrets["GCP_PROJECT_ID"],
+            database=self.secrets["FIRESTORE_DATABASE_ID"],
+            credential_file=self.secrets["GCP_CREDENTIAL_FILE"],
+            loop=asyncio.get_running_loop(),
+        )
+        collection = db.collection(self.firestore_collection_name)
+
+        references = [collection.document(id) for id in dict.fromkeys(matched_ids)]
+        with span("chunk_fetch", chunks=len(references)) as fetch_span:
+            snapshots = {
+                snapshot.id: snapshot
+                async for snapshot in db.get_all(references, field_paths=CONTEXT_FIELDS, **rpc_timeout(timeout))
+            }
+            relevant_docs, missing_ids = self._collect_docs(matched_ids, snapshots)
+            fetch_span.set_attribute("missing", len(missing_ids))
+        return relevant_docs, missing_ids
+
+    @staticmethod
+    def _collect_docs(matched_ids: list, snapshots: dict) -> tuple:
+        # chunks (id, page_content & document_name) in rank order, plus the ids without a document
         relevant_docs = []
+        missing_ids = []
         for id in matched_ids:
-            doc = (
-                db.collection(self.firestore_collection_name)
-                .document(id)
-                .get()
-                .to_dict()
-            )
-            if doc is not None:  # dropping empty documents
-                relevant_docs.append(doc)
+            snapshot = snapshots.get(id)
+            if snapshot is None or not snapshot.exists:
+                missing_ids.append(id)
+            else:
+                relevant_docs.append(dict(snapshot.to_dict(), id=id))
+
+        return relevant_docs, missing_ids
+
+
+class StreamingAnswer:
+    """
+    Answer text streamed as deltas, e.g. for st.write_stream.
+
+    timings holds the retrieval latency, the time to first token (when the model
+    returned it, not when the consumer reads it) and, once iterated, the total
+    latency, all measured from the start of the query.
+    """
 
-        relevant_docs_content = []
-        relevant_docs_names = []
+    def __init__(self, deltas, sources: list, start_time: float, retrieval_time: float, first_token_time: float,
+                 on_complete=None):
+        self.sources = sources
+        self.text = None
+        self.timings = {
+            "retrieval_seconds": retrieval_time - start_time,
+            "time_to_first_token_seconds": first_token_time - start_time,
+            "total_seconds": None,
+        }
+        self._deltas = deltas
+        self._start_time = start_time
+        self._on_complete = on_complete
 
-        for doc in relevant_docs:
-            relevant_docs_content.append(doc["page_content"])
-            if doc["document_name"] not in relevant_docs_names:
-                relevant_docs_names.append(doc["document_name"])
+    def __iter__(self):
+        parts = []
+        for delta in self._deltas:
+            parts.append(delta)
+            yield delta
 
-        return relevant_docs_content, relevant_docs_names
+        self.text = "".join(parts)
+        self.timings["total_seconds"] = time.perf_counter() - self._start_time
+        if self._on_complete is not None:
+            self._on_complete(self.text)
 
 
 if __name__ == "__main__":
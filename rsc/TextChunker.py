@@ -0,0 +1,135 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import deque
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", ".", "!", "?", ",", " ", ""]
+
+
+class TextChunk:
+    """
+    Lightweight chunk with the page_content / metadata interface of a langchain Document.
+    """
+
+    __slots__ = ("page_content", "metadata")
+
+    def __init__(self, page_content: str, metadata: dict = None):
+        self.page_content = page_content
+        self.metadata = metadata if metadata is not None else {}
+
+    def __repr__(self) -> str:
+        return f"TextChunk(page_content={self.page_content[:40]!r}..., metadata={self.metadata!r})"
+
+
+class TextChunker:
+    """
+    Recursive character chunker producing the same chunk boundaries & overlap as
+    langchain's RecursiveCharacterTextSplitter (keep_separator=True, literal
+    separators, strip_whitespace=True, length_function=len), in linear time:
+    plain str.split instead of regex splitting and a deque for the overlap window.
+    """
+
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 50, separators: list = None):
+        if chunk_overlap > chunk_size:
+            raise ValueError(
+                f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size}), should be smaller."
+            )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(separators) if separators is not None else list(DEFAULT_SEPARATORS)
+
+    def split_text(self, text: str) -> list:
+        """
+        Split one text into chunk strings.
+        """
+        chunks = []
+        self._split(text, 0, chunks)
+        return chunks
+
+    def split_texts(self, texts: list) -> list:
+        """
+        Split many texts in one call. Returns one list of chunk strings per text.
+        """
+        return [self.split_text(text) for text in texts]
+
+    def create_chunks(self, texts: list, metadatas: list = None) -> list:
+        """
+        Split many texts into TextChunks, each carrying a copy of its text's metadata.
+        """
+        metadatas = metadatas or [{}] * len(texts)
+        return [
+            TextChunk(page_content=chunk, metadata=dict(metadata))
+            for text, metadata in zip(texts, metadatas)
+            for chunk in self.split_text(text)
+        ]
+
+    def _split(self, text: str, separator_idx: int, chunks: list) -> None:
+        # pick the first remaining separator that occurs in the text
+        separators = self.separators
+        separator = separators[-1]
+        next_separator_idx = len(separators)
+        for idx in range(separator_idx, len(separators)):
+            if separators[idx] == "":
+                separator = ""
+                break
+            if separators[idx] in text:
+                separator = separators[idx]
+                next_separator_idx = idx + 1
+                break
+
+        # split, keeping each separator at the start of the following piece
+        if separator:
+            pieces = text.split(separator)
+            splits = [pieces[0]] + [separator + piece for piece in pieces[1:]]
+            splits = [split for split in splits if split]
+        else:
+            splits = list(text)
+
+        good_splits = []
+        for split in splits:
+            if len(split) < self.chunk_size:
+                good_splits.append(split)
+                continue
+            if good_splits:
+                self._merge(good_splits, chunks)
+                good_splits = []
+            if next_separator_idx >= len(separators):
+                chunks.append(split)
+            else:
+                self._split(split, next_separator_idx, chunks)
+        if good_splits:
+            self._merge(good_splits, chunks)
+
+        return None
+
+    def _merge(self, splits: list, chunks: list) -> None:
+        # greedily combine small splits into chunks, carrying up to chunk_overlap characters over
+        current = deque()
+        total = 0
+        for split in splits:
+            length = len(split)
+            if total + length > self.chunk_size and current:
+                chunk = "".join(current).strip()
+                if chunk:
+                    chunks.append(chunk)
+                while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                    total -= len(current.popleft())
+            current.append(split)
+            total += length
+
+        chunk = "".join(current).strip()
+        if chunk:
+            chunks.append(chunk)
+
+        return None
@@ -0,0 +1,143 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import aiplatform_v1
+
+try:
+    from rsc.retry import call_with_retry
+except:
+    from retry import call_with_retry
+
+# Upsert requests are capped well below the 10 MB request size limit.
+MAX_REQUEST_BYTES = 4 * 1024 * 1024
+MAX_DATAPOINTS_PER_REQUEST = 500
+MAX_IDS_PER_REMOVE_REQUEST = 1000
+DEFAULT_MAX_CONCURRENCY = 4
+
+# raw protobuf classes: building 768-d datapoints through proto-plus marshalling is ~30x slower
+IndexDatapointPb = aiplatform_v1.IndexDatapoint.pb()
+UpsertDatapointsRequestPb = aiplatform_v1.UpsertDatapointsRequest.pb()
+
+
+class VectorIndexWriter:
+    """
+    Streaming updates to a Vertex Vector Search index.
+
+    Datapoints are split into size-bounded upsert requests that are sent
+    concurrently (at most max_concurrency in flight) and retried with
+    exponential backoff on retryable gRPC errors.
+    """
+
+    def __init__(self, credentials, gcp_project_number: str, gcp_region: str, index_id: str,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, max_attempts: int = 5):
+        self.index_client = aiplatform_v1.IndexServiceClient(credentials=credentials, client_options=dict(
+            api_endpoint=f"{gcp_region}-aiplatform.googleapis.com"
+        ))
+        self.index_name = f"projects/{gcp_project_number}/locations/{gcp_region}/indexes/{index_id}"
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+
+    @staticmethod
+    def _estimate_bytes(datapoint_id: str, vector) -> int:
+        # serialized size of an IndexDatapoint: id + packed float32 values + field overhead
+        return len(datapoint_id) + 4 * len(vector) + 16
+
+    def _split_requests(self, datapoints: list):
+        request = []
+        request_bytes = 0
+        for datapoint_id, vector in datapoints:
+            size = self._estimate_bytes(datapoint_id, vector)
+            if request and (len(request) >= MAX_DATAPOINTS_PER_REQUEST or request_bytes + size > MAX_REQUEST_BYTES):
+                yield request
+                request = []
+                request_bytes = 0
+            request.append(IndexDatapointPb(datapoint_id=datapoint_id, feature_vector=vector))
+            request_bytes += size
+        if request:
+            yield request
+
+    def _send_upsert(self, datapoints: list) -> int:
+        upsert_request = aiplatform_v1.UpsertDatapointsRequest(
+            UpsertDatapointsRequestPb(index=self.index_name, datapoints=datapoints)
+        )
+        call_with_retry(self.index_client.upsert_datapoints, request=upsert_request, max_attempts=self.max_attempts)
+        return len(datapoints)
+
+    def _send_remove(self, datapoint_ids: list) -> int:
+        deletion_request = aiplatform_v1.RemoveDatapointsRequest(index=self.index_name, datapoint_ids=datapoint_ids)
+        call_with_retry(self.index_client.remove_datapoints, request=deletion_request, max_attempts=self.max_attempts)
+        return len(datapoint_ids)
+
+    def upsert(self, datapoints: list) -> dict:
+        """
+        Upsert a list of (datapoint id, vector) tuples. Returns upsert statistics.
+        """
+        return self.upsert_stream([datapoints])
+
+    def upsert_stream(self, datapoint_batches) -> dict:
+        """
+        Upsert an iterable of (datapoint id, vector) lists. Every batch is sent as
+        soon as it is produced, so the producer (e.g. embedding) overlaps with the upload.
+        Returns upsert statistics once all requests completed.
+        """
+        return self._run(
+            self._send_upsert,
+            (request for datapoints in datapoint_batches for request in self._split_requests(datapoints)),
+        )
+
+    def remove(self, datapoint_ids: list) -> dict:
+        """
+        Remove datapoints by id in batched requests. Returns removal statistics.
+        """
+        return self._run(
+            self._send_remove,
+            (datapoint_ids[i:i + MAX_IDS_PER_REMOVE_REQUEST] for i in range(0, len(datapoint_ids), MAX_IDS_PER_REMOVE_REQUEST)),
+        )
+
+    def _run(self, send, requests) -> dict:
+        start_time = time.time()
+        # backpressure: the producer blocks while too many requests are in flight
+        in_flight = threading.BoundedSemaphore(self.max_concurrency * 2)
+        futures = []
+        sent = 0
+        failed = 0
+        errors = []
+
+        # one executor per run, its threads end with the run
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for request in requests:
+                in_flight.acquire()
+                future = executor.submit(send, request)
+                future.add_done_callback(lambda _: in_flight.release())
+                futures.append((future, len(request)))
+
+            for future, count in futures:
+                try:
+                    sent += future.result()
+                except Exception as e:
+                    failed += count
+                    errors.append(f"{type(e).__name__}: {e}")
+
+        return {
+            "datapoints": sent + failed,
+            "sent": sent,
+            "failed": failed,
+            "requests": len(futures),
+            "seconds": time.time() - start_time,
+            "errors": errors,
+        }
@@ -12,9 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from dotenv import dotenv_values
-import time
+
+import numpy as np
 
 from google.cloud import aiplatform
+from google.cloud import aiplatform_v1
 import google.auth
 
 from google.cloud import bigquery
@@ -25,8 +27,17 @@ from langchain_community.vectorstores import BigQueryVectorSearch
 
 try:
     from rsc.EmbeddingSession import EmbeddingSession
+    from rsc.ClientRegistry import LOCAL_VECTOR_BACKENDS, get_index_endpoint, get_local_vector_index, get_match_client, get_vector_search_backend
+    from rsc.hedging import rpc_timeout
+    from rsc.tracing import span
 except:
     from EmbeddingSession import EmbeddingSession
+    from ClientRegistry import LOCAL_VECTOR_BACKENDS, get_index_endpoint, get_local_vector_index, get_match_client, get_vector_search_backend
+    from hedging import rpc_timeout
+    from tracing import span
+
+# queries per find_neighbors request of find_matches_batch
+FIND_NEIGHBORS_BATCH_SIZE = 64
 
 
 class VectorSearchSession:
@@ -39,6 +50,7 @@ class VectorSearchSession:
                  credentials,
                  gcp_region,
                  api_endpoint,
+                 backend=None,
                  ):
         
         self.secrets = dotenv_values(".env")
@@ -50,9 +62,48 @@ class VectorSearchSession:
         self.index_endpoint_id = index_endpoint_id # vector search index index endpoint if (numeric)
         self.deployed_index_id = deployed_index_id # vector search index deployed index id (aphanumeric)
         self.api_endpoint = api_endpoint # gcp me api endpoint, depending on region
+        self.backend = backend or get_vector_search_backend() # "vertex", "local" or "ivfpq"
+
+    @property
+    def index_endpoint_name(self) -> str:
+        return f"projects/{self.gcp_project_number}/locations/{self.gcp_region}/indexEndpoints/{self.index_endpoint_id}"
+
+    @property
+    def index_endpoint(self) -> aiplatform.MatchingEngineIndexEndpoint:
+        """
+        Index endpoint handle, shared process-wide via the client registry.
+        """
+        return get_index_endpoint(
+            index_endpoint_name=self.index_endpoint_name,
+            project=self.gcp_project_id,
+            location=self.gcp_region,
+            credentials=self.credentials,
+        )
+
+    def _find_neighbors(self, query_vecs: list, num_neighbors: int, return_full_datapoint: bool = False, timeout: float = None) -> list:
+        """
+        One find_neighbors request on the public endpoint of the deployed index.
+        The match client is called directly, as the SDK endpoint takes no per-call timeout.
+
+        Returns the neighbors of every query vector, in input order.
+        """
+        client = get_match_client(self.index_endpoint.public_endpoint_domain_name, self.credentials)
+        request = aiplatform_v1.FindNeighborsRequest(
+            index_endpoint=self.index_endpoint_name,
+            deployed_index_id=self.deployed_index_id,
+            queries=[
+                aiplatform_v1.FindNeighborsRequest.Query(
+                    datapoint=aiplatform_v1.IndexDatapoint(feature_vector=query_vec), neighbor_count=num_neighbors
+                )
+                for query_vec in query_vecs
+            ],
+            return_full_datapoint=return_full_datapoint,
+        )
+        response = client.find_neighbors(request=request, **rpc_timeout(timeout))
+        return [nearest.neighbors for nearest in response.nearest_neighbors]
 
     def find_matches(
-        self, query_vec: list, num_neighbors: int = 10, match_thresh: float = 0.6
+        self, query_vec: list, num_neighbors: int = 10, match_thresh: float = 0.6, timeout: float = None
     ) -> list:
         """
         Finding nearest neighbours based on input vector (embedded client query).
@@ -65,6 +116,8 @@ class VectorSearchSession:
             number of nearest neighbours to return
         match_thresh : float
             threshold for matching
+        timeout : float
+            optional request timeout in seconds, e.g. the rest of a query deadline
 
         Returns
         -------
@@ -72,26 +125,93 @@ class VectorSearchSession:
             list of matched ids
         """
 
-        print (self.gcp_project_number)
-        index_endpoint = aiplatform.MatchingEngineIndexEndpoint(index_endpoint_name=f"projects/{self.gcp_project_number}/locations/{self.gcp_region}/indexEndpoints/{self.index_endpoint_id}",
-                                                                project=self.gcp_project_id,
-                                                                location=self.gcp_region,
-                                                                credentials=self.credentials
-                                                                )
-        
-        start_time = time.time()
-        res = index_endpoint.find_neighbors(deployed_index_id=self.deployed_index_id, queries=[query_vec], num_neighbors=num_neighbors)
-        end_time = time.time()
-        duration_seconds = end_time - start_time
+        if self.backend in LOCAL_VECTOR_BACKENDS:
+            return self._local_find_matches(query_vec, num_neighbors, match_thresh)
+
+        with span("ann_search", backend=self.backend, queries=1, num_neighbors=num_neighbors) as ann_span:
+            neighbors = self._find_neighbors([query_vec], num_neighbors, timeout=timeout)[0]
+            matched_ids = [match.datapoint.datapoint_id for match in neighbors if match.distance >= match_thresh]
+            ann_span.set_attribute("matches", len(matched_ids))
 
-        matched_ids = [match.id for match in res[0] if match.distance >= match_thresh]
-        
         print("#### Vertex Vector Search ####")
         print(f"Matched ids: {matched_ids}")
-        print(f"Vector Search VS Seconds: {duration_seconds}")
 
         return matched_ids
     
+    def _local_find_matches(self, query_vec: list, num_neighbors: int, match_thresh: float) -> list:
+        # exact or IVF-PQ search on the memory-mapped local index
+        with span("ann_search", backend=self.backend, queries=1, num_neighbors=num_neighbors) as ann_span:
+            matched_ids = get_local_vector_index().find_matches(query_vec, num_neighbors, match_thresh)
+            ann_span.set_attribute("matches", len(matched_ids))
+
+        print("#### Local Vector Search ####")
+        print(f"Matched ids: {matched_ids}")
+
+        return matched_ids
+
+    def find_candidates(
+        self, query_vec: list, num_neighbors: int = 10, match_thresh: float = 0.6, timeout: float = None
+    ) -> tuple:
+        """
+        Like find_matches, but also returns the stored vectors of the matches,
+        e.g. for re-ranking.
+
+        Returns
+        -------
+        matched_ids : list
+            list of matched ids
+        vectors : np.ndarray
+            one stored vector per matched id
+        """
+
+        if self.backend in LOCAL_VECTOR_BACKENDS:
+            with span("ann_search", backend=self.backend, queries=1, num_neighbors=num_neighbors, vectors=True) as ann_span:
+                local_index = get_local_vector_index()
+                matched_ids = local_index.find_matches(query_vec, num_neighbors, match_thresh)
+                ann_span.set_attribute("matches", len(matched_ids))
+                return matched_ids, local_index.get_vectors(matched_ids)
+
+        with span("ann_search", backend=self.backend, queries=1, num_neighbors=num_neighbors, vectors=True) as ann_span:
+            neighbors = self._find_neighbors([query_vec], num_neighbors, return_full_datapoint=True, timeout=timeout)[0]
+            matches = [match for match in neighbors if match.distance >= match_thresh]
+            ann_span.set_attribute("matches", len(matches))
+        matched_ids = [match.datapoint.datapoint_id for match in matches]
+        print("#### Vertex Vector Search (with vectors) ####")
+        print(f"Matched ids: {matched_ids}")
+
+        return matched_ids, np.asarray([list(match.datapoint.feature_vector) for match in matches], dtype=np.float32)
+
+    def find_matches_batch(
+        self, query_vecs: list, num_neighbors: int = 10, match_thresh: float = 0.6
+    ) -> list:
+        """
+        find_matches for many query vectors, sent to find_neighbors together in
+        requests of up to FIND_NEIGHBORS_BATCH_SIZE queries.
+
+        Returns
+        -------
+        matched_ids : list
+            one list of matched ids per query vector, in input order
+        """
+
+        if self.backend in LOCAL_VECTOR_BACKENDS:
+            with span("ann_search", backend=self.backend, queries=len(query_vecs), num_neighbors=num_neighbors):
+                return get_local_vector_index().find_matches_batch(query_vecs, num_neighbors, match_thresh)
+
+        matched_ids = []
+        for first in range(0, len(query_vecs), FIND_NEIGHBORS_BATCH_SIZE):
+            batch = query_vecs[first:first + FIND_NEIGHBORS_BATCH_SIZE]
+            with span("ann_search", backend=self.backend, queries=len(batch), num_neighbors=num_neighbors):
+                res = self._find_neighbors(batch, num_neighbors)
+            matched_ids.extend(
+                [match.datapoint.datapoint_id for match in neighbors if match.distance >= match_thresh] for neighbors in res
+            )
+
+        print("#### Vertex Vector Search (batch) ####")
+        print(f"Queries: {len(query_vecs)}")
+
+        return matched_ids
+
     def bq_find_matches(self, string_query:str, query_vec: list, num_neighbors: int = 10, match_thresh: float = 0.6):
         
         # embedding_model = VertexAIEmbeddings(
@@ -129,15 +249,13 @@ class VectorSearchSession:
 
         client = bigquery.Client(project=self.secrets['GCP_PROJECT_ID'], credentials=self.credentials, location=self.secrets["GCP_REGION"])
 
-        start_time = time.time()
-        rows = client.query_and_wait(query=bq_query_str)
-        end_time = time.time()
-        duration_seconds = end_time - start_time
+        with span("ann_search", backend="bigquery", queries=1, num_neighbors=num_neighbors) as ann_span:
+            rows = client.query_and_wait(query=bq_query_str)
+            matched_ids = [row[1]["id"] for row in rows]
+            ann_span.set_attribute("matches", len(matched_ids))
 
-        matched_ids = [row[1]["id"] for row in rows]
         print("#### BQ Vector Search ####")
         print(f"Matched ids: {matched_ids}")
-        print(f"BigQuery VS Seconds: {duration_seconds}")
 
         return matched_ids
 
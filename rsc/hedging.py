@@ -0,0 +1,214 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# hedged duplicates are sent once a stage is slower than this percentile of its recent latencies
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY_SECONDS = 0.005
+LATENCY_WINDOW = 512
+
+# stage calls run on a shared pool, so a caller can stop waiting for them; the calls
+# pass the remaining deadline to their RPCs as timeout, so abandoned calls end by then
+_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="query-stage")
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    A query stage did not finish before the query deadline.
+    """
+
+    def __init__(self, stage: str, deadline_seconds: float):
+        super().__init__(f"Query deadline of {deadline_seconds:.2f}s exceeded in stage {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Point in time by which a query has to be answered, passed down to every stage.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage: str) -> None:
+        if self.expired():
+            raise DeadlineExceeded(stage, self.seconds)
+        return None
+
+
+def rpc_timeout(timeout: float = None) -> dict:
+    """
+    timeout= keyword for an RPC bounded by the query deadline, e.g.
+    client.get_all(refs, **rpc_timeout(deadline.remaining())). Without a
+    deadline the client's default timeout applies.
+    """
+    return {} if timeout is None else {"timeout": timeout}
+
+
+class LatencyTracker:
+    """
+    Recent latencies per stage with percentile lookups, plus hedging counters.
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._latencies = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+        return None
+
+    def percentile(self, stage: str, percentile: float = HEDGE_PERCENTILE, min_samples: int = HEDGE_MIN_SAMPLES):
+        # None until enough latencies of the stage were observed
+        with self._lock:
+            latencies = sorted(self._latencies.get(stage, ()))
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(int(len(latencies) * percentile / 100), len(latencies) - 1)]
+
+    def count(self, stage: str, counter: str) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(stage, {"hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0})
+            counters[counter] += 1
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            stages = set(self._latencies) | set(self._counters)
+            counters = {stage: dict(self._counters.get(stage, {"hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0})) for stage in stages}
+        for stage in stages:
+            counters[stage]["p95_seconds"] = self.percentile(stage, min_samples=1)
+        return counters
+
+
+def hedged_call(stage: str, call, deadline: Deadline = None, hedge=None, tracker: LatencyTracker = None, on_discard=None):
+    """
+    Run call() within the deadline. If hedge is given and the call is slower than
+    the tracked p95 latency of the stage, hedge() is started as well and the first
+    successful response wins.
+
+    Pending losers are cancelled; calls already running in a worker thread cannot
+    be interrupted, so their results are passed to on_discard (e.g. to close a stream)
+    once they finish. Raises DeadlineExceeded when no response arrives in time.
+    """
+    start_time = time.perf_counter()
+    # calls run in the caller's context, so their tracing spans nest under the caller's
+    primary = _executor.submit(contextvars.copy_context().run, call)
+    if tracker is not None:
+        primary.add_done_callback(lambda future: _record(tracker, stage, future, start_time))
+
+    futures = [primary]
+    hedge_delay = tracker.percentile(stage) if hedge is not None and tracker is not None else None
+    if hedge_delay is not None:
+        wait(futures, timeout=_timeout(max(hedge_delay, HEDGE_MIN_DELAY_SECONDS), deadline))
+        if not primary.done() and not (deadline is not None and deadline.expired()):
+            futures.append(_executor.submit(contextvars.copy_context().run, hedge))
+            tracker.count(stage, "hedges")
+
+    pending = list(futures)
+    error = None
+    while pending:
+        done, _ = wait(pending, timeout=_timeout(None, deadline), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            pending.remove(future)
+            if future.exception() is None:
+                if future is not primary and tracker is not None:
+                    tracker.count(stage, "hedge_wins")
+                _discard(pending, on_discard)
+                return future.result()
+            error = future.exception()
+
+    if pending:
+        _discard(pending, on_discard)
+        if tracker is not None:
+            tracker.count(stage, "deadline_exceeded")
+        raise DeadlineExceeded(stage, deadline.seconds)
+    raise error
+
+
+async def ahedged_call(stage: str, call, deadline: Deadline = None, hedge=None, tracker: LatencyTracker = None):
+    """
+    Async variant of hedged_call; call & hedge return coroutines. Losers are cancelled.
+    """
+    start_time = time.perf_counter()
+    primary = asyncio.ensure_future(call())
+    if tracker is not None:
+        primary.add_done_callback(lambda future: _record(tracker, stage, future, start_time))
+
+    tasks = [primary]
+    hedge_delay = tracker.percentile(stage) if hedge is not None and tracker is not None else None
+    if hedge_delay is not None:
+        await asyncio.wait(tasks, timeout=_timeout(max(hedge_delay, HEDGE_MIN_DELAY_SECONDS), deadline))
+        if not primary.done() and not (deadline is not None and deadline.expired()):
+            tasks.append(asyncio.ensure_future(hedge()))
+            tracker.count(stage, "hedges")
+
+    pending = list(tasks)
+    error = None
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, timeout=_timeout(None, deadline), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if tracker is not None:
+                    tracker.count(stage, "deadline_exceeded")
+                raise DeadlineExceeded(stage, deadline.seconds)
+            for task in done:
+                pending.remove(task)
+                if task.exception() is None:
+                    if task is not primary and tracker is not None:
+                        tracker.count(stage, "hedge_wins")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _timeout(seconds, deadline: Deadline):
+    if deadline is None:
+        return seconds
+    return deadline.remaining() if seconds is None else min(seconds, deadline.remaining())
+
+
+def _record(tracker: LatencyTracker, stage: str, future, start_time: float) -> None:
+    if not future.cancelled() and future.exception() is None:
+        tracker.record(stage, time.perf_counter() - start_time)
+    return None
+
+
+def _discard(futures: list, on_discard) -> None:
+    for future in futures:
+        if not future.cancel() and on_discard is not None:
+            future.add_done_callback(lambda done: done.exception() is None and on_discard(done.result()))
+    return None
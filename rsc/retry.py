@@ -0,0 +1,47 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import time
+
+from google.api_core import exceptions
+
+# transient gRPC / HTTP errors that are safe to retry (ABORTED, DEADLINE_EXCEEDED,
+# UNAVAILABLE, RESOURCE_EXHAUSTED, INTERNAL)
+RETRYABLE_EXCEPTIONS = (
+    exceptions.Aborted,
+    exceptions.DeadlineExceeded,
+    exceptions.ServiceUnavailable,
+    exceptions.ResourceExhausted,
+    exceptions.InternalServerError,
+)
+
+
+def call_with_retry(func, *args, retryable=RETRYABLE_EXCEPTIONS, max_attempts: int = 5,
+                    initial_delay: float = 0.5, max_delay: float = 16.0, **kwargs):
+    """
+    Call func(*args, **kwargs), retrying retryable errors with jittered exponential backoff.
+
+    The last error is re-raised once max_attempts is reached.
+    """
+    delay = initial_delay
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return func(*args, **kwargs)
+        except retryable as e:
+            if attempt == max_attempts:
+                raise
+            print(f"Retrying {getattr(func, '__name__', func)} after {type(e).__name__} (attempt {attempt}/{max_attempts})")
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, max_delay)
@@ -0,0 +1,338 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Lightweight tracing of the query & ingestion stages.
+
+Spans (embed, ann_search, chunk_fetch, prompt_build, llm, ocr, chunking,
+firestore_write, upsert, ...) carry attributes such as chunk counts, bytes,
+tokens & model. Their durations are aggregated in HDR-style histograms that can
+be exported to a JSON file, served over HTTP and mirrored to OpenTelemetry.
+"""
+
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+# histogram buckets: values below 2^SUB_BUCKET_BITS microseconds are exact, above that
+# every power of two is split into 2^(SUB_BUCKET_BITS - 1) buckets (< 1.6% relative error)
+SUB_BUCKET_BITS = 7
+MAX_SHIFT = 34  # up to ~2^41 microseconds
+# attributes that get a histogram of their own per value, e.g. llm[model=gemini-1.5-flash]
+HISTOGRAM_ATTRIBUTES = ("model", "backend")
+PERCENTILES = (50, 90, 95, 99, 99.9)
+DEFAULT_MAX_SPANS = 2048
+
+_span_ids = itertools.count(1)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class LatencyHistogram:
+    """
+    Log-linear latency histogram with constant-time recording and bounded relative error.
+    """
+
+    _sub_buckets = 1 << SUB_BUCKET_BITS
+    _half = _sub_buckets >> 1
+
+    def __init__(self):
+        self.counts = [0] * (self._sub_buckets + MAX_SHIFT * self._half)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.counts[self._index(int(seconds * 1e6))] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        return None
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return None
+
+    def percentile(self, percentile: float) -> float:
+        # midpoint of the bucket holding the percentile, in seconds
+        if not self.count:
+            return 0.0
+        target = max(1, int(round(percentile / 100 * self.count + 0.5 - 1e-9)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._value(index) / 1e6, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        snapshot = {
+            "count": self.count,
+            "mean_seconds": self.total / self.count if self.count else 0.0,
+            "min_seconds": self.min or 0.0,
+            "max_seconds": self.max,
+        }
+        for percentile in PERCENTILES:
+            snapshot[f"p{percentile:g}_seconds"] = self.percentile(percentile)
+        return snapshot
+
+    def _index(self, micros: int) -> int:
+        if micros < self._sub_buckets:
+            return max(micros, 0)
+        shift = min(micros.bit_length() - SUB_BUCKET_BITS, MAX_SHIFT)
+        mantissa = min(micros >> shift, self._sub_buckets - 1)
+        return self._sub_buckets + (shift - 1) * self._half + (mantissa - self._half)
+
+    def _value(self, index: int) -> float:
+        if index < self._sub_buckets:
+            return index + 0.5
+        shift = (index - self._sub_buckets) // self._half + 1
+        mantissa = (index - self._sub_buckets) % self._half + self._half
+        return (mantissa + 0.5) * (1 << shift)
+
+
+class Span:
+    """
+    One timed stage with attributes, nested under the span active when it started.
+    """
+
+    def __init__(self, name: str, attributes: dict, parent: "Span" = None):
+        self.name = name
+        self.attributes = attributes
+        self.span_id = next(_span_ids)
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+        return None
+
+    def set_attributes(self, **attributes) -> None:
+        self.attributes.update(attributes)
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_seconds": self.duration,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    """
+    Collects spans into per-stage histograms & a ring buffer of recent spans.
+
+    export_path: JSON snapshot file, rewritten in the background at most every export_interval_seconds.
+    otel: mirror spans to the OpenTelemetry tracer provider, if opentelemetry is installed.
+    """
+
+    def __init__(self, export_path: str = None, export_interval_seconds: float = 10.0,
+                 max_spans: int = DEFAULT_MAX_SPANS, otel: bool = False):
+        self.export_path = export_path
+        self.export_interval_seconds = export_interval_seconds
+        self._histograms = {}
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+        self._last_export = time.monotonic()
+        self._server = None
+
+        self._otel_tracer = None
+        if otel and otel_trace is None:
+            print("+++++ opentelemetry is not installed, spans are not exported to OpenTelemetry. +++++")
+        elif otel:
+            self._otel_tracer = otel_trace.get_tracer("retrieval-aug-agent")
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Time the with-block as a span; attributes can be added to the yielded span.
+        """
+        span = Span(name, attributes, _current_span.get())
+        token = _current_span.set(span)
+        otel_span = self._otel_tracer.start_as_current_span(name) if self._otel_tracer else contextlib.nullcontext()
+        try:
+            with otel_span as otel:
+                try:
+                    yield span
+                except BaseException as e:
+                    span.set_attribute("error", type(e).__name__)
+                    raise
+                finally:
+                    span.duration = time.perf_counter() - span._start
+                    if otel is not None:
+                        otel.set_attributes({k: v for k, v in span.attributes.items() if isinstance(v, (str, bool, int, float))})
+        finally:
+            _current_span.reset(token)
+            self._finish(span)
+
+    def record(self, name: str, seconds: float, **attributes) -> None:
+        """
+        Record an already measured stage, e.g. a stream consumed across threads.
+        """
+        span = Span(name, attributes, _current_span.get())
+        span.duration = seconds
+        self._finish(span)
+        return None
+
+    def stats(self) -> dict:
+        # histogram snapshots by span name
+        with self._lock:
+            return {name: histogram.snapshot() for name, histogram in sorted(self._histograms.items())}
+
+    def snapshot(self) -> dict:
+        stats = self.stats()
+        with self._lock:
+            spans = [span.to_dict() for span in self._spans]
+        return {"exported_at": time.time(), "histograms": stats, "spans": spans}
+
+    def export(self, path: str = None) -> str:
+        """
+        Write the histograms & recent spans as JSON, atomically.
+        """
+        path = path or self.export_path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # one temporary file per writer, exports of other threads & processes may overlap
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.snapshot(), f, default=str)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def _export_periodically(self) -> None:
+        # runs on its own thread, so neither the export time nor a failing write reaches the traced request
+        try:
+            self.export()
+        except OSError as e:
+            print(f"+++++ Trace export to {self.export_path} failed: {e} +++++")
+        return None
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """
+        Serve GET /metrics (histograms) & /spans (recent spans) as JSON from a daemon thread.
+        """
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics"):
+                    body = tracer.stats()
+                elif self.path.startswith("/spans"):
+                    body = tracer.snapshot()["spans"]
+                else:
+                    self.send_error(404)
+                    return
+                payload = json.dumps(body, default=str).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                return None
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._spans.clear()
+        return None
+
+    def _finish(self, span: Span) -> None:
+        keys = [span.name] + [
+            f"{span.name}[{attribute}={span.attributes[attribute]}]"
+            for attribute in HISTOGRAM_ATTRIBUTES if attribute in span.attributes
+        ]
+        with self._lock:
+            for key in keys:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = LatencyHistogram()
+                histogram.record(span.duration)
+            self._spans.append(span)
+            export = self.export_path and time.monotonic() - self._last_export >= self.export_interval_seconds
+            if export:
+                self._last_export = time.monotonic()
+        if export:
+            threading.Thread(target=self._export_periodically, name="trace-export", daemon=True).start()
+        return None
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """
+    The process-wide tracer, configured from .env on first use
+    (TRACE_EXPORT_PATH, TRACE_EXPORT_INTERVAL_SECONDS, TRACE_METRICS_PORT, TRACE_OTEL_ENABLED).
+    """
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                try:
+                    from rsc.ClientRegistry import get_secrets
+                except:
+                    from ClientRegistry import get_secrets
+
+                secrets = get_secrets()
+                tracer = Tracer(
+                    export_path=secrets.get("TRACE_EXPORT_PATH") or None,
+                    export_interval_seconds=float(secrets.get("TRACE_EXPORT_INTERVAL_SECONDS") or 10.0),
+                    otel=str(secrets.get("TRACE_OTEL_ENABLED") or "").lower() in ("1", "true", "yes"),
+                )
+                if secrets.get("TRACE_METRICS_PORT"):
+                    tracer.serve(int(secrets["TRACE_METRICS_PORT"]))
+                _tracer = tracer
+    return _tracer
+
+
+def span(name: str, **attributes):
+    # span on the process-wide tracer
+    return get_tracer().span(name, **attributes)
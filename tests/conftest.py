@@ -0,0 +1,38 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Shared fixtures: the in-memory GCP fakes of benchmarks.fakes without simulated latency.
+"""
+
+import pytest
+
+from benchmarks import fakes
+
+
+@pytest.fixture
+def no_latency(monkeypatch):
+    # the fakes answer instantly, so tests only wait where they sleep on purpose
+    monkeypatch.setattr(fakes, "LATENCIES", {operation: 0.0 for operation in fakes.LATENCIES})
+    monkeypatch.setattr(fakes.FakeTextEmbeddingModel, "load_latency", 0.0)
+    monkeypatch.setattr(fakes.FakeTextEmbeddingModel, "request_latency", 0.0)
+    monkeypatch.setattr(fakes.FakeTextEmbeddingModel, "per_text_latency", 0.0)
+    return None
+
+
+@pytest.fixture
+def gcp_backend(no_latency):
+    with fakes.fake_gcp_backend({"VECTOR_SEARCH_BACKEND": "vertex", "ANSWER_CACHE_DISABLED": "true"}):
+        yield
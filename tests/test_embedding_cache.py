@@ -0,0 +1,101 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import sqlite3
+
+import pytest
+
+from rsc.EmbeddingCache import EmbeddingCache
+
+MODEL = "text-embedding-004"
+
+
+def vector(seed: int, dimensions: int = 8) -> list:
+    return [float(seed + idx) for idx in range(dimensions)]
+
+
+class FailingInserts:
+    # connection proxy whose INSERTs fail, e.g. on a full disk
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, *args):
+        if sql.startswith("INSERT"):
+            raise sqlite3.OperationalError("database or disk is full")
+        return self.conn.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def test_round_trip_per_model_and_task_type(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.sqlite"))
+    cache.put_many(MODEL, None, ["a", "b"], [vector(1), vector(2)])
+    cache.put_many(MODEL, "RETRIEVAL_QUERY", ["a"], [vector(3)])
+
+    assert cache.get_many(MODEL, None, ["b", "c", "a"]) == [vector(2), None, vector(1)]
+    assert cache.get_many(MODEL, "RETRIEVAL_QUERY", ["a", "b"]) == [vector(3), None]
+    assert cache.get_many("other-model", None, ["a"]) == [None]
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 3
+
+
+def test_entries_persist_across_reopen(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    EmbeddingCache(path=path).put_many(MODEL, None, ["a", "b"], [vector(1), vector(2)])
+
+    reopened = EmbeddingCache(path=path)
+    assert reopened.get_many(MODEL, None, ["a", "b"]) == [vector(1), vector(2)]
+    assert reopened.stats()["size_bytes"] == 2 * 8 * 4
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    # room for three 32-byte vectors
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.sqlite"), max_bytes=3 * 8 * 4)
+    for seed, text in enumerate("abc", start=1):
+        cache.put_many(MODEL, None, [text], [vector(seed)])
+    cache.get_many(MODEL, None, ["a"])
+    cache.put_many(MODEL, None, ["d"], [vector(4)])
+
+    assert cache.get_many(MODEL, None, ["a", "b", "c", "d"]) == [vector(1), None, vector(3), vector(4)]
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size_bytes"] == 3 * 8 * 4
+
+
+def test_replacing_an_entry_keeps_the_size(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.sqlite"))
+    cache.put_many(MODEL, None, ["a"], [vector(1)])
+    cache.put_many(MODEL, None, ["a"], [vector(2)])
+
+    assert cache.get_many(MODEL, None, ["a"]) == [vector(2)]
+    assert cache.stats()["size_bytes"] == 8 * 4
+
+
+def test_failed_write_is_rolled_back(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.sqlite"))
+    cache.put_many(MODEL, None, ["a"], [vector(1)])
+
+    conn = cache._conn
+    cache._conn = FailingInserts(conn)
+    with pytest.raises(sqlite3.OperationalError):
+        cache.put_many(MODEL, None, ["b", "c"], [vector(2), vector(3)])
+    cache._conn = conn
+
+    assert not conn.in_transaction
+    assert cache.stats()["size_bytes"] == 8 * 4
+    # the cache keeps working after the failure
+    cache.put_many(MODEL, None, ["b"], [vector(2)])
+    assert cache.get_many(MODEL, None, ["a", "b", "c"]) == [vector(1), vector(2), None]
+    assert cache.stats()["size_bytes"] == 2 * 8 * 4
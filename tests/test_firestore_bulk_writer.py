@@ -0,0 +1,116 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import itertools
+
+import pytest
+from google.api_core import exceptions
+
+from benchmarks.fakes import FakeFirestoreClient, FakeWriteBatch, reset_fake_stores
+from rsc.FirestoreBulkWriter import MAX_BATCH_SIZE, FirestoreBulkWriter
+
+COLLECTION = "chunks"
+
+
+class FlakyFirestoreClient(FakeFirestoreClient):
+    # the first failures commits are rejected, e.g. on write contention
+    def __init__(self, failures: int, error=exceptions.Aborted):
+        self._calls = itertools.count()
+        self.failures = failures
+        self.error = error
+
+    def batch(self):
+        client = self
+
+        class FlakyBatch(FakeWriteBatch):
+            def commit(self, **kwargs):
+                if next(client._calls) < client.failures:
+                    raise client.error("too much contention on these documents")
+                return super().commit(**kwargs)
+
+        return FlakyBatch()
+
+
+@pytest.fixture(autouse=True)
+def fake_store(no_latency, monkeypatch):
+    reset_fake_stores()
+    # no backoff between retries
+    monkeypatch.setattr("rsc.retry.time.sleep", lambda seconds: None)
+    yield
+    reset_fake_stores()
+
+
+def stored() -> dict:
+    return dict(FakeFirestoreClient.store.get(COLLECTION, {}))
+
+
+def documents(count: int) -> dict:
+    return {f"doc-chunk{idx}": {"id": f"doc-chunk{idx}", "page_content": f"text {idx}"} for idx in range(count)}
+
+
+def test_set_documents_in_batches_of_at_most_500():
+    stats = FirestoreBulkWriter(FakeFirestoreClient(), COLLECTION).set_documents(documents(1201))
+
+    assert stats["batches"] == 3
+    assert (stats["operations"], stats["written"], stats["failed"]) == (1201, 1201, 0)
+    assert stored() == documents(1201)
+
+
+def test_batch_size_is_capped():
+    writer = FirestoreBulkWriter(FakeFirestoreClient(), COLLECTION, batch_size=10000)
+    assert writer.batch_size == MAX_BATCH_SIZE
+
+
+def test_update_and_delete_documents():
+    writer = FirestoreBulkWriter(FakeFirestoreClient(), COLLECTION, batch_size=2)
+    writer.set_documents(documents(5))
+
+    writer.update_documents({"doc-chunk0": {"content_hash": "abc"}})
+    stats = writer.delete_documents(["doc-chunk1", "doc-chunk2", "doc-chunk9"])
+
+    assert stats["batches"] == 2
+    assert stored()["doc-chunk0"] == {"id": "doc-chunk0", "page_content": "text 0", "content_hash": "abc"}
+    assert set(stored()) == {"doc-chunk0", "doc-chunk3", "doc-chunk4"}
+
+
+def test_update_of_a_missing_document_fails():
+    stats = FirestoreBulkWriter(FakeFirestoreClient(), COLLECTION).update_documents({"missing": {"content_hash": "abc"}})
+    assert (stats["written"], stats["failed"]) == (0, 1)
+    assert "NotFound" in stats["errors"][0]
+
+
+def test_contention_is_retried():
+    stats = FirestoreBulkWriter(FlakyFirestoreClient(failures=2), COLLECTION, max_workers=1).set_documents(documents(10))
+
+    assert (stats["written"], stats["failed"]) == (10, 0)
+    assert stored() == documents(10)
+
+
+def test_batches_failing_every_attempt_are_reported():
+    writer = FirestoreBulkWriter(FlakyFirestoreClient(failures=3), COLLECTION, batch_size=5, max_workers=1, max_attempts=3)
+    stats = writer.set_documents(documents(10))
+
+    # the first batch fails all three attempts, the second one is written
+    assert (stats["written"], stats["failed"]) == (5, 5)
+    assert len(stats["errors"]) == 1 and "Aborted" in stats["errors"][0]
+    assert len(stored()) == 5
+
+
+def test_non_retryable_errors_are_not_retried():
+    client = FlakyFirestoreClient(failures=1, error=exceptions.PermissionDenied)
+    stats = FirestoreBulkWriter(client, COLLECTION, max_workers=1).set_documents(documents(3))
+
+    assert (stats["written"], stats["failed"]) == (0, 3)
+    assert next(client._calls) == 1
@@ -0,0 +1,147 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rsc.hedging import Deadline, DeadlineExceeded, LatencyTracker, ahedged_call, hedged_call, rpc_timeout
+
+
+def warmed_tracker(stage: str, seconds: float = 0.01, samples: int = 50) -> LatencyTracker:
+    # the stage's p95 is ~seconds, so hedges start once a call takes longer than that
+    tracker = LatencyTracker()
+    for _ in range(samples):
+        tracker.record(stage, seconds)
+    return tracker
+
+
+def sleeper(seconds: float, result):
+    def call():
+        time.sleep(seconds)
+        return result
+    return call
+
+
+def test_deadline():
+    deadline = Deadline(0.05)
+    assert 0 < deadline.remaining() <= 0.05
+    deadline.check("embedding")
+    time.sleep(0.06)
+    assert deadline.expired()
+    assert deadline.remaining() == 0.0
+    with pytest.raises(DeadlineExceeded) as error:
+        deadline.check("firestore")
+    assert error.value.stage == "firestore"
+
+
+def test_rpc_timeout():
+    assert rpc_timeout() == {}
+    assert rpc_timeout(1.5) == {"timeout": 1.5}
+    # an expired deadline still bounds the RPC instead of falling back to the client default
+    assert rpc_timeout(0.0) == {"timeout": 0.0}
+
+
+def test_no_hedge_before_enough_samples():
+    tracker = LatencyTracker()
+    assert hedged_call("llm", sleeper(0.02, "primary"), hedge=sleeper(0, "hedge"), tracker=tracker) == "primary"
+    assert tracker.stats()["llm"]["hedges"] == 0
+    assert tracker.percentile("llm", min_samples=1) >= 0.02
+
+
+def test_slow_primary_is_hedged():
+    tracker = warmed_tracker("vector_search")
+    discarded = []
+    result = hedged_call(
+        "vector_search", sleeper(0.5, "primary"), deadline=Deadline(5), hedge=sleeper(0, "hedge"),
+        tracker=tracker, on_discard=discarded.append,
+    )
+
+    assert result == "hedge"
+    assert tracker.stats()["vector_search"]["hedges"] == 1
+    assert tracker.stats()["vector_search"]["hedge_wins"] == 1
+    # the abandoned primary is handed to on_discard once it finishes
+    time.sleep(0.6)
+    assert discarded == ["primary"]
+
+
+def test_fast_primary_is_not_hedged():
+    tracker = warmed_tracker("firestore", seconds=0.2)
+    hedge_calls = []
+    result = hedged_call("firestore", sleeper(0, "primary"), hedge=lambda: hedge_calls.append(1), tracker=tracker)
+
+    assert result == "primary"
+    assert hedge_calls == []
+    assert tracker.stats()["firestore"]["hedges"] == 0
+
+
+def test_failed_primary_falls_back_to_hedge():
+    def failing():
+        time.sleep(0.05)
+        raise RuntimeError("unavailable")
+
+    tracker = warmed_tracker("llm")
+    assert hedged_call("llm", failing, hedge=sleeper(0.1, "hedge"), tracker=tracker) == "hedge"
+
+
+def test_error_is_raised_when_every_call_fails():
+    def failing():
+        raise RuntimeError("unavailable")
+
+    with pytest.raises(RuntimeError, match="unavailable"):
+        hedged_call("llm", failing, deadline=Deadline(1))
+
+
+def test_deadline_exceeded():
+    tracker = warmed_tracker("embedding")
+    start = time.perf_counter()
+    with pytest.raises(DeadlineExceeded):
+        hedged_call("embedding", sleeper(1, "primary"), deadline=Deadline(0.1), hedge=sleeper(1, "hedge"), tracker=tracker)
+
+    assert time.perf_counter() - start < 0.5
+    assert tracker.stats()["embedding"]["deadline_exceeded"] == 1
+
+
+def test_async_slow_primary_is_hedged_and_cancelled():
+    tracker = warmed_tracker("llm")
+    cancelled = threading.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return "primary"
+
+    async def fast():
+        return "hedge"
+
+    result = asyncio.run(ahedged_call("llm", slow, deadline=Deadline(2), hedge=fast, tracker=tracker))
+    assert result == "hedge"
+    assert cancelled.is_set()
+    assert tracker.stats()["llm"]["hedge_wins"] == 1
+
+
+def test_async_deadline_exceeded():
+    async def slow():
+        await asyncio.sleep(5)
+
+    start = time.perf_counter()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(ahedged_call("firestore", slow, deadline=Deadline(0.1)))
+    assert time.perf_counter() - start < 0.5
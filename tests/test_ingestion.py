@@ -0,0 +1,145 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import itertools
+
+import pytest
+
+from benchmarks import fakes
+from benchmarks.fakes import FakeFirestoreClient, FakeIndexServiceClient, fake_page_text
+from benchmarks.preprocessing_benchmark import blank_pdf
+from rsc.ClientRegistry import get_secrets
+from rsc.IngestionSession import IngestionSession
+
+pytestmark = pytest.mark.usefixtures("gcp_backend")
+
+PAGES = [fake_page_text(page) for page in range(6)]
+
+
+def ingest(session: IngestionSession, pages: list, **kwargs) -> dict:
+    return session(new_file_name="manual.json", file_to_ingest="\n\n".join(pages).encode(), ingest_json=True, **kwargs)
+
+
+def stored_chunks() -> dict:
+    return dict(FakeFirestoreClient.store.get(get_secrets()["FIRESTORE_COLLECTION_NAME"], {}))
+
+
+def test_unchanged_document_is_reused():
+    session = IngestionSession()
+    first = ingest(session, PAGES)
+    upserted = dict(FakeIndexServiceClient.datapoints)
+
+    assert first["reused"] == 0 and first["recomputed"] > 0 and first["removed"] == 0
+    assert set(upserted) == set(stored_chunks())
+    assert all(data["content_hash"] for data in stored_chunks().values())
+
+    requests_before = fakes.FakeTextEmbeddingModel.request_count
+    again = ingest(session, PAGES)
+    assert again == {"reused": first["recomputed"], "recomputed": 0, "removed": 0}
+    assert fakes.FakeTextEmbeddingModel.request_count == requests_before
+
+
+def test_changed_and_removed_chunks():
+    session = IngestionSession()
+    first = ingest(session, PAGES)
+    before = stored_chunks()
+
+    # the last pages are replaced by one short page: the chunks in front stay, the rest is recomputed or removed
+    report = ingest(session, PAGES[:3] + ["A new closing paragraph about the vector search index."])
+    after = stored_chunks()
+
+    assert report["reused"] > 0
+    assert report["recomputed"] >= 1
+    assert report["removed"] == first["recomputed"] - report["reused"] - report["recomputed"]
+    assert report["removed"] > 0
+    assert len(after) == report["reused"] + report["recomputed"]
+    assert set(FakeIndexServiceClient.datapoints) == set(after)
+    for chunk_id, data in after.items():
+        if chunk_id in before and data["content_hash"] == before[chunk_id]["content_hash"]:
+            assert data["page_content"] == before[chunk_id]["page_content"]
+    assert any("new closing paragraph" in data["page_content"] for data in after.values())
+
+
+def test_full_ingestion_recomputes_everything():
+    session = IngestionSession()
+    first = ingest(session, PAGES)
+    assert ingest(session, PAGES, incremental=False) == {"reused": 0, "recomputed": first["recomputed"], "removed": 0}
+
+
+def test_failed_upsert_is_recomputed_on_the_next_run(monkeypatch):
+    session = IngestionSession()
+    monkeypatch.setitem(fakes.ERROR_RATES, "vector_upsert", 1.0)
+    with pytest.raises(RuntimeError):
+        ingest(session, PAGES)
+    # chunk documents were written, but not marked as up to date
+    assert stored_chunks()
+    assert not any(data.get("content_hash") for data in stored_chunks().values())
+
+    monkeypatch.delitem(fakes.ERROR_RATES, "vector_upsert")
+    report = ingest(session, PAGES)
+    assert report["reused"] == 0
+    assert set(FakeIndexServiceClient.datapoints) == set(stored_chunks())
+
+
+def test_streaming_pdf_reingestion(monkeypatch):
+    # the fake OCR text depends on the request count, so both runs OCR the page groups in the same order
+    session = IngestionSession(pages_per_ocr_request=2, ocr_concurrency=1)
+    pdf = blank_pdf(6)
+    monkeypatch.setattr(fakes.FakeDocumentProcessorServiceClient, "_calls", itertools.count())
+    first = session(new_file_name="scan.pdf", file_to_ingest=pdf, ingest_pdf=True, streaming=True)
+    monkeypatch.setattr(fakes.FakeDocumentProcessorServiceClient, "_calls", itertools.count())
+    again = session(new_file_name="scan.pdf", file_to_ingest=pdf, ingest_pdf=True, streaming=True)
+
+    assert first["recomputed"] > 0
+    assert (again["reused"], again["recomputed"], again["removed"]) == (first["recomputed"], 0, 0)
+    assert set(again["stages"]) == {"ocr", "chunking", "embedding", "sink"}
+
+
+def test_reingestion_keeps_documents_sharing_the_id_prefix():
+    session = IngestionSession()
+    session(new_file_name="a.pdf", file_to_ingest=b"", ingest_pdf=True, document_text="\n\n".join(PAGES))
+    session(new_file_name="a-chunky.pdf", file_to_ingest=b"", ingest_pdf=True, document_text="\n\n".join(PAGES))
+    chunky = {chunk_id for chunk_id in stored_chunks() if chunk_id.startswith("a-chunky-chunk")}
+
+    report = session(new_file_name="a.pdf", file_to_ingest=b"", ingest_pdf=True, document_text=PAGES[0])
+
+    assert report["removed"] > 0
+    assert chunky and chunky <= set(stored_chunks())
+    assert chunky <= set(FakeIndexServiceClient.datapoints)
+
+
+def test_notion_reingestion_keeps_databases_sharing_the_id_prefix():
+    session = IngestionSession()
+    pages = [[PAGES[0]], [PAGES[1]]]
+    session(new_file_name="wiki", ingest_notion_database=True, data_to_ingest=pages, notion_page_titles=["Intro", "Setup"])
+    session(new_file_name="wiki: archive", ingest_notion_database=True, data_to_ingest=pages, notion_page_titles=["Intro", "Setup"])
+
+    report = session(new_file_name="wiki", ingest_notion_database=True, data_to_ingest=pages[:1], notion_page_titles=["Intro"])
+
+    assert (report["reused"], report["removed"]) == (1, 1)
+    assert set(stored_chunks()) == {"wiki: Intro-chunk0", "wiki: archive: Intro-chunk0", "wiki: archive: Setup-chunk0"}
+
+
+def test_backfill_lexical_index():
+    session = IngestionSession()
+    collection = session.firestore_client.collection(get_secrets()["FIRESTORE_COLLECTION_NAME"])
+    for idx in range(5):
+        collection.document(f"old-chunk{idx}").set({"id": f"old-chunk{idx}", "page_content": f"error code E{idx}00 of the pump"})
+    assert len(session.lexical_index) == 0
+
+    assert session.backfill_lexical_index(batch_size=2) == 5
+    assert len(session.lexical_index) == 5
+    ids, _ = session.lexical_index.search("E300", num_results=1)
+    assert ids == ["old-chunk3"]
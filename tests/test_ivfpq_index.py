@@ -0,0 +1,130 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+import pytest
+
+from rsc.IVFPQIndex import IVFPQIndex
+from rsc.LocalVectorIndex import LocalVectorIndex
+
+DIMENSIONS = 64
+SIZE = 4000
+NLIST = 16
+K = 10
+
+
+def clustered_vectors(size: int, rng) -> np.ndarray:
+    centers = rng.standard_normal((40, DIMENSIONS)).astype(np.float32)
+    return centers[rng.integers(0, len(centers), size)] + 0.5 * rng.standard_normal((size, DIMENSIONS)).astype(np.float32)
+
+
+@pytest.fixture
+def indexes(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = clustered_vectors(SIZE, rng)
+    datapoints = [(f"doc-chunk{idx}", vector) for idx, vector in enumerate(vectors)]
+
+    exact = LocalVectorIndex(str(tmp_path / "exact"))
+    ivfpq = IVFPQIndex(str(tmp_path / "ivfpq"), nlist=NLIST, nprobe=4, subquantizers=16, train_size=SIZE)
+    exact.upsert(datapoints)
+    ivfpq.upsert(datapoints)
+
+    queries = vectors[rng.choice(SIZE, 50)] + 0.1 * rng.standard_normal((50, DIMENSIONS)).astype(np.float32)
+    return exact, ivfpq, queries
+
+
+def recall(exact, ivfpq, queries, **search_kwargs) -> float:
+    expected = [ids for ids, _ in exact.search(queries, K)]
+    found = [ids for ids, _ in ivfpq.search(queries, K, **search_kwargs)]
+    return float(np.mean([len(set(f) & set(e)) / K for f, e in zip(found, expected)]))
+
+
+def test_trained_on_reaching_train_size(indexes):
+    _, ivfpq, _ = indexes
+    assert ivfpq.is_trained
+    memory = ivfpq.memory_bytes()
+    assert memory["ivfpq"] < memory["flat"] / 4
+
+
+def test_recall_against_exact_search(indexes):
+    exact, ivfpq, queries = indexes
+    assert recall(exact, ivfpq, queries) >= 0.9
+    # probing every list leaves only the quantization error, which re-ranking removes
+    assert recall(exact, ivfpq, queries, nprobe=NLIST) >= 0.98
+
+
+def test_scores_are_exact_cosine_similarities(indexes):
+    exact, ivfpq, queries = indexes
+    ids, scores = ivfpq.search(queries[:1], K, nprobe=NLIST)[0]
+    exact_scores = dict(zip(*exact.search(queries[:1], SIZE)[0]))
+
+    assert scores == sorted(scores, reverse=True)
+    assert scores == pytest.approx([exact_scores[i] for i in ids], abs=1e-5)
+
+
+def test_rows_added_after_training_and_deletes(indexes):
+    exact, ivfpq, queries = indexes
+    new_vectors = queries[:5] * 3
+    ivfpq.upsert([(f"new-{idx}", vector) for idx, vector in enumerate(new_vectors)])
+
+    # a vector is its own nearest neighbour, encoded or not
+    for idx, vector in enumerate(new_vectors):
+        assert ivfpq.search(vector[None, :], 1)[0][0] == [f"new-{idx}"]
+
+    removed = [ids[0] for ids, _ in ivfpq.search(queries[5:10], 1)]
+    ivfpq.remove(removed)
+    for ids, _ in ivfpq.search(queries, K, nprobe=NLIST):
+        assert not set(ids) & set(removed)
+
+
+def test_reopened_index_keeps_its_quantizers(indexes, tmp_path):
+    exact, ivfpq, queries = indexes
+    reopened = IVFPQIndex(str(tmp_path / "ivfpq"), nlist=NLIST, nprobe=4, subquantizers=16, train_size=SIZE)
+
+    assert reopened.is_trained
+    assert [ids for ids, _ in reopened.search(queries, K)] == [ids for ids, _ in ivfpq.search(queries, K)]
+
+
+def test_untrained_index_searches_exactly(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = clustered_vectors(100, rng)
+    datapoints = [(f"doc-chunk{idx}", vector) for idx, vector in enumerate(vectors)]
+    exact = LocalVectorIndex(str(tmp_path / "exact"))
+    ivfpq = IVFPQIndex(str(tmp_path / "ivfpq"), nlist=NLIST, subquantizers=16, train_size=1000)
+    exact.upsert(datapoints)
+    ivfpq.upsert(datapoints)
+
+    assert not ivfpq.is_trained
+    assert recall(exact, ivfpq, vectors[:20]) == 1.0
+
+
+def test_append_after_an_interrupted_encoding(indexes, tmp_path):
+    _, ivfpq, queries = indexes
+    path = tmp_path / "ivfpq"
+    # the codes of one row plus part of the next, written without their lists
+    with open(path / "codes.u8", "ab") as f:
+        f.write(bytes(16 + 5))
+
+    reopened = IVFPQIndex(str(path), nlist=NLIST, nprobe=4, subquantizers=16, train_size=SIZE)
+    new_vectors = queries[:5] * 3
+    reopened.upsert([(f"new-{idx}", vector) for idx, vector in enumerate(new_vectors)])
+
+    reopened = IVFPQIndex(str(path), nlist=NLIST, nprobe=4, subquantizers=16, train_size=SIZE)
+    assert len(reopened._codes) == len(reopened._lists) == SIZE + 5
+    lists, codes = reopened._encode(np.asarray(reopened._matrix, dtype=np.float32))
+    np.testing.assert_array_equal(reopened._lists, lists)
+    np.testing.assert_array_equal(reopened._codes, codes)
+    for idx, vector in enumerate(new_vectors):
+        assert reopened.search(vector[None, :], 1)[0][0] == [f"new-{idx}"]
@@ -0,0 +1,114 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import math
+import random
+from collections import Counter
+
+import pytest
+
+from rsc.LexicalIndex import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+VOCABULARY = [f"term{i}" for i in range(60)]
+
+
+def random_documents(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    # skewed term distribution, so posting lists range from a few rows to most of the index
+    weights = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+    return [
+        (f"doc-{i}", " ".join(rng.choices(VOCABULARY, weights=weights, k=rng.randint(3, 60))))
+        for i in range(count)
+    ]
+
+
+def brute_force_bm25(documents: list, query: str, k1: float = 1.2, b: float = 0.75) -> dict:
+    # {id: score} of every matching document, scored exhaustively
+    tokenized = {doc_id: Counter(tokenize(text)) for doc_id, text in documents}
+    lengths = {doc_id: sum(terms.values()) for doc_id, terms in tokenized.items()}
+    average_length = sum(lengths.values()) / len(lengths)
+    scores = {}
+    for term in dict.fromkeys(tokenize(query)):
+        containing = [doc_id for doc_id, terms in tokenized.items() if term in terms]
+        idf = math.log(1 + (len(tokenized) - len(containing) + 0.5) / (len(containing) + 0.5))
+        for doc_id in containing:
+            frequency = tokenized[doc_id][term]
+            scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (k1 + 1) / (
+                frequency + k1 * (1 - b + b * lengths[doc_id] / average_length)
+            )
+    return scores
+
+
+def assert_top_k(index: LexicalIndex, documents: list, query: str, k: int) -> None:
+    expected = brute_force_bm25(documents, query)
+    ids, scores = index.search(query, num_results=k)
+    top_scores = sorted(expected.values(), reverse=True)[:k]
+
+    assert len(ids) == len(top_scores)
+    assert scores == pytest.approx(top_scores, rel=1e-4)
+    # ids may only differ among documents with tied scores
+    for doc_id, score in zip(ids, scores):
+        assert expected[doc_id] == pytest.approx(score, rel=1e-4)
+
+
+@pytest.mark.parametrize("k", [1, 5, 10, 50])
+def test_maxscore_top_k_matches_brute_force(tmp_path, k):
+    documents = random_documents(500)
+    index = LexicalIndex(path=str(tmp_path))
+    index.upsert(documents)
+
+    rng = random.Random(k)
+    for _ in range(20):
+        query = " ".join(rng.sample(VOCABULARY, rng.randint(1, 6)))
+        assert_top_k(index, documents, query, k)
+
+
+def test_search_after_replace_and_remove(tmp_path):
+    documents = random_documents(200, seed=1)
+    index = LexicalIndex(path=str(tmp_path))
+    index.upsert(documents)
+
+    replaced = [(doc_id, "term59 term59 term58") for doc_id, _ in documents[:10]]
+    index.upsert(replaced)
+    removed = [doc_id for doc_id, _ in documents[10:150]]
+    index.remove(removed)
+
+    remaining = replaced + documents[150:]
+    assert len(index) == len(remaining)
+    for query in ("term59", "term0 term1 term58", "term3 term7"):
+        assert_top_k(index, remaining, query, 10)
+    assert not set(index.search("term0 term1 term2", num_results=200)[0]) & set(removed)
+
+
+def test_index_is_reloaded_from_its_log(tmp_path):
+    documents = random_documents(100, seed=2)
+    LexicalIndex(path=str(tmp_path)).upsert(documents)
+
+    reopened = LexicalIndex(path=str(tmp_path))
+    assert len(reopened) == len(documents)
+    assert_top_k(reopened, documents, "term2 term9", 10)
+
+
+def test_search_without_matches(tmp_path):
+    index = LexicalIndex(path=str(tmp_path))
+    assert index.search("anything") == ([], [])
+    index.upsert([("doc-0", "vector search index")])
+    assert index.search("unrelated words") == ([], [])
+
+
+def test_reciprocal_rank_fusion_prefers_ids_ranked_by_both():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a", "d"]])
+    assert fused[:2] == ["a", "c"]
+    assert set(fused) == {"a", "b", "c", "d"}
@@ -0,0 +1,48 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import threading
+
+from rsc import LLMBackends
+from rsc.LLMBackends import EchoBackend, get_llm_backend, llm_backend_stats, register_llm_backend
+
+
+def test_stats_while_backends_are_created(monkeypatch):
+    monkeypatch.setattr(LLMBackends, "_created_backends", {})
+    names = [f"echo-{idx}" for idx in range(200)]
+    for name in names:
+        monkeypatch.setitem(LLMBackends.LLM_BACKENDS, name, lambda name=name: EchoBackend(name))
+
+    creating = threading.Thread(target=lambda: [get_llm_backend(name) for name in names])
+    creating.start()
+    while creating.is_alive():
+        assert set(llm_backend_stats()) <= set(names)
+    creating.join()
+
+    stats = llm_backend_stats()
+    assert set(stats) == set(names)
+    assert stats["echo-0"]["requests"] == 0
+
+
+def test_registered_backend_replaces_the_shared_one(monkeypatch):
+    monkeypatch.setattr(LLMBackends, "_created_backends", {})
+    monkeypatch.setitem(LLMBackends.LLM_BACKENDS, "echo-test", lambda: EchoBackend("echo-test"))
+    first = get_llm_backend("echo-test")
+    assert get_llm_backend("echo-test") is first
+
+    register_llm_backend("echo-test", lambda: EchoBackend("echo-test", first_token_seconds=0.5))
+    replaced = get_llm_backend("echo-test")
+    assert replaced is not first and replaced.first_token_seconds == 0.5
+    assert llm_backend_stats()["echo-test"] == replaced.stats()
@@ -0,0 +1,85 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+
+from rsc.LocalVectorIndex import LocalVectorIndex
+
+
+def test_upsert_find_and_remove(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    index.upsert([("a", [1, 0, 0]), ("b", [0, 1, 0]), ("c", [1, 1, 0])])
+
+    assert len(index) == 3
+    assert index.find_matches([1, 0, 0], num_neighbors=2) == ["a", "c"]
+    assert index.find_matches([0, 0, 1]) == []
+
+    index.remove(["c", "missing"])
+    assert index.find_matches([1, 0, 0], num_neighbors=2) == ["a"]
+
+
+def test_replaced_ids_keep_their_latest_vector(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    index.upsert([("a", [1, 0, 0]), ("b", [0, 1, 0])])
+    index.upsert([("a", [0, 0, 1])])
+
+    assert len(index) == 2
+    assert index.find_matches([0, 0, 1]) == ["a"]
+    assert index.find_matches([1, 0, 0]) == []
+    np.testing.assert_allclose(index.get_vectors(["a", "missing"]), [[0, 0, 1], [0, 0, 0]])
+
+
+def test_reopen_and_compaction(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    index.upsert([(f"id{idx}", np.eye(4)[idx % 4] + idx / 100) for idx in range(8)])
+    index.remove([f"id{idx}" for idx in range(5)])
+
+    reopened = LocalVectorIndex(str(tmp_path))
+    assert len(reopened) == 3
+    assert reopened.find_matches(np.eye(4)[3] + 0.07, num_neighbors=1) == ["id7"]
+    assert (tmp_path / "ids.txt").read_text().split() == ["id5", "id6", "id7"]
+
+
+def test_append_after_an_interrupted_write(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    index.upsert([("a", [1, 0, 0]), ("b", [0, 1, 0])])
+    # the vector row of an upsert that stopped before its id was written
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(np.asarray([1, 0, 0], dtype=np.float32).tobytes())
+
+    index = LocalVectorIndex(str(tmp_path))
+    index.upsert([("c", [0, 0, 1])])
+    assert index.find_matches([0, 0, 1]) == ["c"]
+
+    reopened = LocalVectorIndex(str(tmp_path))
+    assert reopened.find_matches([0, 0, 1]) == ["c"]
+    assert reopened.find_matches([1, 0, 0]) == ["a"]
+
+
+def test_cut_off_id_is_ignored(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    index.upsert([("a", [1, 0, 0])])
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(np.asarray([0, 1, 0], dtype=np.float32).tobytes())
+    with open(tmp_path / "ids.txt", "a", encoding="utf-8") as f:
+        f.write("bb")
+
+    index = LocalVectorIndex(str(tmp_path))
+    assert len(index) == 1
+    index.upsert([("b", [0, 1, 0])])
+
+    reopened = LocalVectorIndex(str(tmp_path))
+    assert (tmp_path / "ids.txt").read_text() == "a\nb\n"
+    assert reopened.find_matches([0, 1, 0]) == ["b"]
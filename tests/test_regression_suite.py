@@ -0,0 +1,86 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import os
+
+import pytest
+from google.api_core import exceptions
+
+from benchmarks import fakes, regression_suite
+from benchmarks.regression_suite import compare_results, load_baseline, parse_error_rates, percentiles
+
+
+def result(commit: str, **metrics) -> dict:
+    return {"commit": commit, "timestamp": "2024-01-01T00:00:00+00:00", "scenarios": {"deletion": {"metrics": metrics}}}
+
+
+def test_percentiles():
+    stats = percentiles([float(value) for value in range(1, 101)])
+    assert stats == {"p50_seconds": 51.0, "p95_seconds": 95.0, "p99_seconds": 99.0}
+
+
+def test_only_slower_seconds_metrics_are_regressions():
+    baseline = result("abc", total_seconds=1.0, p95_seconds=2.0, chunks=10)
+    baseline["scenarios"]["ingest_pdf"] = {"metrics": {"total_seconds": 0.0}}
+    current = result("def", total_seconds=1.05, p95_seconds=2.5, chunks=20, mean_seconds=9.0)
+    current["scenarios"]["ingest_pdf"] = {"metrics": {"total_seconds": 5.0}}
+
+    # chunks is no latency, mean_seconds & the zero baseline have nothing to compare with
+    regressions = compare_results(current, baseline, threshold=0.1)
+    assert [(scenario, metric) for scenario, metric, _ in regressions] == [("deletion", "p95_seconds")]
+    assert regressions[0][2] == pytest.approx(0.25)
+
+
+def test_baseline_is_the_latest_result_of_another_commit(tmp_path, monkeypatch):
+    monkeypatch.setattr(regression_suite, "RESULTS_DIR", str(tmp_path))
+    assert load_baseline(None, "current") is None
+
+    for mtime, commit in enumerate(("older", "newer", "current")):
+        (tmp_path / f"{commit}.json").write_text(json.dumps(result(commit)))
+        os.utime(tmp_path / f"{commit}.json", (mtime, mtime))
+    assert load_baseline(None, "current")["commit"] == "newer"
+    assert load_baseline(str(tmp_path / "older.json"), "current")["commit"] == "older"
+    assert load_baseline("missing", "current") is None
+
+
+def test_parse_error_rates():
+    assert parse_error_rates(None) == regression_suite.DEFAULT_ERROR_RATES
+    assert parse_error_rates(["firestore_commit=0.5", "vector_upsert=0"]) == {"firestore_commit": 0.5, "vector_upsert": 0.0}
+
+
+def test_suite_exit_code(tmp_path, no_latency):
+    args = ["--scenarios", "deletion", "--repeat", "1", "--pages", "3", "--error-rate", "firestore_commit=0", "--no-save"]
+    faster = tmp_path / "faster.json"
+    faster.write_text(json.dumps(result("faster", total_seconds=1e-9)))
+    slower = tmp_path / "slower.json"
+    slower.write_text(json.dumps(result("slower", total_seconds=1e9)))
+
+    assert regression_suite.main(args + ["--compare", str(faster)]) == 1
+    assert regression_suite.main(args + ["--compare", str(slower)]) == 0
+
+
+def test_fake_calls_slower_than_their_timeout(no_latency, monkeypatch):
+    monkeypatch.setitem(fakes.LATENCIES, "firestore_read", 0.05)
+    with pytest.raises(exceptions.DeadlineExceeded):
+        fakes.simulate_latency("firestore_read", timeout=0.01)
+    fakes.simulate_latency("firestore_read", timeout=1.0)
+
+
+def test_service_profile_injects_errors(no_latency):
+    with fakes.fake_service_profile(error_rates={"firestore_commit": 1.0}):
+        with pytest.raises(exceptions.ServiceUnavailable):
+            fakes.simulate_latency("firestore_commit")
+    fakes.simulate_latency("firestore_commit")
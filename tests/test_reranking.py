@@ -0,0 +1,46 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+
+from rsc.Reranking import maximal_marginal_relevance
+
+QUERY = [1.0, 0.0, 0.0]
+# two near-identical passages close to the query, then a different one
+CANDIDATES = [[0.9, 0.1, 0.0], [0.9, 0.11, 0.0], [0.6, 0.0, 0.8], [0.0, 1.0, 0.0]]
+
+
+def test_pure_relevance_ranks_by_similarity():
+    assert maximal_marginal_relevance(QUERY, CANDIDATES, k=4, lambda_mult=1.0) == [0, 1, 2, 3]
+
+
+def test_diversity_skips_the_near_duplicate():
+    assert maximal_marginal_relevance(QUERY, CANDIDATES, k=2, lambda_mult=0.5) == [0, 2]
+
+
+def test_duplicates_are_dropped():
+    selected = maximal_marginal_relevance(QUERY, CANDIDATES, k=4, lambda_mult=1.0, duplicate_thresh=0.99)
+    assert selected == [0, 2, 3]
+
+
+def test_scale_invariance():
+    scaled = np.asarray(CANDIDATES) * [[1], [10], [0.1], [3]]
+    assert maximal_marginal_relevance(np.asarray(QUERY) * 5, scaled, k=3) == maximal_marginal_relevance(QUERY, CANDIDATES, k=3)
+
+
+def test_edge_cases():
+    assert maximal_marginal_relevance(QUERY, [], k=3) == []
+    assert maximal_marginal_relevance(QUERY, CANDIDATES, k=0) == []
+    assert sorted(maximal_marginal_relevance(QUERY, CANDIDATES, k=10)) == [0, 1, 2, 3]
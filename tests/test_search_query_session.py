@@ -0,0 +1,143 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import time
+
+import pytest
+
+from benchmarks import fakes
+from rsc.LexicalIndex import LexicalIndex
+from rsc.SearchQuerySession import SearchQuerySession
+
+pytestmark = pytest.mark.usefixtures("gcp_backend")
+
+
+def store_chunks(session: SearchQuerySession, count: int) -> None:
+    for idx in range(count):
+        session.firestore_client.collection(session.firestore_collection_name).document(f"doc-chunk{idx}").set(
+            {"id": f"doc-chunk{idx}", "page_content": f"text {idx}", "document_name": "doc.pdf", "content_hash": "abc"}
+        )
+
+
+def count_reads(session: SearchQuerySession, monkeypatch) -> list:
+    calls = []
+    get_all = session.firestore_client.get_all
+
+    def counting_get_all(references, **kwargs):
+        calls.append(len(references))
+        return get_all(references, **kwargs)
+
+    monkeypatch.setattr(session.firestore_client, "get_all", counting_get_all)
+    return calls
+
+
+def test_matched_chunks_are_fetched_in_one_read(monkeypatch):
+    session = SearchQuerySession(model_name="gemini-1.5-flash")
+    store_chunks(session, 5)
+    calls = count_reads(session, monkeypatch)
+
+    docs, missing_ids = session._get_doc_from_firestore(["doc-chunk3", "doc-chunk0", "doc-chunk4"])
+
+    assert calls == [3]
+    assert [doc["id"] for doc in docs] == ["doc-chunk3", "doc-chunk0", "doc-chunk4"]
+    assert missing_ids == []
+    # only the prompt fields are read
+    assert docs[1] == {"id": "doc-chunk0", "page_content": "text 0", "document_name": "doc.pdf"}
+
+
+def test_missing_and_duplicate_ids(monkeypatch):
+    session = SearchQuerySession(model_name="gemini-1.5-flash")
+    store_chunks(session, 2)
+    calls = count_reads(session, monkeypatch)
+
+    docs, missing_ids = session._get_doc_from_firestore(["doc-chunk1", "gone-chunk0", "doc-chunk1", "doc-chunk0"])
+
+    assert calls == [3]
+    assert [doc["id"] for doc in docs] == ["doc-chunk1", "doc-chunk1", "doc-chunk0"]
+    assert missing_ids == ["gone-chunk0"]
+
+
+def test_async_fetch_matches_the_sync_fetch():
+    session = SearchQuerySession(model_name="gemini-1.5-flash")
+    store_chunks(session, 3)
+    matched_ids = ["doc-chunk2", "gone-chunk0", "doc-chunk0"]
+
+    assert asyncio.run(session._aget_doc_from_firestore(matched_ids)) == session._get_doc_from_firestore(matched_ids)
+
+
+def test_stream_time_to_first_token_excludes_the_consumer():
+    session = SearchQuerySession(model_name="gemini-1.5-flash")
+    store_chunks(session, 3)
+
+    answer = session.stream(client_query="What is in the document?")
+    first_token = answer.timings["time_to_first_token_seconds"]
+    time.sleep(0.2)
+    text = "".join(answer)
+
+    assert text == answer.text and text
+    assert answer.timings["retrieval_seconds"] <= first_token < 0.2
+    assert answer.timings["total_seconds"] >= 0.2
+
+
+def test_aquery_prompts_with_the_retrieved_context(monkeypatch):
+    session = SearchQuerySession(model_name="gemini-1.5-flash")
+    store_chunks(session, 3)
+    contexts = []
+    llm_session = session._llm_session
+
+    def recording_llm_session(client_query, context, image=None, model_name=None):
+        contexts.append(context["content"])
+        return llm_session(client_query, context, image, model_name)
+
+    monkeypatch.setattr(session, "_llm_session", recording_llm_session)
+    answer, sources = asyncio.run(session.aquery(client_query="What is in the document?"))
+
+    assert answer["text"]
+    assert contexts and all(content is not None for content in contexts)
+
+
+def test_aquery_loads_the_embedding_model_off_the_event_loop(monkeypatch):
+    monkeypatch.setattr(fakes.FakeTextEmbeddingModel, "load_latency", 0.3)
+    session = SearchQuerySession(model_name="gemini-1.5-flash")
+    store_chunks(session, 3)
+
+    async def longest_stall() -> float:
+        ticks = [time.perf_counter()]
+
+        async def ticker():
+            while True:
+                await asyncio.sleep(0.01)
+                ticks.append(time.perf_counter())
+
+        ticking = asyncio.create_task(ticker())
+        await session.aquery(client_query="What is in the document?")
+        ticking.cancel()
+        return max(later - earlier for earlier, later in zip(ticks, ticks[1:]))
+
+    assert asyncio.run(longest_stall()) < 0.2
+
+
+def test_hybrid_retrieval_skips_an_empty_lexical_index():
+    session = SearchQuerySession(model_name="gemini-1.5-flash", retrieval_mode="hybrid")
+    timings = {}
+    assert session._add_lexical_matches("error E1234", ["a-chunk0", "b-chunk0"], timings) == ["a-chunk0", "b-chunk0"]
+    assert "lexical_search" not in timings
+
+    # indexed by another process
+    LexicalIndex(session.lexical_index.path).upsert([("c-chunk0", "error E1234 means the disk is full")])
+    matched_ids = session._add_lexical_matches("error E1234", ["a-chunk0", "b-chunk0"], timings)
+    assert "c-chunk0" in matched_ids
+    assert "fusion" in timings
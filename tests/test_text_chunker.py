@@ -0,0 +1,60 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import random
+
+import pytest
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from benchmarks.fakes import fake_page_text
+from rsc.TextChunker import DEFAULT_SEPARATORS, TextChunker
+
+
+def sample_texts() -> list:
+    rng = random.Random(0)
+    texts = ["", "   ", "short text", "x" * 5000, "Sentence one. Sentence two! Question? " * 80]
+    for doc in range(30):
+        text = "\n".join(fake_page_text(f"{doc}-{page}") for page in range(rng.randint(1, 5)))
+        if doc % 5 == 0:
+            text = text.replace(" ", "")  # no word boundaries, e.g. OCR noise
+        if doc % 7 == 0:
+            text = text.replace("\n", "\n\n")
+        texts.append(text)
+    return texts
+
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(1000, 50), (1000, 200), (300, 0), (100, 99), (40, 10)])
+def test_chunks_match_recursive_character_text_splitter(chunk_size, chunk_overlap):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=DEFAULT_SEPARATORS)
+    chunker = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    for text in sample_texts():
+        assert chunker.split_text(text) == splitter.split_text(text)
+
+
+def test_create_chunks_copies_metadata():
+    chunks = TextChunker(chunk_size=100, chunk_overlap=0).create_chunks(
+        [fake_page_text(0), fake_page_text(1)], [{"document_name": "a"}, {"document_name": "b"}]
+    )
+
+    assert {chunk.metadata["document_name"] for chunk in chunks} == {"a", "b"}
+    chunks[0].metadata["chunk_identifier"] = "a-chunk0"
+    assert "chunk_identifier" not in chunks[1].metadata
+    assert all(len(chunk.page_content) <= 100 for chunk in chunks)
+
+
+def test_overlap_larger_than_chunk_size_is_rejected():
+    with pytest.raises(ValueError):
+        TextChunker(chunk_size=100, chunk_overlap=101)
@@ -0,0 +1,180 @@
+# Copyright 2024 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import math
+import random
+import threading
+
+import pytest
+
+from rsc import tracing
+from rsc.IngestionPipeline import IngestionPipeline
+from rsc.tracing import PERCENTILES, LatencyHistogram, Tracer
+
+
+def exact_percentile(values: list, percentile: float) -> float:
+    # nearest rank
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percentile / 100 * len(ordered)), 1) - 1]
+
+
+def test_histogram_percentiles_within_relative_error():
+    rng = random.Random(0)
+    # log-normal latencies from ~0.1ms to seconds, plus a slow tail
+    values = [rng.lognormvariate(math.log(0.02), 1.5) for _ in range(20000)] + [rng.uniform(5, 30) for _ in range(50)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+
+    for percentile in PERCENTILES + (1, 25, 75):
+        assert histogram.percentile(percentile) == pytest.approx(exact_percentile(values, percentile), rel=0.016)
+    assert histogram.count == len(values)
+    assert histogram.min == min(values)
+    assert histogram.max == max(values)
+    assert histogram.snapshot()["mean_seconds"] == pytest.approx(sum(values) / len(values))
+
+
+def test_histogram_small_values_are_exact_to_the_microsecond():
+    histogram = LatencyHistogram()
+    for micros in range(1, 101):
+        histogram.record(micros / 1e6)
+    assert histogram.percentile(50) == pytest.approx(50.5e-6)
+    assert histogram.percentile(100) == pytest.approx(100e-6)
+
+
+def test_histogram_merge_equals_recording_everything():
+    rng = random.Random(1)
+    values = [rng.expovariate(10) for _ in range(5000)]
+    merged, first, second = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for idx, value in enumerate(values):
+        merged.record(value)
+        (first if idx % 2 else second).record(value)
+    first.merge(second)
+
+    assert first.counts == merged.counts
+    assert first.snapshot() == pytest.approx(merged.snapshot())
+
+
+def test_empty_histogram():
+    snapshot = LatencyHistogram().snapshot()
+    assert snapshot["count"] == 0
+    assert snapshot["p99_seconds"] == 0.0
+
+
+def test_spans_nest_and_feed_histograms():
+    tracer = Tracer()
+    with tracer.span("query", model="gemini-1.5-flash") as root:
+        with tracer.span("embed"):
+            pass
+        with pytest.raises(ValueError):
+            with tracer.span("llm", model="gemini-1.5-flash"):
+                raise ValueError("boom")
+    tracer.record("llm", 0.25, model="claude3-sonnet")
+
+    spans = {span["name"] + str(span["attributes"].get("model")): span for span in tracer.snapshot()["spans"]}
+    embed, llm, query = spans["embedNone"], spans["llmgemini-1.5-flash"], spans["querygemini-1.5-flash"]
+    assert embed["parent_id"] == llm["parent_id"] == query["span_id"] == root.span_id
+    assert embed["trace_id"] == llm["trace_id"] == query["trace_id"]
+    assert llm["attributes"]["error"] == "ValueError"
+    assert spans["llmclaude3-sonnet"]["parent_id"] is None
+
+    stats = tracer.stats()
+    assert stats["llm"]["count"] == 2
+    assert stats["llm[model=claude3-sonnet]"]["max_seconds"] == 0.25
+    assert set(stats) == {"query", "query[model=gemini-1.5-flash]", "embed", "llm", "llm[model=gemini-1.5-flash]", "llm[model=claude3-sonnet]"}
+
+
+def test_export_writes_histograms_and_spans(tmp_path):
+    tracer = Tracer(export_path=str(tmp_path / "trace.json"))
+    with tracer.span("chunking"):
+        pass
+    with open(tracer.export()) as f:
+        exported = json.load(f)
+
+    assert exported["histograms"]["chunking"]["count"] == 1
+    assert [span["name"] for span in exported["spans"]] == ["chunking"]
+
+
+def wait_for_exports() -> None:
+    for thread in threading.enumerate():
+        if thread.name == "trace-export":
+            thread.join()
+
+
+def test_periodic_export_runs_in_the_background(tmp_path):
+    tracer = Tracer(export_path=str(tmp_path / "trace.json"), export_interval_seconds=0)
+    with tracer.span("chunking"):
+        pass
+    wait_for_exports()
+
+    with open(tmp_path / "trace.json") as f:
+        assert json.load(f)["histograms"]["chunking"]["count"] == 1
+    assert [path.name for path in tmp_path.iterdir()] == ["trace.json"]
+
+
+def test_failing_periodic_export_does_not_fail_the_span(tmp_path, capsys):
+    (tmp_path / "file").write_text("")
+    tracer = Tracer(export_path=str(tmp_path / "file" / "trace.json"), export_interval_seconds=0)
+    with tracer.span("chunking"):
+        pass
+    wait_for_exports()
+
+    assert tracer.stats()["chunking"]["count"] == 1
+    assert "Trace export" in capsys.readouterr().out
+
+
+def test_concurrent_exports(tmp_path):
+    tracer = Tracer(export_path=str(tmp_path / "trace.json"))
+    with tracer.span("chunking"):
+        pass
+    errors = []
+
+    def export():
+        try:
+            for _ in range(20):
+                tracer.export()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=export) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with open(tmp_path / "trace.json") as f:
+        assert json.load(f)["histograms"]["chunking"]["count"] == 1
+    assert [path.name for path in tmp_path.iterdir()] == ["trace.json"]
+
+
+def test_pipeline_stage_spans_nest_under_the_caller(monkeypatch):
+    tracer = Tracer()
+    monkeypatch.setattr(tracing, "_tracer", tracer)
+
+    def stage(items):
+        for item in items:
+            with tracing.span("stage_item", thread=threading.current_thread().name):
+                yield item * 2
+
+    with tracing.span("ingest") as root:
+        stats = IngestionPipeline(source=iter(range(5)), stages=[("double", stage), ("again", stage)]).run()
+
+    assert stats["again"]["items_out"] == 5
+    item_spans = [span for span in tracer.snapshot()["spans"] if span["name"] == "stage_item"]
+    assert len(item_spans) == 10
+    assert {span["parent_id"] for span in item_spans} == {root.span_id}
+    assert {span["attributes"]["thread"] for span in item_spans} == {"pipeline-double", "pipeline-again"}